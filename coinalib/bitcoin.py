@@ -28,75 +28,187 @@ import datetime
 import hashlib
 import struct
 
+BLOCK_HEADER_SIZE = 80
 
-def double_sha256(data):
-    return hashlib.sha256(hashlib.sha256(data).digest()).digest()
+_HEADER_STRUCT = struct.Struct("<I32s32s3I")
+_UINT32 = struct.Struct("<I")
 
 
-class BlockHeader(dict):
-    def __init__(self, **params):
-        super().__init__(**params)
-        self._hash_hex = None
+def double_sha256(data):
+    return hashlib.sha256(hashlib.sha256(data).digest()).digest()
 
-    @property
-    def utxo_root(self):
-        return self["utxo_root"]
 
-    @property
-    def block_height(self):
-        return self["block_height"]
+def bits_to_target(bits):
+    """Decode the compact "bits" representation of a proof-of-work target."""
+    if bits & 0x00800000:
+        return 0  # Negative targets are invalid.
+
+    exponent = bits >> 24
+    mantissa = bits & 0x007fffff
+    if exponent <= 3:
+        return mantissa >> (8 * (3 - exponent))
+    return mantissa << (8 * (exponent - 3))
+
+
+def _check_buffer_size(data):
+    if len(data) % BLOCK_HEADER_SIZE:
+        raise ValueError("Data size {} is not a multiple of {}.".format(
+            len(data), BLOCK_HEADER_SIZE))
+
+
+def hash_headers(data):
+    """Return hashes (in internal byte order) of all raw block headers in a contiguous buffer."""
+    _check_buffer_size(data)
+    view = memoryview(data)
+    sha256 = hashlib.sha256
+    return [
+        sha256(sha256(view[offset:offset + BLOCK_HEADER_SIZE]).digest()).digest()
+        for offset in range(0, len(view), BLOCK_HEADER_SIZE)]
+
+
+def _verify_headers(data):
+    view = memoryview(data)
+    sha256 = hashlib.sha256
+    from_bytes = int.from_bytes
+    unpack_from = _UINT32.unpack_from
+    targets = {}
+    hashes = []
+    invalid = []
+    for index, offset in enumerate(range(0, len(view), BLOCK_HEADER_SIZE)):
+        hash_bin = sha256(sha256(view[offset:offset + BLOCK_HEADER_SIZE]).digest()).digest()
+        hashes.append(hash_bin)
+        bits = unpack_from(view, offset + 72)[0]
+        try:
+            target = targets[bits]
+        except KeyError:
+            target = targets[bits] = bits_to_target(bits)
+        if from_bytes(hash_bin, "little") > target:
+            invalid.append(index)
+    return hashes, invalid
+
+
+def verify_headers(data, executor=None, batch_size=2016 * 10):
+    """
+    Hash all raw block headers in a contiguous buffer and check their proof of work.
+
+    Each hash is compared with the target decoded from the header's own bits field. Returns
+    a tuple of a list of hashes and a list of indexes of headers with insufficient work.
+    Ranges larger than batch_size are split into batches and fanned out to executor,
+    e.g. concurrent.futures.ProcessPoolExecutor, if it is provided.
+    """
+    _check_buffer_size(data)
+    count = len(data) // BLOCK_HEADER_SIZE
+    if executor is None or count <= batch_size:
+        return _verify_headers(data)
+
+    step = batch_size * BLOCK_HEADER_SIZE
+    batches = (bytes(data[offset:offset + step]) for offset in range(0, len(data), step))
+    hashes = []
+    invalid = []
+    for batch_hashes, batch_invalid in executor.map(_verify_headers, batches):
+        invalid.extend(len(hashes) + index for index in batch_invalid)
+        hashes.extend(batch_hashes)
+    return hashes, invalid
+
+
+class BlockHeader:
+    """
+    Block header backed by its raw 80-byte serialization.
+
+    Fields are decoded on access. A header can be created either from the raw bytes or from
+    the fields as sent in blockchain.headers.subscribe payloads, e.g. BlockHeader(**payload).
+    """
+    __slots__ = ("_raw", "_hash", "block_height", "utxo_root")
+
+    def __init__(self, raw_bin=None, block_height=None, utxo_root=None, **params):
+        if raw_bin is None:
+            # The hashes are in internal byte order; the other values are all in little-endian
+            # order. https://bitcoin.org/en/developer-reference#block-headers
+            raw_bin = _HEADER_STRUCT.pack(
+                params["version"],
+                binascii.a2b_hex(params["prev_block_hash"].encode("ascii"))[::-1],
+                binascii.a2b_hex(params["merkle_root"].encode("ascii"))[::-1],
+                params["timestamp"],
+                params["bits"],
+                params["nonce"])
+        elif len(raw_bin) != BLOCK_HEADER_SIZE:
+            raise ValueError("Block header must be {} bytes long, not {}.".format(
+                BLOCK_HEADER_SIZE, len(raw_bin)))
+
+        self._raw = bytes(raw_bin)
+        self._hash = None
+        self.block_height = block_height
+        self.utxo_root = utxo_root
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+    def to_dict(self):
+        return {
+            "block_height": self.block_height,
+            "utxo_root": self.utxo_root,
+            "version": self.version,
+            "prev_block_hash": self.prev_block_hash,
+            "merkle_root": self.merkle_root,
+            "timestamp": self.timestamp,
+            "bits": self.bits,
+            "nonce": self.nonce,
+        }
+
+    def __eq__(self, other):
+        if not isinstance(other, BlockHeader):
+            return NotImplemented
+        return self._raw == other._raw and self.block_height == other.block_height
+
+    def __hash__(self):
+        return hash(self._raw)
+
+    def __repr__(self):
+        return "<{}: {} {}>".format(self.__class__.__name__, self.block_height, self.hash_hex)
 
     @property
-    def nonce(self):
-        return self["nonce"]
+    def version(self):
+        return _UINT32.unpack_from(self._raw, 0)[0]
 
     @property
-    def bits(self):
-        return self["bits"]
+    def prev_block_hash(self):
+        return binascii.b2a_hex(self._raw[35:3:-1]).decode("ascii")
 
     @property
     def merkle_root(self):
-        return self["merkle_root"]
-
-    @property
-    def prev_block_hash(self):
-        return self["prev_block_hash"]
+        return binascii.b2a_hex(self._raw[67:35:-1]).decode("ascii")
 
     @property
     def timestamp(self):
-        return self["timestamp"]
+        return _UINT32.unpack_from(self._raw, 68)[0]
 
     @property
     def datetime(self):
         return datetime.datetime.utcfromtimestamp(self.timestamp)
 
     @property
-    def version(self):
-        return self["version"]
+    def bits(self):
+        return _UINT32.unpack_from(self._raw, 72)[0]
+
+    @property
+    def nonce(self):
+        return _UINT32.unpack_from(self._raw, 76)[0]
 
     @property
     def raw_bin(self):
-        # The hashes are in internal byte order; the other values are all in little-endian order.
-        # https://bitcoin.org/en/developer-reference#block-headers
-        return struct.pack(
-            "<I32s32s3I",
-            self.version,
-            binascii.a2b_hex(self.prev_block_hash.encode("ascii"))[::-1],
-            binascii.a2b_hex(self.merkle_root.encode("ascii"))[::-1],
-            self.timestamp,
-            self.bits,
-            self.nonce)
+        return self._raw
 
     @property
     def raw_hex(self):
-        return binascii.b2a_hex(self.raw_bin).decode("ascii")
+        return binascii.b2a_hex(self._raw).decode("ascii")
 
     @property
-    def hash_hex(self):
-        if not self._hash_hex:
-            self._hash_hex = binascii.b2a_hex(double_sha256(self.raw_bin)[::-1]).decode("ascii")
-        return self._hash_hex
+    def hash_bin(self):
+        if self._hash is None:
+            self._hash = double_sha256(self._raw)
+        return self._hash
 
     @property
-    def hash_bin(self):
-        return binascii.a2b_hex(self.hash_hex.encode("ascii"))[::-1]
+    def hash_hex(self):
+        return binascii.b2a_hex(self.hash_bin[::-1]).decode("ascii")
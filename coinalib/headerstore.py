@@ -0,0 +1,132 @@
+# coding: utf-8
+
+# Copyright 2015 Jiří Janoušek <janousek.jiri@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import mmap
+import os
+
+from coinalib.bitcoin import BLOCK_HEADER_SIZE
+from coinalib.bitcoin import BlockHeader
+
+
+class BlockHeaderStore:
+    """
+    Flat file of raw 80-byte block headers indexed by block height.
+
+    Header of block at height N is stored at offset N * 80, so a lookup is just a slice
+    of the memory-mapped file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._file = os.fdopen(fd, "r+b", buffering=0)
+        size = os.fstat(fd).st_size
+        if size % BLOCK_HEADER_SIZE:
+            # Drop an incomplete record left behind by an interrupted write.
+            size -= size % BLOCK_HEADER_SIZE
+            self._file.truncate(size)
+        self._count = size // BLOCK_HEADER_SIZE
+        self._map = None
+        self._mapped = 0
+
+    def __len__(self):
+        return self._count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def height(self):
+        """Height of the last stored header or -1 if the store is empty."""
+        return self._count - 1
+
+    def get_raw(self, height):
+        if not 0 <= height < self._count:
+            raise IndexError("No header at height {}.".format(height))
+
+        offset = height * BLOCK_HEADER_SIZE
+        return self._view()[offset:offset + BLOCK_HEADER_SIZE]
+
+    def get_header(self, height):
+        return BlockHeader(self.get_raw(height), height)
+
+    def get_range(self, start, stop):
+        """Return raw headers of blocks start..stop-1 as a single contiguous buffer."""
+        start = max(start, 0)
+        stop = min(stop, self._count)
+        if start >= stop:
+            return b""
+        return self._view()[start * BLOCK_HEADER_SIZE:stop * BLOCK_HEADER_SIZE]
+
+    def append(self, header):
+        if not isinstance(header, (bytes, bytearray, memoryview)):
+            header = header.raw_bin
+        self.extend(header)
+
+    def extend(self, data):
+        size = len(data)
+        if size % BLOCK_HEADER_SIZE:
+            raise ValueError("Data size {} is not a multiple of {}.".format(
+                size, BLOCK_HEADER_SIZE))
+
+        self._file.seek(self._count * BLOCK_HEADER_SIZE)
+        self._file.write(data)
+        self._count += size // BLOCK_HEADER_SIZE
+
+    def truncate(self, height):
+        """Remove headers of blocks at the given height and above, e.g. after a reorg."""
+        if height < 0:
+            raise ValueError("Height must not be negative.")
+        if height >= self._count:
+            return
+
+        self._unmap()
+        self._file.truncate(height * BLOCK_HEADER_SIZE)
+        self._count = height
+
+    def flush(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._unmap()
+        if not self._file.closed:
+            self._file.close()
+
+    def _view(self):
+        if self._mapped != self._count:
+            self._unmap()
+            self._map = mmap.mmap(
+                self._file.fileno(), self._count * BLOCK_HEADER_SIZE, access=mmap.ACCESS_READ)
+            self._mapped = self._count
+        return self._map
+
+    def _unmap(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+            self._mapped = 0
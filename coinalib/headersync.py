@@ -0,0 +1,193 @@
+# coding: utf-8
+
+# Copyright 2015 Jiří Janoušek <janousek.jiri@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import binascii
+
+from coinalib import stratum
+from coinalib.bitcoin import BLOCK_HEADER_SIZE
+from coinalib.bitcoin import double_sha256
+from coinalib.bitcoin import verify_headers
+from coinalib.stratum import utils
+
+
+class ChainError(ValueError):
+    def __init__(self, height, reason):
+        super().__init__(height, reason)
+        self.height = height
+        self.reason = reason
+
+    def __str__(self):
+        return "Block header at height {}: {}".format(self.height, self.reason)
+
+
+def verify_chain(data, height, prev_raw=None, executor=None):
+    """
+    Check proof of work of raw headers in data and that each of them refers to the hash of
+    the preceding one.
+
+    The first header is checked against prev_raw if it is given.
+    """
+    hashes, invalid = verify_headers(data, executor)
+    if invalid:
+        raise ChainError(height + invalid[0], "Insufficient proof of work.")
+
+    prev_hash = double_sha256(prev_raw) if prev_raw is not None else None
+    for i, offset in enumerate(range(0, len(data), BLOCK_HEADER_SIZE)):
+        if prev_hash is not None and data[offset + 4:offset + 36] != prev_hash:
+            raise ChainError(height + i, "prev_block_hash does not match previous header.")
+        prev_hash = hashes[i]
+
+
+class BlockHeaderSync:
+    """
+    Download block headers in chunks via blockchain.block.get_chunk and append them to a store.
+
+    Up to max_in_flight chunk requests (and chunks waiting to be written) are outstanding
+    at once, so the sync is not bound by one round trip per chunk.
+    """
+    CHUNK_SIZE = 2016
+
+    def __init__(self, client, store, max_in_flight=4, executor=None):
+        self.progress = utils.Event()
+        self.finished = utils.Event()
+        self.failed = utils.Event()
+        self.client = client
+        self.store = store
+        self.max_in_flight = max_in_flight
+        self.executor = executor
+        self.running = False
+        self.tip_height = None
+        self._next_chunk = 0
+        self._last_chunk = 0
+        self._in_flight = set()
+        self._completed = {}
+        self._generation = 0  # Tells responses of a stopped sync apart
+
+    def start(self, tip_height=None):
+        if self.running:
+            raise RuntimeError("Sync is already running.")
+
+        self.running = True
+        self._generation += 1
+        self._in_flight.clear()
+        self._completed.clear()
+        if tip_height is None:
+            self.client.send_request_async(
+                "blockchain.headers.subscribe", [], self._on_tip, self._generation)
+        else:
+            self._begin(tip_height)
+
+    def stop(self):
+        self.running = False
+
+    def _on_tip(self, response, error, generation):
+        if not self.running or generation != self._generation:
+            return
+        if error:
+            self._fail(error)
+        else:
+            self._begin(response.response["block_height"])
+
+    def _begin(self, tip_height):
+        self.tip_height = tip_height
+        self._next_chunk = len(self.store) // self.CHUNK_SIZE
+        self._last_chunk = tip_height // self.CHUNK_SIZE
+        if self.store.height >= tip_height:
+            self._finish()
+        else:
+            self._request_chunks()
+
+    def _request_chunks(self):
+        while self.running and self._next_chunk <= self._last_chunk:
+            if len(self._in_flight) + len(self._completed) >= self.max_in_flight:
+                break
+            index = self._next_chunk
+            self._next_chunk += 1
+            self._in_flight.add(index)
+            self.client.send_request_async(
+                "blockchain.block.get_chunk", [index], self._on_chunk, self._generation, index,
+                priority=stratum.Priority.bulk)
+
+    def _on_chunk(self, response, error, generation, index):
+        if not self.running or generation != self._generation:
+            return
+        self._in_flight.discard(index)
+        if error:
+            self._fail(error)
+            return
+
+        try:
+            data = binascii.a2b_hex(response.response)
+        except (binascii.Error, TypeError, ValueError) as e:
+            self._fail(e)
+            return
+
+        self._completed[index] = data
+        try:
+            self._write_completed()
+        except ChainError as e:
+            self._fail(e)
+            return
+
+        if self.store.height >= self.tip_height:
+            self._finish()
+        else:
+            self._request_chunks()
+            if not self._in_flight:
+                # The server had fewer headers than it announced.
+                self._finish()
+
+    def _write_completed(self):
+        while True:
+            height = len(self.store)
+            index = height // self.CHUNK_SIZE
+            data = self._completed.pop(index, None)
+            if data is None:
+                break
+
+            if len(data) % BLOCK_HEADER_SIZE:
+                raise ChainError(height, "Chunk {} has invalid size.".format(index))
+            if index < self._last_chunk and len(data) != self.CHUNK_SIZE * BLOCK_HEADER_SIZE:
+                raise ChainError(height, "Chunk {} is incomplete.".format(index))
+
+            # Skip headers of a partial chunk that are already stored.
+            data = data[(height - index * self.CHUNK_SIZE) * BLOCK_HEADER_SIZE:]
+            if not data:
+                break
+
+            prev_raw = self.store.get_raw(height - 1) if height else None
+            verify_chain(data, height, prev_raw, self.executor)
+            self.store.extend(data)
+            self.progress.emit(self, self.store.height, self.tip_height)
+
+    def _finish(self):
+        self.running = False
+        self.store.flush()
+        self.finished.emit(self, self.store.height)
+
+    def _fail(self, exception):
+        self.running = False
+        self._completed.clear()
+        self.store.flush()
+        self.failed.emit(self, exception)
@@ -35,3 +35,10 @@ class Protocol(str, enum.Enum):
     @classmethod
     def by_priority(cls):
         return cls.ssl, cls.https, cls.tcp, cls.http
+
+
+class Priority(enum.IntEnum):
+    """Lanes of queued requests, see session.Session.LANE_WEIGHTS."""
+    interactive = 0
+    normal = 1
+    bulk = 2
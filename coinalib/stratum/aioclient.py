@@ -0,0 +1,248 @@
+# coding: utf-8
+
+# Copyright 2015 Jiří Janoušek <janousek.jiri@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import asyncio
+import ssl
+
+from coinalib import stratum
+from coinalib.stratum import codec as m_codec
+from coinalib.stratum import exceptions
+from coinalib.stratum.transports import Notification
+
+_CLOSED = object()
+
+
+class Subscription:
+    """Async iterator over notifications of a single subscription."""
+
+    def __init__(self, client, key, result):
+        self.client = client
+        self.key = key
+        self.result = result
+        self._queue = asyncio.Queue()
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.closed and self._queue.empty():
+            raise StopAsyncIteration
+        notification = await self._queue.get()
+        if notification is _CLOSED:
+            raise StopAsyncIteration
+        return notification
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.client._remove_subscription(self)
+            self._queue.put_nowait(_CLOSED)
+
+    def _push(self, notification):
+        self._queue.put_nowait(notification)
+
+
+class AsyncStratumClient:
+    """
+    Stratum client running over asyncio streams.
+
+    Requests are coroutines resolved by a single reader task, so any number of them can be
+    outstanding on one connection without extra threads.
+    """
+    LINE_LIMIT = 64 * 1024 * 1024
+
+    def __init__(self, peer, timeout=5, codec=None):
+        if peer.protocol not in (stratum.Protocol.tcp, stratum.Protocol.ssl):
+            raise ValueError("Unsupported protocol '{}'.".format(peer.protocol))
+
+        self.peer = peer
+        self.use_ssl = peer.protocol == stratum.Protocol.ssl
+        self.port = peer.port or (50002 if self.use_ssl else 50001)
+        self.timeout = timeout
+        self.codec = codec if codec is not None else m_codec.default_codec
+        self.message_id = 0
+        self._reader = None
+        self._writer = None
+        self._reader_task = None
+        self._pending = {}
+        self._subscriptions = {}
+        self._exception = None
+
+    @property
+    def is_connected(self):
+        return self._reader_task is not None and not self._reader_task.done()
+
+    async def connect(self):
+        if self.use_ssl:
+            # Electrum servers use mostly self-signed certificates.
+            context = ssl.create_default_context()
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        else:
+            context = None
+
+        try:
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(
+                    self.peer.host, self.port, ssl=context, limit=self.LINE_LIMIT),
+                self.timeout)
+        except asyncio.TimeoutError as e:
+            raise exceptions.ConnectionTimeout(self.peer) from e
+        except OSError as e:
+            raise exceptions.ConnectionError(str(e), peer=self.peer) from e
+
+        self._exception = None
+        self._reader_task = asyncio.ensure_future(self._read_loop())
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            try:
+                await self._reader_task
+            except asyncio.CancelledError:
+                pass
+        self._abort(exceptions.ConnectionError("Connection closed.", peer=self.peer))
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def request(self, method, params=None, timeout=None):
+        """Send a request and return its result or raise exceptions.MessageError."""
+        if self._exception is not None:
+            raise self._exception
+        if self._writer is None:
+            raise exceptions.ConnectionError("Not connected.", peer=self.peer)
+
+        self.message_id += 1
+        message_id = self.message_id
+        future = asyncio.get_running_loop().create_future()
+        self._pending[message_id] = future
+        try:
+            self._writer.write(self.codec.encode_request(message_id, method, params or []))
+            await self._writer.drain()
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._pending.pop(message_id, None)
+
+    async def subscribe(self, method, params=None, timeout=None):
+        """
+        Subscribe to notifications and return a Subscription.
+
+        The result of the subscribe request is available as Subscription.result.
+        """
+        params = params or []
+        key = (method, params[0] if params else None)
+        # Register before sending, so that notifications following the response are not lost.
+        subscription = Subscription(self, key, None)
+        self._subscriptions.setdefault(key, []).append(subscription)
+        try:
+            subscription.result = await self.request(method, params, timeout)
+        except BaseException:
+            self._remove_subscription(subscription)
+            raise
+        return subscription
+
+    def _remove_subscription(self, subscription):
+        subscriptions = self._subscriptions.get(subscription.key)
+        if subscriptions and subscription in subscriptions:
+            subscriptions.remove(subscription)
+            if not subscriptions:
+                del self._subscriptions[subscription.key]
+
+    async def _read_loop(self):
+        try:
+            while True:
+                line = await self._reader.readline()
+                if not line:
+                    raise exceptions.ConnectionError(
+                        "Connection closed by peer.", peer=self.peer)
+                if line.strip():
+                    self._process_response(line)
+        except asyncio.CancelledError:
+            raise
+        except (ValueError, OSError) as e:
+            self._abort(exceptions.ConnectionError(str(e), peer=self.peer))
+        except exceptions.StratumError as e:
+            self._abort(e)
+        except Exception as e:
+            # Never leave pending requests waiting for a reader that is gone.
+            self._abort(exceptions.ConnectionError(
+                "Failed to process response: {!r}".format(e), peer=self.peer))
+
+    def _process_response(self, data):
+        try:
+            entries = self.codec.decode(data)
+        except ValueError:
+            raise exceptions.ValueError("Invalid response", data)
+
+        if not isinstance(entries, list):
+            entries = [entries]
+        for entry in entries:
+            if not isinstance(entry, dict):
+                raise exceptions.ValueError("Invalid response", data)
+            message_id = entry.get("id")
+            if message_id is None:
+                self._deliver_notification(Notification(entry.get("method"), entry.get("params")))
+                continue
+
+            if not isinstance(message_id, (int, str)):
+                raise exceptions.ValueError("Invalid message id", data)
+            future = self._pending.get(message_id)
+            if future is None or future.done():
+                continue
+
+            error = entry.get("error")
+            if error:
+                future.set_exception(exceptions.MessageError.from_response(error))
+            else:
+                future.set_result(entry.get("result"))
+
+    def _deliver_notification(self, notification):
+        params = notification.params or []
+        first = params[0] if params and isinstance(params[0], str) else None
+        subscriptions = self._subscriptions.get((notification.method, first))
+        if subscriptions is None and first is not None:
+            subscriptions = self._subscriptions.get((notification.method, None))
+        for subscription in subscriptions or ():
+            subscription._push(notification)
+
+    def _abort(self, exception):
+        if self._exception is None:
+            self._exception = exception
+        pending, self._pending = self._pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(exception)
+        subscriptions, self._subscriptions = self._subscriptions, {}
+        for group in subscriptions.values():
+            for subscription in group:
+                subscription.closed = True
+                subscription._push(_CLOSED)
@@ -0,0 +1,211 @@
+# coding: utf-8
+
+# Copyright 2015 Jiří Janoušek <janousek.jiri@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import collections
+import json
+import sqlite3
+
+from coinalib.stratum import codec as m_codec
+
+# Blocks this deep below the tip are not expected to be reorganized anymore.
+SAFE_DEPTH = 6
+
+
+def _is_final(height, tip_height):
+    return tip_height is not None and isinstance(height, int) \
+        and 0 <= height <= tip_height - SAFE_DEPTH
+
+
+def _raw_transaction(params, cache):
+    # The verbose form contains confirmations. A transaction is cached only once it is buried
+    # in the chain, as learned from a history or merkle response, so that a transaction
+    # dropped from the mempool or reorganized away isn't served from the cache.
+    if not params or len(params) > 2 or len(params) == 2 and params[1]:
+        return False
+    return _is_final(cache.tx_heights.get(params[0]), cache.tip_height)
+
+
+def _final_header(params, cache):
+    return len(params) == 1 and _is_final(params[0], cache.tip_height)
+
+
+def _final_merkle(params, cache):
+    return len(params) == 2 and _is_final(params[1], cache.tip_height)
+
+
+# Methods whose results never change, mapped to a predicate telling whether given params
+# and the state of the cache (the tip and confirmed heights) make the result immutable.
+# Header chunks are left out, the header store already keeps them.
+IMMUTABLE_METHODS = {
+    "blockchain.transaction.get": _raw_transaction,
+    "blockchain.transaction.get_merkle": _final_merkle,
+    "blockchain.block.get_header": _final_header,
+}
+
+
+# Methods returning lists of {"tx_hash": ..., "height": ...} items
+TX_LIST_METHODS = frozenset((
+    "blockchain.address.get_history",
+    "blockchain.address.listunspent",
+))
+
+
+def _estimate_size(result):
+    """Return the approximate number of bytes of a decoded JSON result."""
+    if isinstance(result, str):
+        return len(result)
+    if isinstance(result, dict):
+        return sum(len(key) + _estimate_size(value) for key, value in result.items())
+    if isinstance(result, list):
+        return sum(_estimate_size(item) for item in result)
+    return 8
+
+
+def make_key(method, params):
+    """Return a key identifying a request by its method and canonical params."""
+    return json.dumps([method, params], sort_keys=True, separators=(",", ":"))
+
+
+class ResponseCache:
+    """
+    Least recently used cache of results of immutable requests.
+
+    Up to max_size results taking up to about max_bytes are kept in memory. An optional store
+    keeps all of them on disk.
+    """
+
+    def __init__(self, max_size=10000, store=None, methods=None, max_bytes=16 * 1024 * 1024):
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self.store = store
+        self.methods = methods if methods is not None else IMMUTABLE_METHODS
+        self.tip_height = None
+        self.tx_heights = collections.OrderedDict()  # Confirmed heights of transactions
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+
+    def is_cacheable(self, method, params):
+        predicate = self.methods.get(method)
+        return predicate is not None and predicate(params or [], self)
+
+    def update_tip(self, height):
+        if isinstance(height, int) and (self.tip_height is None or height > self.tip_height):
+            self.tip_height = height
+
+    def update_tx_height(self, tx_hash, height):
+        """Record the height of the block confirming a transaction."""
+        # Heights of unconfirmed transactions are 0 or negative.
+        if not isinstance(tx_hash, str) or not isinstance(height, int) or height <= 0:
+            return
+        heights = self.tx_heights
+        heights[tx_hash] = height
+        heights.move_to_end(tx_hash)
+        while len(heights) > self.max_size:
+            heights.popitem(last=False)
+
+    def observe(self, method, params, result):
+        """Learn confirmed heights of transactions from a response."""
+        if method in TX_LIST_METHODS and isinstance(result, list):
+            for item in result:
+                if isinstance(item, dict):
+                    self.update_tx_height(item.get("tx_hash"), item.get("height"))
+        elif method == "blockchain.transaction.get_merkle" and isinstance(result, dict) \
+                and params:
+            self.update_tx_height(params[0], result.get("block_height"))
+
+    def get(self, key):
+        """Return a cached result or raise KeyError."""
+        entries = self._entries
+        try:
+            result = entries[key][0]
+        except KeyError:
+            if self.store is None:
+                self.misses += 1
+                raise
+            try:
+                result = self.store.get(key)
+            except KeyError:
+                self.misses += 1
+                raise
+            self._add(key, result)
+        else:
+            entries.move_to_end(key)
+        self.hits += 1
+        return result
+
+    def put(self, key, result):
+        self._add(key, result)
+        if self.store is not None:
+            self.store.put(key, result)
+
+    def clear(self):
+        self._entries.clear()
+        self.size_bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _add(self, key, result):
+        entries = self._entries
+        size = len(key) + _estimate_size(result)
+        old = entries.pop(key, None)
+        if old is not None:
+            self.size_bytes -= old[1]
+        if size > self.max_bytes:
+            return  # Would evict everything else
+        entries[key] = (result, size)
+        self.size_bytes += size
+        while len(entries) > self.max_size or self.size_bytes > self.max_bytes:
+            self.size_bytes -= entries.popitem(last=False)[1][1]
+
+
+class SqliteStore:
+    """On-disk store of cached results, so that they survive restarts."""
+
+    def __init__(self, path, codec=None):
+        self.codec = codec if codec is not None else m_codec.default_codec
+        self.connection = sqlite3.connect(path)
+        # The cache can be rebuilt from the network, so durability isn't worth fsyncs.
+        self.connection.execute("PRAGMA synchronous = OFF")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, result BLOB NOT NULL)")
+        self.connection.commit()
+
+    def get(self, key):
+        row = self.connection.execute(
+            "SELECT result FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return self.codec.decode(row[0])
+
+    def put(self, key, result):
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (key, result) VALUES (?, ?)",
+                (key, self.codec.encode(result)))
+
+    def close(self):
+        self.connection.close()
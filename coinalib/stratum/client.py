@@ -23,9 +23,13 @@
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import collections
+import random
 import traceback
 
+from coinalib import stratum
+from coinalib.stratum import cache as m_cache
 from coinalib.stratum import session as m_session
+from coinalib.stratum import subscriptions
 from coinalib.stratum import transports
 from coinalib.stratum import utils
 
@@ -52,8 +56,73 @@ class SyncRequestCallback:
         self.loop.stop()
 
 
+class SharedRequest:
+    """
+    A request whose response is passed to all callers that asked for the same thing meanwhile.
+
+    The request keeps the timeout of the first caller.
+    """
+
+    def __init__(self, client, key, cacheable):
+        self.client = client
+        self.key = key
+        self.cacheable = cacheable
+        self.id = None
+        self.callbacks = []
+
+    def __call__(self, response, error):
+        self._forget()
+        if self.cacheable and not error:
+            self.client.cache.put(self.key, response.response)
+        for callback in self.callbacks:
+            try:
+                callback(response, error)
+            except Exception:
+                traceback.print_exc()
+
+    def cancel(self, callback):
+        """Detach a caller. The request itself is cancelled when nobody waits for it."""
+        try:
+            self.callbacks.remove(callback)
+        except ValueError:
+            return False
+        if not self.callbacks:
+            self._forget()
+            self.client.session.cancel_request(self.id)
+        return True
+
+    def _forget(self):
+        if self.client._shared_requests.get(self.key) is self:
+            del self.client._shared_requests[self.key]
+
+
+class SharedRequestHandle:
+    """Returned to a caller of a shared request to allow its cancellation."""
+    __slots__ = ("request", "callback")
+
+    def __init__(self, request, callback):
+        self.request = request
+        self.callback = callback
+
+    @property
+    def id(self):
+        return self.request.id
+
+    def cancel(self):
+        return self.request.cancel(self.callback)
+
+
 class StratumClient:
-    def __init__(self, transport_pool, loop, session=None):
+    # Reconnect delays in seconds grow exponentially from the base up to the maximum.
+    RECONNECT_BASE_DELAY = 1
+    RECONNECT_MAX_DELAY = 5 * 60
+    # Requests are expired even if no transport is running to do it.
+    EXPIRE_INTERVAL = 1
+    # Spare connections are health-checked and replaced at this interval in seconds.
+    WARM_UP_INTERVAL = 30
+
+    def __init__(self, transport_pool, loop, session=None, connections=None,
+                 hedge_percentile=None, cache=None):
         self.init_transport = utils.Event()
         self.connection_established = utils.Event()
         self.connection_lost = utils.Event()
@@ -61,81 +130,167 @@ class StratumClient:
 
         if session is None:
             session = m_session.Session()
+        if hedge_percentile is not None:
+            # Slow read-only requests are re-sent through another connection.
+            session.hedge_percentile = hedge_percentile
 
         self.tranport_pool = transport_pool
         self.loop = loop
         self.session = session
         self._event_loop_listener = m_session.EventLoopListener(loop, self)
         self.session.add_listener(self._event_loop_listener)
-        self.transport = None
+        if connections is not None:
+            transport_pool.size = connections
         self.notifications = collections.defaultdict(utils.Event)
+        self.subscriptions = subscriptions.SubscriptionRegistry(self)
         self.reconnect_attempts = 0
+        self._running = False
+        # Results of immutable requests are served from the cache, see cache.ResponseCache.
+        self.cache = cache
+        self._shared_requests = {}
+        if cache is not None:
+            self.notifications["blockchain.headers.subscribe"].connect(
+                self._on_header_notification)
+
+    @property
+    def transports(self):
+        return self.tranport_pool.transports
+
+    @property
+    def transport(self):
+        return self.transports[0] if self.transports else None
 
     @property
     def is_connection_established(self):
-        return self.transport and self.transport.is_functional
+        return any(transport.is_functional for transport in self.transports)
 
     def start(self):
-        self.start_new_transport()
+        self._running = True
+        self.loop.call_later(self.EXPIRE_INTERVAL, self._expire_requests)
+        self.loop.call_later(self.WARM_UP_INTERVAL, self._keep_warm)
+        for i in range(self.tranport_pool.size):
+            self.start_new_transport()
 
     def stop(self):
-        if self.transport:
-            self.transport.stop()
-            self.transport.join()
-
-    def send_request_async(self, method, params, callback, *args, **kwargs):
+        self._running = False
+        self.tranport_pool.stop()
+
+    def _expire_requests(self):
+        if self._running:
+            self.session.expire_requests()
+            self.loop.call_later(self.EXPIRE_INTERVAL, self._expire_requests)
+
+    def _keep_warm(self):
+        if self._running:
+            if self.is_connection_established:
+                self.tranport_pool.warm_up()
+            self.loop.call_later(self.WARM_UP_INTERVAL, self._keep_warm)
+
+    def send_request_async(self, method, params, callback, *args, timeout=None,
+                           priority=stratum.Priority.normal, **kwargs):
         callback = AsyncRequestCallback(callback, args, kwargs)
-        return self.session.enqueue_request(method, params, callback)
+        return self._enqueue_request(method, params, callback, timeout, priority)
 
-    def send_request_sync(self, method, params):
+    def send_request_sync(self, method, params, timeout=None, priority=stratum.Priority.normal):
         child_loop = self.loop.create_child()
         callback = SyncRequestCallback(child_loop)
-        self.session.enqueue_request(method, params, callback)
+        self._enqueue_request(method, params, callback, timeout, priority)
         child_loop.run()
         if callback.error:
             raise callback.error
         return callback.response
 
+    def _enqueue_request(self, method, params, callback, timeout, priority):
+        """Queue a request unless its result is cached or an identical one is in flight."""
+        if not m_session.is_idempotent(method):
+            request_id = self.session.enqueue_request(
+                method, params, callback, timeout, priority=priority)
+            return m_session.RequestHandle(self.session, request_id)
+
+        key = m_cache.make_key(method, params)
+        cache = self.cache
+        cacheable = cache is not None and cache.is_cacheable(method, params)
+        if cacheable:
+            try:
+                result = cache.get(key)
+            except KeyError:
+                pass
+            else:
+                self.loop.call_soon(callback, transports.Response(None, result), None)
+                return m_session.RequestHandle(self.session, None)
+
+        # Single flight: identical requests in flight share a single response.
+        shared = self._shared_requests.get(key)
+        if shared is None or not self.session.is_pending(shared.id):
+            shared = SharedRequest(self, key, cacheable)
+            shared.id = self.session.enqueue_request(
+                method, params, shared, timeout, priority=priority)
+            self._shared_requests[key] = shared
+        else:
+            # An urgent caller mustn't wait in the lane of the original one.
+            self.session.raise_priority(shared.id, priority)
+        shared.callbacks.append(callback)
+        return SharedRequestHandle(shared, callback)
+
     def start_new_transport(self):
-        if self.transport and self.transport.running:
-            self.transport.stop()
-        self.session.restart_unprocessed()
+        if not self._running or self.tranport_pool.is_full:
+            return
         try:
-            self.transport = self.tranport_pool.get_transport()
-
+            transport = self.tranport_pool.start_transport(self.session)
         except ValueError:
-            self.transport = None
             self.reconnect()
         else:
-            self.transport.start(self.session)
-            self.init_transport.emit(self, self.transport)
+            self.init_transport.emit(self, transport)
 
     def reconnect(self):
         self.reconnect_attempts += 1
-        delay = min(5 * self.reconnect_attempts, 5 * 60)
+        delay = max(self.get_reconnect_delay(self.reconnect_attempts),
+                    self.tranport_pool.retry_delay())
         self.connection_reconnect.emit(self, self.reconnect_attempts, delay)
-        self.tranport_pool.enable_all()
         self.loop.call_later(delay, self.start_new_transport)
 
+    def get_reconnect_delay(self, attempts):
+        """Exponential backoff with full jitter, so that clients don't reconnect in lockstep."""
+        delay = min(self.RECONNECT_BASE_DELAY * 2 ** (attempts - 1), self.RECONNECT_MAX_DELAY)
+        return random.uniform(0, delay)
+
     def on_transport_aborted(self, session, transport, exception):
         transport.peer.disable()
+        self.tranport_pool.remove_transport(transport)
+        self.session.restart_unprocessed(transport)
         if transport.is_functional:
             self.connection_lost.emit(self, transport)
         self.start_new_transport()
 
     def on_transport_functional(self, session, transport):
         self.reconnect_attempts = 0
+        transport.peer.enable()
+        self.tranport_pool.warm_up()
         self.connection_established.emit(self, transport)
 
     def on_notification_received(self, session, notification):
+        self.subscriptions.dispatch(notification)
         self.notifications[notification.method].emit(notification)
 
     def on_respose_received(self, session, request, response, error):
+        if self.cache is not None and not error:
+            if request.method == "blockchain.headers.subscribe":
+                self._update_tip(response.response)
+            else:
+                self.cache.observe(request.method, request.params, response.response)
         try:
             request.callback(response, error)
         except Exception:
             traceback.print_exc()
 
+    def _on_header_notification(self, notification):
+        if notification.params:
+            self._update_tip(notification.params[0])
+
+    def _update_tip(self, header):
+        if isinstance(header, dict):
+            self.cache.update_tip(header.get("block_height", header.get("height")))
+
 
 if __name__ == "__main__":
     from coinalib.stratum import peers
@@ -0,0 +1,128 @@
+# coding: utf-8
+
+# Copyright 2015 Jiří Janoušek <janousek.jiri@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import json
+import sys
+import timeit
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class Codec:
+    """Encodes JSON-RPC messages to bytes and decodes them from bytes or bytearrays."""
+    name = None
+
+    def encode(self, obj):
+        raise NotImplementedError
+
+    def decode(self, data):
+        raise NotImplementedError
+
+    def encode_request(self, message_id, method, params):
+        return self.encode({
+            "id": message_id,
+            "method": method, "params": params,
+            "jsonrpc": "2.0"
+        }) + b"\n"
+
+
+class StdlibCodec(Codec):
+    name = "json"
+
+    def __init__(self):
+        self._encoder = json.JSONEncoder(separators=(",", ":"))
+
+    def encode(self, obj):
+        # ensure_ascii makes the output ASCII, so the cheap ascii codec suffices.
+        return self._encoder.encode(obj).encode("ascii")
+
+    def decode(self, data):
+        # json.loads detects UTF-8/16/32 of bytes and bytearray itself.
+        return json.loads(data)
+
+
+class OrjsonCodec(Codec):
+    name = "orjson"
+
+    def encode(self, obj):
+        return orjson.dumps(obj)
+
+    def decode(self, data):
+        return orjson.loads(data)
+
+
+CODECS = {StdlibCodec.name: StdlibCodec}
+if orjson is not None:
+    CODECS[OrjsonCodec.name] = OrjsonCodec
+
+
+def get_codec(name=None):
+    """Return a codec by name or the fastest available one."""
+    if name is None:
+        name = OrjsonCodec.name if OrjsonCodec.name in CODECS else StdlibCodec.name
+    try:
+        return CODECS[name]()
+    except KeyError:
+        raise ValueError("Unknown or unavailable codec '{}'.".format(name))
+
+
+default_codec = get_codec()
+
+
+def _benchmark(number=20):
+    # A blockchain.address.get_history like response of a busy address
+    response = {
+        "id": 1, "jsonrpc": "2.0",
+        "result": [
+            {"tx_hash": "{:064x}".format(i * 7919), "height": 300000 + i // 3}
+            for i in range(50000)]
+    }
+    data = json.dumps(response).encode("ascii")
+
+    def legacy():
+        json.loads(data.decode("ascii"))
+        json.dumps(response).encode("ascii")
+
+    results = [("legacy str json", timeit.timeit(legacy, number=number))]
+    for name in sorted(CODECS):
+        codec = CODECS[name]()
+
+        def run():
+            codec.decode(data)
+            codec.encode(response)
+
+        results.append((name, timeit.timeit(run, number=number)))
+
+    baseline = results[0][1]
+    print("{} bytes, {} round trips".format(len(data), number))
+    for name, seconds in results:
+        print("{:16} {:8.3f} ms  {:5.2f}x".format(
+            name, seconds * 1000 / number, baseline / seconds))
+
+
+if __name__ == "__main__":
+    _benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
@@ -0,0 +1,160 @@
+# coding: utf-8
+
+# Copyright 2015 Jiří Janoušek <janousek.jiri@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import json
+import os
+import time
+
+from coinalib import stratum
+from coinalib.stratum.peers import DEFAULT_PEERS, Peer, PeerList
+
+
+class PeerCache:
+    """
+    Persists peers together with their measured scores.
+
+    Peers are stored as a compact JSON list of
+    [host, port, version, prunning, protocol, rtt, failure_rate, trips, retry_after] items.
+    Peers with an open circuit breaker keep it across restarts, retry_after is a Unix time.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path, "rt", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return []
+        if not isinstance(data, list):
+            return []
+
+        now = time.time()
+        peers = []
+        for item in data:
+            # Invalid entries of a corrupted cache are skipped.
+            try:
+                host, port, version, prunning, protocol, rtt, failure_rate = item[:7]
+                trips, retry_after = item[7:] if len(item) == 9 else (0, None)
+                if not isinstance(host, str) or not isinstance(version, str):
+                    continue
+                peer = Peer(host, int(port), version, int(prunning), stratum.Protocol(protocol))
+            except (TypeError, ValueError):
+                continue
+            if rtt is not None and not (_is_number(rtt) and rtt >= 0):
+                continue
+            if not _is_number(failure_rate) or not 0 <= failure_rate <= 1:
+                continue
+            if not isinstance(trips, int) or isinstance(trips, bool) or not 0 <= trips <= 64:
+                continue
+            if retry_after is not None and not _is_number(retry_after):
+                continue
+            peer.rtt = rtt
+            peer.failure_rate = failure_rate
+            if trips and retry_after is not None:
+                peer.restore_circuit(trips, retry_after - now)
+            peers.append(peer)
+        return peers
+
+    def save(self, peers):
+        now = time.time()
+        data = [
+            [peer.host, peer.port, peer.version, peer.prunning, peer.protocol.value,
+             peer.rtt, round(peer.failure_rate, 4), peer.trips,
+             round(now + peer.retry_delay()) if peer.retry_at is not None else None]
+            for peer in peers]
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def load_peer_list(cache, default_peers=DEFAULT_PEERS):
+    """
+    Load cached peers first to keep their scores and circuit breakers, so that peers found
+    dead by an earlier session or by probe_peers aren't picked. Default peers are a fallback.
+    """
+    peer_list = PeerList(cache.load())
+    peer_list.merge(PeerList.parse(default_peers))
+    return peer_list
+
+
+class PeerDiscovery:
+    """
+    Merges peers announced by servers via server.peers.subscribe into the peer list.
+
+    With a cache, the peer list is also saved every SAVE_INTERVAL seconds, so that the saved
+    scores reflect measurements made during the session. Call save() on shutdown too.
+    """
+
+    METHOD = "server.peers.subscribe"
+    # Minimal number of seconds between two discovery requests
+    INTERVAL = 10 * 60
+    SAVE_INTERVAL = 5 * 60
+
+    def __init__(self, client, peer_list, cache=None):
+        self.client = client
+        self.peer_list = peer_list
+        self.cache = cache
+        self.last_request = None
+        client.connection_established.connect(self.on_connection_established)
+        client.notifications[self.METHOD].connect(self.on_notification)
+        if cache is not None:
+            client.loop.call_later(self.SAVE_INTERVAL, self._save_periodically)
+
+    def discover(self):
+        self.last_request = time.monotonic()
+        self.client.send_request_async(self.METHOD, [], self.on_response)
+
+    def merge(self, entries):
+        added = self.peer_list.merge(PeerList.parse(entries))
+        self.save()
+        return added
+
+    def save(self):
+        if self.cache is not None:
+            self.cache.save(self.peer_list.list_peers())
+
+    def _save_periodically(self):
+        try:
+            self.save()
+        finally:
+            self.client.loop.call_later(self.SAVE_INTERVAL, self._save_periodically)
+
+    def on_connection_established(self, client, transport):
+        if self.last_request is None or time.monotonic() - self.last_request >= self.INTERVAL:
+            self.discover()
+
+    def on_response(self, response, error):
+        if not error and response.response:
+            self.merge(response.response)
+
+    def on_notification(self, notification):
+        if notification.params:
+            self.merge(notification.params[0])
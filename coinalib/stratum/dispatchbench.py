@@ -0,0 +1,209 @@
+# coding: utf-8
+
+# Copyright 2015 Jiří Janoušek <janousek.jiri@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Measures how callbacks posted from another thread drain through a GLib-style main loop.
+
+Run as python -m coinalib.stratum.dispatchbench [count] [--glib]. Without --glib, the main
+loop is PriorityMainLoop, which follows GLib's dispatching rules but needs no GLib.
+"""
+
+import heapq
+import itertools
+import statistics
+import sys
+import threading
+import time
+
+from coinalib.stratum import utils
+
+PRIORITY_DEFAULT = 0
+PRIORITY_DEFAULT_IDLE = 200
+
+
+class PriorityMainLoop:
+    """
+    A pure Python main loop dispatching sources like GMainContext does.
+
+    Each iteration dispatches all ready sources of the most urgent ready priority, so idle
+    sources run only when no timeout is due, and all idle sources ready at the start of an
+    iteration run in that iteration. Callbacks returning True are kept.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._ids = itertools.count(1)
+        self._idle = []
+        self._timeouts = []
+        self._removed = set()
+        self._running = False
+        self.longest_iteration = 0.0  # Seconds spent dispatching idle sources at once
+
+    def idle_add(self, func, *args):
+        with self._condition:
+            source_id = next(self._ids)
+            self._idle.append((source_id, func, args))
+            self._condition.notify()
+        return source_id
+
+    def timeout_add(self, interval, func, *args):
+        with self._condition:
+            source_id = next(self._ids)
+            due = time.monotonic() + interval / 1000
+            heapq.heappush(self._timeouts, (due, source_id, interval, func, args))
+            self._condition.notify()
+        return source_id
+
+    def source_remove(self, source_id):
+        with self._condition:
+            self._removed.add(source_id)
+
+    def quit(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+
+    def run(self):
+        self._running = True
+        while self._running:
+            with self._condition:
+                now = time.monotonic()
+                if self._timeouts and self._timeouts[0][0] <= now:
+                    ready = []
+                    while self._timeouts and self._timeouts[0][0] <= now:
+                        ready.append(heapq.heappop(self._timeouts))
+                    idle = False
+                elif self._idle:
+                    ready, self._idle = self._idle, []
+                    idle = True
+                else:
+                    timeout = self._timeouts[0][0] - now if self._timeouts else None
+                    self._condition.wait(timeout)
+                    continue
+
+            start = time.monotonic()
+            for source in ready:
+                if idle:
+                    source_id, func, args = source
+                else:
+                    due, source_id, interval, func, args = source
+                if source_id in self._removed:
+                    continue
+                if func(*args):
+                    with self._condition:
+                        if idle:
+                            self._idle.append(source)
+                        else:
+                            heapq.heappush(self._timeouts, (
+                                time.monotonic() + interval / 1000, source_id, interval,
+                                func, args))
+            if idle:
+                self.longest_iteration = max(self.longest_iteration, time.monotonic() - start)
+
+
+class GLibMainLoop:
+    """Adapts GLib's default main context to the interface of PriorityMainLoop."""
+
+    def __init__(self):
+        from gi.repository import GLib
+        self._glib = GLib
+        self._loop = GLib.MainLoop()
+        self.idle_add = GLib.idle_add
+        self.timeout_add = GLib.timeout_add
+        self.source_remove = GLib.source_remove
+        self.run = self._loop.run
+        self.quit = self._loop.quit
+
+
+def benchmark(loop, count, use_dispatcher, work=0.00002):
+    """
+    Post count callbacks from a thread and return drain statistics in seconds.
+
+    Each callback busy-waits for work seconds, standing for response handling. A 5 ms timeout
+    source stands for redraws and input handling; the longest gap between its runs is how long
+    the user interface would freeze.
+    """
+    latencies = []
+    ticks = []
+
+    def on_callback(posted):
+        now = time.monotonic()
+        latencies.append(now - posted)
+        end = now + work
+        while time.monotonic() < end:
+            pass
+        if len(latencies) == count:
+            loop.quit()
+
+    def tick():
+        ticks.append(time.monotonic())
+        return True
+
+    if use_dispatcher:
+        call_soon = utils.BatchDispatcher(loop.idle_add).call_soon
+    else:
+        def call_soon(func, *args):
+            def callback():
+                func(*args)
+                return False
+            loop.idle_add(callback)
+
+    def produce():
+        for i in range(count):
+            call_soon(on_callback, time.monotonic())
+
+    tick_source = loop.timeout_add(5, tick)
+    start = time.monotonic()
+    threading.Thread(target=produce, daemon=True).start()
+    loop.run()
+    elapsed = time.monotonic() - start
+    loop.source_remove(tick_source)
+    ticks = [start] + ticks + [start + elapsed]
+    latencies.sort()
+    return {
+        "elapsed": elapsed,
+        "latency_mean": statistics.mean(latencies),
+        "latency_p99": latencies[int(len(latencies) * 0.99) - 1],
+        "latency_max": latencies[-1],
+        "slice_max": getattr(loop, "longest_iteration", None),
+        "tick_gap_max": max(b - a for a, b in zip(ticks, ticks[1:])),
+    }
+
+
+def main(argv):
+    count = int(argv[0]) if argv and argv[0].isdigit() else 10000
+    factory = GLibMainLoop if "--glib" in argv else PriorityMainLoop
+    keys = ("elapsed", "latency_mean", "latency_p99", "latency_max", "slice_max",
+            "tick_gap_max")
+    print("{}, {} callbacks posted from a thread, times in ms".format(factory.__name__, count))
+    print("{:16}".format("") + "".join("{:>13}".format(key) for key in keys))
+    for name, use_dispatcher in (("idle_add each", False), ("BatchDispatcher", True)):
+        result = benchmark(factory(), count, use_dispatcher)
+        print("{:16}".format(name) + "".join(
+            "{:13.2f}".format(result[key] * 1000) if result[key] is not None
+            else "{:>13}".format("n/a") for key in keys))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
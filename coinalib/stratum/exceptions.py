@@ -46,6 +46,15 @@ class ConnectionTimeout(StratumError):
         return "Timeout from peer {}".format(self.peer)
 
 
+class RequestTimeout(StratumError):
+    def __init__(self, request_id=None, method=None):
+        self.request_id = request_id
+        self.method = method
+
+    def __str__(self):
+        return "Request {} ({}) timed out".format(self.request_id, self.method)
+
+
 class ValueError(ValueError, StratumError):
     pass
 
@@ -56,5 +65,13 @@ class MessageError(StratumError):
         self.text = text
         self.traceback = traceback
 
+    @classmethod
+    def from_response(cls, error):
+        if isinstance(error, str):
+            return cls(0, error)
+        if isinstance(error, dict):
+            return cls(error.get("code", 0), error.get("message"), error.get("data"))
+        return cls(error[0], error[1], error[2] if len(error) > 2 else None)
+
     def __str__(self):
         return "{} {}".format(self.code, self.text)
@@ -26,10 +26,15 @@ import traceback
 
 from gi.repository import GLib
 
+from coinalib.stratum import utils
+
 
 class MainLoopWrapper:
     def __init__(self):
         self._loop = None
+        # Callbacks are run in time-sliced batches from a single idle source instead of one
+        # idle source per callback, which would flood the main loop during bursts.
+        self._dispatcher = utils.BatchDispatcher(GLib.idle_add)
 
     def run(self):
         if self._loop:
@@ -49,14 +54,7 @@ class MainLoopWrapper:
         return self.call_soon(func, *args, **kwargs)
 
     def call_soon(self, func, *args, **kwargs):
-        def callback(func, *args2, **kwargs2):
-            try:
-                func(*args2, **kwargs2)
-            except Exception:
-                traceback.print_exc()
-            return False
-
-        GLib.idle_add(callback, func, *args, **kwargs)
+        self._dispatcher.call_soon(func, *args, **kwargs)
 
     def call_later(self, delay, func, *args, **kwargs):
         def callback(func, *args2, **kwargs2):
@@ -66,7 +64,7 @@ class MainLoopWrapper:
                 traceback.print_exc()
             return False
 
-        GLib.timeout_add_seconds(delay, callback, func, *args, **kwargs)
+        GLib.timeout_add(int(delay * 1000), callback, func, *args, **kwargs)
 
     def create_child(self):
         return self.__class__()
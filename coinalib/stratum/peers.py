@@ -23,6 +23,8 @@
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import random
+import threading
+import time
 
 from coinalib import stratum
 
@@ -59,21 +61,120 @@ DEFAULT_PEERS = [
 
 
 class Peer:
+    # Weight of the newest sample in the moving averages
+    EWMA_WEIGHT = 0.25
+    # Assumed round-trip time of a peer that hasn't been measured yet
+    UNKNOWN_RTT = 0.5
+    FAILURE_PENALTY = 10
+    # Circuit breaker states
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+    # Cooldown of an open circuit in seconds, doubled with every consecutive failure
+    COOLDOWN = 30
+    MAX_COOLDOWN = 30 * 60
+
     def __init__(self, host, port, version, prunning, protocol, enabled=True):
+        # Transports, warm-up and probe threads update the same peer.
+        self._lock = threading.Lock()
         self.host = host
         self.port = port
         self.version = version
         self.prunning = prunning
         self.protocol = protocol
-        self.enabled = enabled
+        self.rtt = None
+        self.failure_rate = 0.0
+        self.errors = 0
+        self.timeouts = 0
+        self.trips = 0
+        self.cooldown = 0
+        self.retry_at = None
+        if not enabled:
+            self.disable()
+
+    @property
+    def state(self):
+        retry_at = self.retry_at
+        if retry_at is None:
+            return self.CLOSED
+        return self.OPEN if time.monotonic() < retry_at else self.HALF_OPEN
+
+    @property
+    def enabled(self):
+        return self.state != self.OPEN
+
+    @property
+    def score(self):
+        """Expected cost of using the peer; lower is better."""
+        rtt = self.rtt if self.rtt is not None else self.UNKNOWN_RTT
+        return rtt * (1 + self.FAILURE_PENALTY * self.failure_rate)
+
+    def record_rtt(self, rtt):
+        weight = self.EWMA_WEIGHT
+        with self._lock:
+            self.rtt = rtt if self.rtt is None else (1 - weight) * self.rtt + weight * rtt
+            self.failure_rate *= 1 - weight
+
+    def record_error(self):
+        with self._lock:
+            self.errors += 1
+            self._record_failure()
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+            self._record_failure()
+
+    def _record_failure(self):
+        weight = self.EWMA_WEIGHT
+        self.failure_rate = (1 - weight) * self.failure_rate + weight
 
     def disable(self):
+        """
+        Open the circuit breaker after a failure.
+
+        The peer is skipped until a cooldown elapses, then it becomes half-open and a single
+        trial connection decides whether it is closed again or opened with a longer cooldown.
+        """
         # Might emit signal in the future
-        self.enabled = False
+        with self._lock:
+            self.trips += 1
+            cooldown = min(self.COOLDOWN * 2 ** (self.trips - 1), self.MAX_COOLDOWN)
+            # Jitter keeps clients that lost the same peer from retrying it in lockstep.
+            self.cooldown = random.uniform(cooldown / 2, cooldown)
+            self.retry_at = time.monotonic() + self.cooldown
 
     def enable(self):
+        """Close the circuit breaker after a successful connection."""
         # Might emit signal in the future
-        self.enabled = True
+        with self._lock:
+            self.trips = 0
+            self.cooldown = 0
+            self.retry_at = None
+
+    def start_trial(self):
+        """Let a half-open peer be used by a single trial, which ends with enable or disable."""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.retry_at = time.monotonic() + self.cooldown
+
+    def restore_circuit(self, trips, retry_delay):
+        """Restore a circuit breaker saved by an earlier session, see retry_delay()."""
+        with self._lock:
+            self.trips = trips
+            if trips:
+                self.cooldown = min(self.COOLDOWN * 2 ** (trips - 1), self.MAX_COOLDOWN)
+                self.retry_at = time.monotonic() + retry_delay
+            else:
+                self.cooldown = 0
+                self.retry_at = None
+
+    def retry_delay(self):
+        """Return seconds until the peer can be used again."""
+        retry_at = self.retry_at
+        if retry_at is None:
+            return 0
+        return max(0, retry_at - time.monotonic())
 
     def __str__(self):
         return "{}:{} ({}) {} p{} ({})".format(
@@ -124,11 +225,29 @@ class PeerList:
         for protocol in stratum.Protocol:
             self.peers[protocol].sort(key=key_func, reverse=True)
 
-    def get_peer(self, protocol=None):
+    def merge(self, peers):
+        """
+        Add peers that aren't in the list yet.
+
+        Known peers are kept, so that their scores aren't lost. Returns the number of added peers.
+        """
+        known = {(peer.host, peer.port, peer.protocol): peer for peer in self.list_peers()}
+        added = 0
+        for peer in peers:
+            key = (peer.host, peer.port, peer.protocol)
+            if key not in known:
+                known[key] = peer
+                added += 1
+        if added:
+            self.update(known.values())
+        return added
+
+    def get_peer(self, protocol=None, exclude=()):
+        """Pick an enabled peer. Peers with a host in exclude are skipped."""
         if protocol is None:
             for protocol in stratum.Protocol.by_priority():
                 try:
-                    return self.get_peer(protocol)
+                    return self.get_peer(protocol, exclude)
                 except ValueError:
                     pass
 
@@ -152,13 +271,24 @@ class PeerList:
                 if choices:
                     break
 
-            if peer.enabled:
+            if peer.enabled and peer.host not in exclude:
                 choices.append(peer)
 
         if not choices:
             raise ValueError("No enabled peers for protocol '{}'.".format(protocol))
-
-        return random.choice(choices)
+        # Peers that failed before are tried only when no healthy peer is left.
+        closed = [peer for peer in choices if peer.state == Peer.CLOSED]
+        if closed:
+            choices = closed
+        if len(choices) == 1:
+            peer = choices[0]
+        else:
+            # Power of two choices: prefer the better of two random peers, which favours fast
+            # peers without sending all clients to the same one.
+            first, second = random.sample(choices, 2)
+            peer = first if first.score <= second.score else second
+        peer.start_trial()
+        return peer
 
     # TODO medium: unittest
     def list_peers(self, protocol=None):
@@ -173,3 +303,7 @@ class PeerList:
     def enable_all(self):
         for peer in self.list_peers():
             peer.enable()
+
+    def retry_delay(self):
+        """Return seconds until any peer can be used again."""
+        return min((peer.retry_delay() for peer in self.list_peers()), default=0)
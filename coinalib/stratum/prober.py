@@ -0,0 +1,128 @@
+# coding: utf-8
+
+# Copyright 2015 Jiří Janoušek <janousek.jiri@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import collections
+import concurrent.futures
+import socket
+import time
+
+import requests
+
+from coinalib import stratum
+from coinalib.stratum import codec as m_codec
+from coinalib.stratum import exceptions
+from coinalib.stratum import transports
+
+
+ProbeResult = collections.namedtuple("ProbeResult", "peer rtt server_version error")
+
+
+class PeerProber:
+    """
+    Checks many peers concurrently with a server.version request.
+
+    Live peers get their round-trip time recorded and are enabled, dead peers are disabled,
+    so that a client never picks them.
+    """
+
+    def __init__(self, timeout=5, max_workers=16, connections=None, codec=None):
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.connections = connections if connections is not None \
+            else transports.ConnectionCache()
+        self.codec = codec if codec is not None else m_codec.default_codec
+        self.message = self.codec.encode_request(1, "server.version", ["1.9.5", "0.9"])
+
+    def probe_all(self, peers, callback=None):
+        """Probe peers in parallel, call callback(result) as results arrive and return them."""
+        results = []
+        with concurrent.futures.ThreadPoolExecutor(self.max_workers) as executor:
+            futures = [executor.submit(self.probe, peer) for peer in peers]
+            for future in concurrent.futures.as_completed(futures):
+                result = future.result()
+                results.append(result)
+                if callback:
+                    callback(result)
+        return results
+
+    def probe(self, peer):
+        start = time.monotonic()
+        try:
+            if peer.protocol in transports.SOCKET_PROTOCOLS:
+                response = self._probe_socket(peer)
+            else:
+                response = self._probe_http(peer)
+            if not isinstance(response, dict):
+                raise exceptions.ValueError("Invalid response", response)
+            if response.get("error"):
+                raise exceptions.MessageError.from_response(response["error"])
+        except exceptions.ConnectionTimeout as e:
+            peer.record_timeout()
+            peer.disable()
+            return ProbeResult(peer, None, None, e)
+        except (exceptions.StratumError, ValueError) as e:
+            peer.record_error()
+            peer.disable()
+            return ProbeResult(peer, None, None, e)
+
+        rtt = time.monotonic() - start
+        peer.record_rtt(rtt)
+        peer.enable()
+        return ProbeResult(peer, rtt, response.get("result"), None)
+
+    def _probe_socket(self, peer):
+        port = peer.port or transports.DEFAULT_PORTS[peer.protocol]
+        sock = self.connections.connect(
+            peer, port, peer.protocol == stratum.Protocol.ssl, self.timeout)
+        try:
+            sock.settimeout(self.timeout)
+            sock.sendall(self.message)
+            data = b""
+            while b"\n" not in data:
+                chunk = sock.recv(4096)
+                if not chunk:
+                    raise exceptions.ConnectionError("Connection closed.", peer=peer)
+                data += chunk
+        except socket.timeout as e:
+            raise exceptions.ConnectionTimeout(peer) from e
+        except OSError as e:
+            raise exceptions.ConnectionError(str(e), peer=peer) from e
+        finally:
+            sock.close()
+        return self.codec.decode(data.split(b"\n", 1)[0])
+
+    def _probe_http(self, peer):
+        use_ssl = peer.protocol == stratum.Protocol.https
+        address = "{}://{}:{}/".format(
+            "https" if use_ssl else "http", peer.host,
+            peer.port or transports.DEFAULT_PORTS[peer.protocol])
+        try:
+            result = self.connections.http_session(address).post(
+                address, data=self.message, timeout=self.timeout, verify=False,
+                headers={"Content-Type": "application/stratum"})
+        except requests.Timeout as e:
+            raise exceptions.ConnectionTimeout(peer) from e
+        except requests.RequestException as e:
+            raise exceptions.ConnectionError(str(e), peer=peer) from e
+        return self.codec.decode(result.content)
@@ -23,45 +23,393 @@
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import collections
-import json
+import heapq
 import queue
+import threading
+import time
 
+from coinalib import stratum
+from coinalib.stratum import codec as m_codec
+from coinalib.stratum import exceptions
 
-Request = collections.namedtuple("Request", "id data callback")
+
+# Methods with side effects, which must not be sent twice
+NOT_READ_ONLY_METHODS = frozenset(("blockchain.transaction.broadcast",))
+
+# Kinds of timer heap entries
+_EXPIRE = 0
+_HEDGE = 1
+
+
+def is_read_only(method):
+    return method not in NOT_READ_ONLY_METHODS and not method.endswith(".subscribe")
+
+
+def is_idempotent(method):
+    """Whether identical requests can be answered by a single one, including subscriptions."""
+    return method not in NOT_READ_ONLY_METHODS
+
+
+class Request:
+    __slots__ = (
+        "id", "method", "params", "data", "callback", "deadline", "cancelled", "hedge",
+        "transport", "sent", "twin", "is_copy", "avoid", "priority")
+
+    def __init__(self, id, method, params, data, callback, deadline=None, hedge=False,
+                 priority=stratum.Priority.normal):
+        self.id = id
+        self.method = method
+        self.params = params
+        self.data = data
+        self.callback = callback
+        self.deadline = deadline
+        self.priority = priority
+        self.cancelled = False
+        self.hedge = hedge
+        self.transport = None
+        self.sent = None
+        # The other copy of a hedged request
+        self.twin = None
+        self.is_copy = False
+        # A hedged copy mustn't be sent by the transport of the original request
+        self.avoid = None
+
+    def __repr__(self):
+        return "<{}: {} {}>".format(self.__class__.__name__, self.id, self.method)
+
+
+class RequestHandle:
+    """Returned for a queued request to allow its cancellation."""
+    __slots__ = ("session", "id")
+
+    def __init__(self, session, request_id):
+        self.session = session
+        self.id = request_id
+
+    def cancel(self):
+        return self.session.cancel_request(self.id)
+
+
+class LatencyTracker:
+    """Percentiles of recent response latencies."""
+
+    def __init__(self, size=200, refresh=20):
+        self.samples = collections.deque(maxlen=size)
+        self.refresh = refresh
+        self._sorted = []
+        self._added = 0
+
+    def add(self, latency):
+        self.samples.append(latency)
+        self._added += 1
+        if self._added >= self.refresh or len(self._sorted) < self.refresh:
+            self._sorted = sorted(self.samples)
+            self._added = 0
+
+    def percentile(self, percentile):
+        if not self._sorted:
+            return None
+        index = min(len(self._sorted) - 1, int(len(self._sorted) * percentile / 100))
+        return self._sorted[index]
 
 
 class Session:
-    def __init__(self):
+    # Share of dequeued requests of each priority lane while all lanes are busy
+    LANE_WEIGHTS = (16, 4, 1)
+
+    def __init__(self, max_in_flight=None, default_timeout=None, hedge_percentile=None,
+                 min_hedge_delay=0.05, codec=None):
         self.listeners = []
-        self.requests = queue.Queue()
+        self.codec = codec if codec is not None else m_codec.default_codec
+        # Queued requests by priority; a request moved to another lane is skipped in the old one.
+        self.lanes = tuple(collections.deque() for priority in stratum.Priority)
+        self._credits = [0] * len(self.lanes)
+        self.queued = {}
         self.in_progress = {}
         self.message_id = 0
+        self.max_in_flight = max_in_flight
+        self.default_timeout = default_timeout
+        self.hedge_percentile = hedge_percentile
+        self.min_hedge_delay = min_hedge_delay
+        self.latency = LatencyTracker()
+        self.transports = set()
+        self.outstanding = collections.Counter()
+        self._hedges = collections.deque()
+        self._timers = []
+        self._condition = threading.Condition()
+        self._wakers = []
 
     def add_listener(self, listener):
         self.listeners.append(listener)
 
-    def enqueue_request(self, method, params, callback):
-        self.message_id += 1
-        data = json.dumps({
-            "id": self.message_id,
-            "method": method, "params": params or [],
-            "jsonrpc": "2.0"
-        })
-        data = data.encode("ascii") + b"\n"
-        self.requests.put(Request(self.message_id, data, callback))
-        return self.message_id
+    def add_waker(self, waker):
+        """Register a callable to be called from any thread when requests can be popped."""
+        self._wakers = self._wakers + [waker]
+
+    def remove_waker(self, waker):
+        self._wakers = [w for w in self._wakers if w != waker]
+
+    def _wake_up(self):
+        for waker in self._wakers:
+            waker()
+
+    def _encode(self, message_id, method, params):
+        return self.codec.encode_request(message_id, method, params)
+
+    def enqueue_request(self, method, params, callback, timeout=None, hedge=None,
+                        priority=stratum.Priority.normal):
+        """
+        Queue a request and return its id.
+
+        Requests are dequeued by priority lanes with weighted fair sharing (LANE_WEIGHTS), so
+        that bulk requests can't starve interactive ones and aren't starved either.
+        If timeout (or default_timeout) is set, the request fails with
+        exceptions.RequestTimeout when it isn't answered within that many seconds.
+        If hedge is true (default for read-only methods when hedge_percentile is set) and the
+        request takes longer than the hedge_percentile of recent latencies, a copy of it is
+        queued for another transport and the first response wins.
+        """
+        if timeout is None:
+            timeout = self.default_timeout
+        if hedge is None:
+            hedge = self.hedge_percentile is not None and is_read_only(method)
+        with self._condition:
+            self.message_id += 1
+            params = params or []
+            data = self._encode(self.message_id, method, params)
+            request = Request(
+                self.message_id, method, params, data, callback, hedge=hedge,
+                priority=stratum.Priority(priority))
+            if timeout is not None:
+                request.deadline = time.monotonic() + timeout
+                heapq.heappush(self._timers, (request.deadline, request.id, _EXPIRE))
+            self.lanes[request.priority].append(request)
+            self.queued[request.id] = request
+            self._condition.notify()
+        self._wake_up()
+        return request.id
 
     def get_request(self, request_id):
         return self.in_progress[request_id]
 
-    def pop_request(self):
-        request = self.requests.get_nowait()
+    def is_pending(self, request_id):
+        with self._condition:
+            return self._is_pending(request_id)
+
+    def raise_priority(self, request_id, priority):
+        """Move a queued request to a more urgent lane. Returns whether it was moved."""
+        with self._condition:
+            request = self.queued.get(request_id)
+            if request is None or request.is_copy or priority >= request.priority:
+                return False
+            request.priority = stratum.Priority(priority)
+            self.lanes[priority].append(request)
+            self._condition.notify()
+        self._wake_up()
+        return True
+
+    def _next_request(self, transport, balance=True):
+        hedges = self._hedges
+        while hedges and hedges[0].cancelled:
+            hedges.popleft()
+        for request in hedges:
+            if not request.cancelled and request.avoid is not transport:
+                return request
+
+        lane = self._next_lane()
+        if lane is None or balance and not self._is_least_loaded(transport):
+            return None
+        return self.lanes[lane][0]
+
+    def _next_lane(self):
+        """Pick a non-empty lane by smooth weighted round-robin without consuming its turn."""
+        best = None
+        credits = self._credits
+        for priority, lane in enumerate(self.lanes):
+            while lane and (lane[0].cancelled or lane[0].priority != priority):
+                lane.popleft()  # Cancelled or moved to another lane
+            if not lane:
+                credits[priority] = 0
+            elif best is None or credits[priority] + self.LANE_WEIGHTS[priority] \
+                    > credits[best] + self.LANE_WEIGHTS[best]:
+                best = priority
+        return best
+
+    def _take_turn(self, lane):
+        credits = self._credits
+        total = 0
+        for priority, weight in enumerate(self.LANE_WEIGHTS):
+            if self.lanes[priority]:
+                credits[priority] += weight
+                total += weight
+        credits[lane] -= total
+
+    def _is_least_loaded(self, transport):
+        if transport is None or len(self.transports) < 2:
+            return True
+        outstanding = self.outstanding
+        load = outstanding[transport]
+        return all(load <= outstanding[other] for other in self.transports)
+
+    def _can_pop(self, transport=None, balance=True):
+        if self.max_in_flight is not None and len(self.in_progress) >= self.max_in_flight:
+            return False
+        return self._next_request(transport, balance) is not None
+
+    def pop_request(self, block=False, timeout=None, transport=None):
+        """
+        Pop a queued request for the transport and mark it as in progress.
+
+        Raises queue.Empty if there is no request or the in-flight window is full. With block
+        set, waits up to timeout seconds for a request and a free slot in the window first.
+        """
+        with self._condition:
+            if block:
+                if not self._condition.wait_for(lambda: self._can_pop(transport), timeout):
+                    raise queue.Empty
+            elif not self._can_pop(transport):
+                raise queue.Empty
+            return self._pop(transport)
+
+    def _pop(self, transport, balance=True):
+        request = self._next_request(transport, balance)
+        if request.is_copy:
+            self._hedges.remove(request)
+        else:
+            self._take_turn(request.priority)
+            self.lanes[request.priority].popleft()
+        del self.queued[request.id]
         self.in_progress[request.id] = request
-        self.requests.task_done()
+        request.transport = transport
+        self.outstanding[transport] += 1
+        request.sent = time.monotonic()
+        if request.hedge and request.twin is None and self.hedge_percentile is not None:
+            delay = self.latency.percentile(self.hedge_percentile)
+            delay = max(self.min_hedge_delay, delay if delay is not None else 0)
+            heapq.heappush(self._timers, (request.sent + delay, request.id, _HEDGE))
+        return request
+
+    def pop_requests(self, limit, block=False, timeout=None, transport=None):
+        """
+        Pop up to limit queued requests. Raises queue.Empty if there are none.
+
+        Only the first request waits for the transport to be the least loaded one. The batch is
+        then filled up to the transport's fair share of the queued and outstanding requests.
+        """
+        with self._condition:
+            requests = [self.pop_request(block, timeout, transport)]
+            if len(self.transports) > 1:
+                outstanding = self.outstanding
+                load = len(self.queued) + sum(outstanding[other] for other in self.transports)
+                share = -(-load // len(self.transports))
+                limit = min(limit, max(1, share - outstanding[transport] + 1))
+            while len(requests) < limit and self._can_pop(transport, balance=False):
+                requests.append(self._pop(transport, balance=False))
+            return requests
+
+    def _pop_in_progress(self, request_id):
+        request = self.in_progress.pop(request_id, None)
+        if request is not None:
+            transport = request.transport
+            self.outstanding[transport] -= 1
+            if not self.outstanding[transport] and transport not in self.transports:
+                del self.outstanding[transport]
         return request
 
+    def _is_pending(self, request_id):
+        return request_id in self.queued or request_id in self.in_progress
+
+    def _remove_request(self, request_id):
+        request = self.queued.pop(request_id, None)
+        if request is None:
+            request = self._pop_in_progress(request_id)
+            if request is None:
+                return None
+        request.cancelled = True
+        if request.twin is not None and not request.twin.cancelled:
+            self._remove_request(request.twin.id)
+        self._condition.notify()
+        return request
+
+    def cancel_request(self, request_id):
+        """Cancel a queued or in-progress request. Its callback won't be called."""
+        with self._condition:
+            request = self._remove_request(request_id)
+        if request is None:
+            return False
+        self._wake_up()
+        return True
+
+    def next_deadline(self):
+        """Return the earliest monotonic time a timer of a pending request fires or None."""
+        with self._condition:
+            timers = self._timers
+            while timers and not self._is_pending(timers[0][1]):
+                heapq.heappop(timers)
+            return timers[0][0] if timers else None
+
+    def _hedge(self, request):
+        self.message_id += 1
+        copy = Request(
+            self.message_id, request.method, request.params,
+            self._encode(self.message_id, request.method, request.params), request.callback)
+        copy.twin = request
+        copy.is_copy = True
+        copy.avoid = request.transport
+        request.twin = copy
+        self.queued[copy.id] = copy
+        self._hedges.append(copy)
+        self._condition.notify_all()
+
+    def expire_requests(self, now=None):
+        """
+        Fail requests whose deadline has passed and hedge slow requests.
+
+        Returns the number of expired requests.
+        """
+        if now is None:
+            now = time.monotonic()
+        expired = []
+        hedged = False
+        with self._condition:
+            timers = self._timers
+            while timers and timers[0][0] <= now:
+                deadline, request_id, kind = heapq.heappop(timers)
+                if kind == _HEDGE:
+                    request = self.in_progress.get(request_id)
+                    if request is not None and request.twin is None:
+                        self._hedge(request)
+                        hedged = True
+                else:
+                    request = self._remove_request(request_id)
+                    if request is not None:
+                        expired.append(request)
+
+            # Drop entries of finished requests once they dominate the heap.
+            pending = len(self.queued) + len(self.in_progress)
+            if len(timers) > 64 and len(timers) > 2 * pending:
+                self._timers = [entry for entry in timers if self._is_pending(entry[1])]
+                heapq.heapify(self._timers)
+
+        if expired or hedged:
+            self._wake_up()
+        for request in expired:
+            error = exceptions.RequestTimeout(request.id, request.method)
+            for listener in self.listeners:
+                listener.on_respose_received(self, request, None, error)
+        return len(expired)
+
     def deliver_response(self, request, response, error):
-        del self.in_progress[request.id]
+        with self._condition:
+            if self._pop_in_progress(request.id) is None:
+                return  # Cancelled, expired or answered by the twin meanwhile
+            if request.twin is not None:
+                self._remove_request(request.twin.id)
+            if request.sent is not None and error is None:
+                self.latency.add(time.monotonic() - request.sent)
+            self._condition.notify()
+        if self.max_in_flight is not None or request.twin is not None or self.transports:
+            self._wake_up()
         for listener in self.listeners:
             listener.on_respose_received(self, request, response, error)
 
@@ -69,19 +417,42 @@ class Session:
         for listener in self.listeners:
             listener.on_notification_received(self, notification)
 
+    def remove_transport(self, transport):
+        with self._condition:
+            self.transports.discard(transport)
+            self._condition.notify_all()
+        self._wake_up()
+
     def transport_aborted(self, transport, exception):
+        self.remove_transport(transport)
         for listener in self.listeners:
             listener.on_transport_aborted(self, transport, exception)
 
     def transport_functional(self, transport):
+        with self._condition:
+            # Requests are balanced among functional transports.
+            self.transports.add(transport)
         for listener in self.listeners:
             listener.on_transport_functional(self, transport)
 
-    def restart_unprocessed(self):
-        unprocessed = self.in_progress
-        self.in_progress = {}
-        for request in unprocessed.values():
-            self.requests.put(request)
+    def restart_unprocessed(self, transport=None):
+        """Queue again requests in progress, only those sent by transport if it is given."""
+        with self._condition:
+            unprocessed = [
+                request for request in self.in_progress.values()
+                if transport is None or request.transport is transport]
+            for request in unprocessed:
+                self._pop_in_progress(request.id)
+                self.queued[request.id] = request
+                request.transport = None
+                if request.is_copy:
+                    self._hedges.append(request)
+            # Put them back in front of their lanes, in the original order.
+            for request in sorted(unprocessed, key=lambda request: request.id, reverse=True):
+                if not request.is_copy:
+                    self.lanes[request.priority].appendleft(request)
+            self._condition.notify_all()
+        self._wake_up()
 
 
 class SessionListener:
@@ -0,0 +1,204 @@
+# coding: utf-8
+
+# Copyright 2015 Jiří Janoušek <janousek.jiri@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import re
+
+from coinalib.stratum import codec as m_codec
+from coinalib.stratum import exceptions
+
+# Both patterns are scanned linearly: a bracket or a quote is searched for one at a time and
+# strings are skipped by a separate match starting after their opening quote. The string body
+# stops before the closing quote or before a backslash whose escaped character hasn't arrived.
+_TOKEN = re.compile(rb'[\[\]{}"]')
+_STRING_BODY = re.compile(rb'[^"\\]*(?:\\.[^"\\]*)*', re.DOTALL)
+_SEPARATORS = re.compile(rb'[\s,]*')
+_QUOTE = ord('"')
+_OPENING = frozenset(b"[{")
+
+
+class LineDecoder:
+    """
+    Decodes newline-delimited JSON messages fed in arbitrary chunks.
+
+    Only the incomplete last line is buffered. Lines holding a batch are flattened.
+    """
+
+    def __init__(self, codec=None, max_size=64 * 1024 * 1024):
+        self.codec = codec if codec is not None else m_codec.default_codec
+        self.max_size = max_size
+        self._buf = bytearray()
+        self._scanned = 0
+
+    def feed(self, data):
+        """Return a list of entries completed by data."""
+        buf = self._buf
+        buf += data
+        entries = []
+        start = 0
+        end = buf.find(b"\n", self._scanned)
+        while end >= 0:
+            if end > start:
+                # A line filling the whole buffer is decoded with its newline, without a copy.
+                _decode_into(
+                    self.codec, buf, start, end + 1 if end + 1 == len(buf) else end, entries)
+            start = end + 1
+            end = buf.find(b"\n", start)
+        del buf[:start]
+        self._scanned = len(buf)
+        if len(buf) > self.max_size:
+            raise exceptions.ValueError("Message exceeds {} bytes.".format(self.max_size))
+        return entries
+
+    def close(self):
+        """Decode the last line if it isn't terminated by a newline."""
+        buf, self._buf = self._buf, bytearray()
+        self._scanned = 0
+        entries = []
+        if buf.strip():
+            _decode_into(self.codec, buf, 0, len(buf), entries)
+        return entries
+
+
+class JsonStreamDecoder:
+    """
+    Decodes a JSON body holding a message or a batch of messages fed in arbitrary chunks.
+
+    Messages of a batch are decoded as soon as their closing brace arrives and their bytes are
+    dropped, so a large batch never has to be held in memory as a whole. A single message is
+    decoded by close().
+    """
+
+    def __init__(self, codec=None, max_size=64 * 1024 * 1024):
+        self.codec = codec if codec is not None else m_codec.default_codec
+        self.max_size = max_size
+        self._buf = bytearray()
+        self._pos = 0
+        self._start = None
+        self._depth = 0
+        self._in_string = False
+        self._batch = None  # Unknown until the first character arrives
+
+    def feed(self, data):
+        """Return a list of entries completed by data."""
+        buf = self._buf
+        buf += data
+        entries = []
+        if self._batch is None:
+            pos = _SEPARATORS.match(buf).end()
+            if pos < len(buf):
+                self._batch = buf[pos] == 0x5b  # [
+                if self._batch:
+                    self._pos = pos + 1
+                    self._depth = 1
+        if self._batch:
+            self._scan_batch(entries)
+        if len(buf) > self.max_size:
+            raise exceptions.ValueError("Message exceeds {} bytes.".format(self.max_size))
+        return entries
+
+    def close(self):
+        """Return the remaining entries or raise ValueError if the body is incomplete."""
+        buf, batch, depth = self._buf, self._batch, self._depth
+        self.__init__(self.codec, self.max_size)
+        entries = []
+        if batch:
+            if depth > 0:
+                raise exceptions.ValueError("Incomplete batch.")
+        elif batch is not None:
+            _decode_into(self.codec, buf, 0, len(buf), entries)
+        return entries
+
+    def _scan_batch(self, entries):
+        buf = self._buf
+        pos = self._pos
+        depth = self._depth
+        in_string = self._in_string
+        size = len(buf)
+        while pos < size and depth > 0:
+            if in_string:
+                # Resume where the previous chunk ended instead of rescanning the string.
+                pos = _STRING_BODY.match(buf, pos).end()
+                if pos >= size or buf[pos] != _QUOTE:
+                    break  # Wait for the rest of the string.
+                pos += 1
+                in_string = False
+                continue
+
+            if depth == 1:
+                # Between messages
+                pos = _SEPARATORS.match(buf, pos).end()
+                if pos >= size:
+                    break
+                char = buf[pos]
+                if char == 0x5d:  # ]
+                    depth = 0
+                elif char in _OPENING:
+                    self._start = pos
+                    depth += 1
+                else:
+                    raise exceptions.ValueError(
+                        "Unexpected character {!r} in batch.".format(chr(char)))
+                pos += 1
+                continue
+
+            match = _TOKEN.search(buf, pos)
+            if match is None:
+                pos = size
+                break
+            token_start = match.start()
+            char = buf[token_start]
+            pos = token_start + 1
+            if char == _QUOTE:
+                in_string = True
+                continue
+            if char in _OPENING:
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 1:
+                    _decode_into(self.codec, buf, self._start, pos, entries)
+                    self._start = None
+
+        # Drop consumed bytes.
+        cut = self._start if self._start is not None else pos
+        del buf[:cut]
+        self._pos = pos - cut
+        if self._start is not None:
+            self._start = 0
+        self._depth = depth
+        self._in_string = in_string
+
+
+def _decode_into(codec, buf, start, end, entries):
+    # Large single messages usually fill the whole buffer, which is decoded without a copy.
+    data = buf if start == 0 and end == len(buf) else buf[start:end]
+    try:
+        entry = codec.decode(data)
+    except ValueError as e:
+        raise exceptions.ValueError(
+            "Invalid message: {}".format(e), bytes(buf[start:min(end, start + 100)])) from e
+    if isinstance(entry, list):
+        entries.extend(entry)
+    else:
+        entries.append(entry)
@@ -0,0 +1,159 @@
+# coding: utf-8
+
+# Copyright 2015 Jiří Janoušek <janousek.jiri@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import traceback
+
+from coinalib import stratum
+from coinalib.stratum import utils
+
+
+class Subscription:
+    """A subscription to notifications of a method with params, shared by all its callers."""
+
+    def __init__(self, method, params):
+        self.method = method
+        self.params = params
+        self.value = None
+        self.known = False
+        self.changed = utils.Event()
+        self.failed = utils.Event()
+
+    @property
+    def key(self):
+        return subscription_key(self.method, self.params)
+
+    def update(self, value):
+        """Store a new value and emit changed(subscription, value) if it differs."""
+        if self.known and value == self.value:
+            return  # A duplicate, e.g. the answer of a replayed subscription
+        self.value = value
+        self.known = True
+        self.changed.emit(self, value)
+
+    def __repr__(self):
+        return "<{}: {} {}>".format(self.__class__.__name__, self.method, self.params)
+
+
+def subscription_key(method, params):
+    """Notifications are routed by method and the first param (e.g. an address)."""
+    return method, params[0] if params else None
+
+
+class SubscriptionRegistry:
+    """
+    Tracks active subscriptions of a client and replays them after a connection is lost.
+
+    Notifications are routed to subscriptions by their method and first param.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.subscriptions = {}
+        self._replay_needed = False
+        client.connection_established.connect(self.on_connection_established)
+        client.connection_lost.connect(self.on_connection_lost)
+
+    def subscribe(self, method, params, callback, *args, **kwargs):
+        """
+        Subscribe to notifications, callback(subscription, value, *args, **kwargs) is called
+        with the result of the subscribe request and every change announced later.
+
+        Returns a handle for unsubscribe; handle[0] is the subscription. If the subscribe request
+        fails, the subscription is dropped and its failed(subscription, error) event is emitted.
+        Subscribe again to retry.
+        """
+        params = params or []
+        key = subscription_key(method, params)
+        subscription = self.subscriptions.get(key)
+        if subscription is None:
+            subscription = self.subscriptions[key] = Subscription(method, params)
+            self._send(subscription)
+        elif subscription.known:
+            self.client.loop.call_soon(
+                callback, subscription, subscription.value, *args, **kwargs)
+        handler = subscription.changed.connect(callback, *args, **kwargs)
+        return subscription, handler
+
+    def unsubscribe(self, handle):
+        # Stratum has no unsubscribe request, notifications are just dropped.
+        subscription, handler = handle
+        subscription.changed.disconnect(handler)
+        if not subscription.changed and self.subscriptions.get(subscription.key) is subscription:
+            del self.subscriptions[subscription.key]
+
+    def dispatch(self, notification):
+        """Route a notification to its subscription. Returns whether there was one."""
+        params = notification.params or []
+        subscriptions = self.subscriptions
+        subscription = None
+        if params:
+            try:
+                subscription = subscriptions.get((notification.method, params[0]))
+            except TypeError:
+                pass  # Unhashable first param, e.g. a block header
+        if subscription is None:
+            subscription = subscriptions.get((notification.method, None))
+            value = params[0] if params else None
+        else:
+            value = params[1] if len(params) > 1 else None
+        if subscription is None:
+            return False
+        try:
+            subscription.update(value)
+        except Exception:
+            traceback.print_exc()
+        return True
+
+    def replay(self):
+        """Send all subscribe requests again at once, so that transports can batch them."""
+        self._replay_needed = False
+        # The bulk lane keeps thousands of them from delaying interactive requests.
+        for subscription in list(self.subscriptions.values()):
+            self._send(subscription, stratum.Priority.bulk)
+
+    def on_connection_lost(self, client, transport):
+        # Subscriptions of the lost connection are gone, replay them through another one.
+        if client.is_connection_established:
+            self.replay()
+        else:
+            self._replay_needed = True
+
+    def on_connection_established(self, client, transport):
+        if self._replay_needed:
+            self.replay()
+
+    def _send(self, subscription, priority=stratum.Priority.normal):
+        self.client.send_request_async(
+            subscription.method, subscription.params, self._on_response, subscription,
+            priority=priority)
+
+    def _on_response(self, response, error, subscription):
+        if self.subscriptions.get(subscription.key) is not subscription:
+            return  # Unsubscribed or already failed
+        if error:
+            # Later callers must not attach to a subscription the server doesn't serve.
+            del self.subscriptions[subscription.key]
+            subscription.failed.emit(subscription, error)
+        else:
+            subscription.update(response.response)
@@ -0,0 +1,143 @@
+# coding: utf-8
+
+# Copyright 2015 Jiří Janoušek <janousek.jiri@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import asyncio
+import json
+import unittest
+
+from coinalib import stratum
+from coinalib.stratum import exceptions
+from coinalib.stratum.aioclient import AsyncStratumClient
+from coinalib.stratum.peers import Peer
+
+
+class FakeElectrumServer:
+    def __init__(self):
+        self.server = None
+        self.writers = []
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        for writer in self.writers:
+            writer.close()
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        self.writers.append(writer)
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            message = json.loads(line.decode("utf-8"))
+            method, params = message["method"], message["params"]
+            if method == "blockchain.address.subscribe":
+                self.send(writer, {"id": message["id"], "result": "status0"})
+                self.send(writer, {"method": method, "params": [params[0], "status1"]})
+            elif method == "blockchain.address.get_balance":
+                # Answer in reverse order of requests
+                await asyncio.sleep(0.01 * (10 - int(params[0])))
+                self.send(writer, {"id": message["id"], "result": params[0]})
+            elif method == "hang":
+                pass
+            elif method == "raw":
+                writer.write(params[0].encode("utf-8") + b"\n")
+            else:
+                self.send(writer, {"id": message["id"], "error": [1, "unknown method"]})
+
+    def send(self, writer, message):
+        writer.write(json.dumps(message).encode("utf-8") + b"\n")
+
+
+class AsyncStratumClientTest(unittest.TestCase):
+    def run_test(self, test):
+        async def wrapper():
+            server = FakeElectrumServer()
+            port = await server.start()
+            peer = Peer("127.0.0.1", port, "v0.9", 0, stratum.Protocol.tcp)
+            try:
+                async with AsyncStratumClient(peer) as client:
+                    await test(client, server)
+            finally:
+                await server.stop()
+
+        asyncio.run(wrapper())
+
+    def test_unsupported_protocol(self):
+        with self.assertRaises(ValueError):
+            AsyncStratumClient(Peer("localhost", 0, "v0.9", 0, stratum.Protocol.http))
+
+    def test_concurrent_requests(self):
+        async def test(client, server):
+            params = [str(i) for i in range(10)]
+            results = await asyncio.gather(*(
+                client.request("blockchain.address.get_balance", [p]) for p in params))
+            self.assertEqual(params, results)
+
+        self.run_test(test)
+
+    def test_error(self):
+        async def test(client, server):
+            with self.assertRaises(exceptions.MessageError):
+                await client.request("foo")
+            with self.assertRaises(asyncio.TimeoutError):
+                await client.request("hang", timeout=0.05)
+            self.assertFalse(client._pending)
+
+        self.run_test(test)
+
+    def test_malformed_response(self):
+        for line in ('[1]', '"x"', '{"id": [1], "result": 1}'):
+            async def test(client, server):
+                pending = asyncio.ensure_future(client.request("hang"))
+                with self.assertRaises(exceptions.ConnectionError):
+                    await client.request("raw", [line])
+                with self.assertRaises(exceptions.ConnectionError):
+                    await asyncio.wait_for(pending, 1)
+
+            with self.subTest(line=line):
+                self.run_test(test)
+
+    def test_subscribe(self):
+        async def test(client, server):
+            subscription = await client.subscribe("blockchain.address.subscribe", ["addr"])
+            other = await client.subscribe("blockchain.address.subscribe", ["other"])
+            self.assertEqual("status0", subscription.result)
+            notification = await subscription.__anext__()
+            self.assertEqual(["addr", "status1"], notification.params)
+            notification = await other.__anext__()
+            self.assertEqual(["other", "status1"], notification.params)
+            other.close()
+            self.assertNotIn(("blockchain.address.subscribe", "other"), client._subscriptions)
+
+            for writer in server.writers:
+                writer.close()
+            self.assertEqual([], [n async for n in subscription])
+            with self.assertRaises(exceptions.ConnectionError):
+                await client.request("foo")
+
+        self.run_test(test)
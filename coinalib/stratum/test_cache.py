@@ -0,0 +1,266 @@
+# coding: utf-8
+
+# Copyright 2015 Jiří Janoušek <janousek.jiri@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import queue
+import tempfile
+import unittest
+
+from coinalib.stratum import cache as m_cache
+from coinalib.stratum import client as m_client
+from coinalib.stratum import utils
+from coinalib.stratum.transports import Response
+
+
+class ResponseCacheTest(unittest.TestCase):
+    def test_lru(self):
+        cache = m_cache.ResponseCache(max_size=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(1, cache.get("a"))
+        cache.put("c", 3)
+        with self.assertRaises(KeyError):
+            cache.get("b")
+        self.assertEqual(1, cache.get("a"))
+        self.assertEqual(3, cache.get("c"))
+        self.assertEqual(2, len(cache))
+        self.assertEqual((3, 1), (cache.hits, cache.misses))
+
+    def test_byte_limit(self):
+        cache = m_cache.ResponseCache(max_bytes=2500)
+        cache.put("a", "00" * 500)
+        cache.put("b", {"hex": "00" * 500, "height": 1})
+        self.assertEqual(2, len(cache))
+        cache.put("c", "00" * 500)
+        self.assertEqual(2, len(cache))
+        with self.assertRaises(KeyError):
+            cache.get("a")
+        self.assertLessEqual(cache.size_bytes, 2500)
+        # A result larger than the limit isn't kept in memory at all.
+        cache.put("d", "00" * 2000)
+        with self.assertRaises(KeyError):
+            cache.get("d")
+        self.assertEqual("00" * 500, cache.get("c"))
+        cache.clear()
+        self.assertEqual(0, cache.size_bytes)
+
+    def test_is_cacheable(self):
+        cache = m_cache.ResponseCache()
+        self.assertFalse(cache.is_cacheable("blockchain.address.get_history", ["1abc"]))
+        # Block data is cacheable only well below a known tip.
+        self.assertFalse(cache.is_cacheable("blockchain.block.get_header", [100]))
+        cache.update_tip(10000)
+        cache.update_tip(5)
+        self.assertEqual(10000, cache.tip_height)
+        self.assertTrue(cache.is_cacheable("blockchain.block.get_header", [100]))
+        self.assertFalse(cache.is_cacheable("blockchain.block.get_header", [9999]))
+        self.assertFalse(cache.is_cacheable("blockchain.block.get_header", ["100"]))
+        # Chunks are kept by the header store.
+        self.assertFalse(cache.is_cacheable("blockchain.block.get_chunk", [3]))
+        self.assertTrue(
+            cache.is_cacheable("blockchain.transaction.get_merkle", ["ab" * 32, 9000]))
+
+    def test_confirmed_transactions_only(self):
+        method = "blockchain.transaction.get"
+        cache = m_cache.ResponseCache()
+        cache.update_tip(10000)
+        # The confirmation of a transaction is unknown at first.
+        self.assertFalse(cache.is_cacheable(method, ["ab" * 32]))
+        cache.observe("blockchain.address.get_history", ["1abc"], [
+            {"tx_hash": "ab" * 32, "height": 9000},
+            {"tx_hash": "cd" * 32, "height": 9998},
+            {"tx_hash": "ef" * 32, "height": 0},
+        ])
+        cache.observe("blockchain.transaction.get_merkle", ["12" * 32, 9001],
+                      {"block_height": 9001, "merkle": [], "pos": 0})
+        self.assertTrue(cache.is_cacheable(method, ["ab" * 32]))
+        self.assertTrue(cache.is_cacheable(method, ["12" * 32, False]))
+        self.assertFalse(cache.is_cacheable(method, ["ab" * 32, True]))
+        # Not buried deep enough yet or unconfirmed
+        self.assertFalse(cache.is_cacheable(method, ["cd" * 32]))
+        self.assertFalse(cache.is_cacheable(method, ["ef" * 32]))
+        cache.update_tip(10004)
+        self.assertTrue(cache.is_cacheable(method, ["cd" * 32]))
+
+    def test_make_key(self):
+        self.assertEqual(
+            m_cache.make_key("m", [{"b": 1, "a": 2}]), m_cache.make_key("m", [{"a": 2, "b": 1}]))
+
+    def test_store(self):
+        fd, path = tempfile.mkstemp(suffix=".sqlite")
+        os.close(fd)
+        try:
+            store = m_cache.SqliteStore(path)
+            cache = m_cache.ResponseCache(max_size=1, store=store)
+            cache.put("a", {"hex": "00ff"})
+            cache.put("b", 2)
+            self.assertEqual({"hex": "00ff"}, cache.get("a"))
+            store.close()
+
+            store = m_cache.SqliteStore(path)
+            cache = m_cache.ResponseCache(store=store)
+            self.assertEqual(2, cache.get("b"))
+            with self.assertRaises(KeyError):
+                cache.get("c")
+            store.close()
+        finally:
+            os.unlink(path)
+
+
+class ClientCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = utils.SimpleLoop()
+        self.client = m_client.StratumClient(None, self.loop, cache=m_cache.ResponseCache())
+        self.client.cache.update_tip(1000)
+        self.session = self.client.session
+        self.results = []
+
+    def callback(self, response, error, name):
+        self.results.append((name, response.response, error))
+
+    def run_loop(self):
+        self.loop.call_soon(self.loop.stop)
+        self.loop.run()
+
+    def test_cached_and_deduplicated(self):
+        method, params = "blockchain.block.get_header", [10]
+        self.client.send_request_async(method, params, self.callback, "first")
+        self.client.send_request_async(method, params, self.callback, "second")
+        request = self.session.pop_request()
+        with self.assertRaises(queue.Empty):
+            self.session.pop_request()
+
+        self.session.deliver_response(request, Response(request.id, {"height": 10}), None)
+        self.run_loop()
+        self.assertEqual(
+            [("first", {"height": 10}, None), ("second", {"height": 10}, None)], self.results)
+
+        self.client.send_request_async(method, params, self.callback, "third")
+        with self.assertRaises(queue.Empty):
+            self.session.pop_request()
+        self.run_loop()
+        self.assertEqual(("third", {"height": 10}, None), self.results[-1])
+
+    def test_not_cacheable(self):
+        method, params = "blockchain.block.get_header", [999]
+        for i in range(2):
+            self.client.send_request_async(method, params, self.callback, i)
+            request = self.session.pop_request()
+            self.session.deliver_response(request, Response(request.id, {}), None)
+        self.run_loop()
+        self.assertEqual([(0, {}, None), (1, {}, None)], self.results)
+
+    def test_cancelled_request_is_not_shared(self):
+        method, params = "blockchain.block.get_header", [10]
+        self.client.send_request_async(method, params, self.callback, "first").cancel()
+        self.client.send_request_async(method, params, self.callback, "second")
+        request = self.session.pop_request()
+        self.session.deliver_response(request, Response(request.id, {"height": 10}), None)
+        self.run_loop()
+        self.assertEqual([("second", {"height": 10}, None)], self.results)
+
+    def test_transaction_cached_once_confirmed(self):
+        self.client.send_request_async(
+            "blockchain.address.get_history", ["1abc"], self.callback, "history")
+        request = self.session.pop_request()
+        self.session.deliver_response(
+            request, Response(request.id, [{"tx_hash": "ab" * 32, "height": 900}]), None)
+        self.run_loop()
+        self.client.send_request_async(
+            "blockchain.transaction.get", ["ab" * 32], self.callback, "tx")
+        request = self.session.pop_request()
+        self.session.deliver_response(request, Response(request.id, "00ff"), None)
+        self.run_loop()
+        self.client.send_request_async(
+            "blockchain.transaction.get", ["ab" * 32], self.callback, "cached")
+        with self.assertRaises(queue.Empty):
+            self.session.pop_request()
+        self.run_loop()
+        self.assertEqual(("cached", "00ff", None), self.results[-1])
+
+    def test_tip_from_notification(self):
+        self.client.on_notification_received(self.session, m_client.transports.Notification(
+            "blockchain.headers.subscribe", [{"block_height": 2000}]))
+        self.assertEqual(2000, self.client.cache.tip_height)
+
+
+class SingleFlightTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = utils.SimpleLoop()
+        self.client = m_client.StratumClient(None, self.loop)
+        self.session = self.client.session
+        self.results = []
+
+    def callback(self, response, error, name):
+        self.results.append((name, response.response, error))
+
+    def test_identical_requests_share_response(self):
+        method = "blockchain.address.get_history"
+        first = self.client.send_request_async(method, ["1abc"], self.callback, "first")
+        second = self.client.send_request_async(method, ["1abc"], self.callback, "second")
+        other = self.client.send_request_async(method, ["1xyz"], self.callback, "other")
+        self.assertEqual(first.id, second.id)
+        self.assertNotEqual(first.id, other.id)
+
+        requests = self.session.pop_requests(10)
+        self.assertEqual(2, len(requests))
+        self.session.deliver_response(requests[0], Response(requests[0].id, ["tx"]), None)
+        self.loop.call_soon(self.loop.stop)
+        self.loop.run()
+        self.assertEqual([("first", ["tx"], None), ("second", ["tx"], None)], self.results)
+
+        # Once answered, the same request goes to the server again.
+        self.client.send_request_async(method, ["1abc"], self.callback, "third")
+        self.assertEqual(1, len(self.session.pop_requests(10)))
+
+    def test_cancel_detaches_caller(self):
+        method = "blockchain.address.get_history"
+        first = self.client.send_request_async(method, ["1abc"], self.callback, "first")
+        second = self.client.send_request_async(method, ["1abc"], self.callback, "second")
+        self.assertTrue(first.cancel())
+        self.assertFalse(first.cancel())
+        self.assertTrue(self.session.is_pending(second.id))
+        self.assertTrue(second.cancel())
+        self.assertFalse(self.session.is_pending(second.id))
+
+    def test_duplicate_subscribe_is_shared(self):
+        method = "blockchain.headers.subscribe"
+        first = self.client.send_request_async(method, [], self.callback, "first")
+        second = self.client.send_request_async(method, [], self.callback, "second")
+        self.assertEqual(first.id, second.id)
+        requests = self.session.pop_requests(10)
+        self.assertEqual(1, len(requests))
+        response = Response(requests[0].id, {"block_height": 5})
+        self.session.deliver_response(requests[0], response, None)
+        self.loop.call_soon(self.loop.stop)
+        self.loop.run()
+        self.assertEqual([
+            ("first", {"block_height": 5}, None),
+            ("second", {"block_height": 5}, None)], self.results)
+
+    def test_not_read_only_requests_are_not_shared(self):
+        method = "blockchain.transaction.broadcast"
+        first = self.client.send_request_async(method, ["00"], self.callback, "first")
+        second = self.client.send_request_async(method, ["00"], self.callback, "second")
+        self.assertNotEqual(first.id, second.id)
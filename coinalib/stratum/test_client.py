@@ -0,0 +1,79 @@
+# coding: utf-8
+
+# Copyright 2015 Jiří Janoušek <janousek.jiri@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import unittest
+
+from coinalib.stratum import client as m_client
+from coinalib.stratum import exceptions
+from coinalib.stratum import utils
+
+
+class UnavailableTransportPool:
+    size = 1
+    is_full = False
+
+    def __init__(self):
+        self.transports = []
+        self.attempts = 0
+
+    def start_transport(self, session):
+        self.attempts += 1
+        raise ValueError("No transport is available.")
+
+    def retry_delay(self):
+        return 0
+
+    def stop(self):
+        pass
+
+
+class HeadlessClientTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = utils.SimpleLoop()
+        self.pool = UnavailableTransportPool()
+        self.client = m_client.StratumClient(self.pool, self.loop)
+        self.client.RECONNECT_BASE_DELAY = 0.01
+        self.client.EXPIRE_INTERVAL = 0.01
+
+    def test_reconnect(self):
+        delays = []
+        self.client.connection_reconnect.connect(
+            lambda client, attempts, delay: delays.append(delay))
+        self.client.start()
+        self.loop.call_later(0.2, self.loop.stop)
+        self.loop.run()
+        self.client.stop()
+        self.assertGreater(self.pool.attempts, 2)
+        self.assertEqual(self.pool.attempts, len(delays))
+
+    def test_requests_expire_without_transport(self):
+        errors = []
+        self.client.start()
+        self.client.send_request_async(
+            "server.version", [], lambda response, error: errors.append(error), timeout=0.02)
+        self.loop.call_later(0.1, self.loop.stop)
+        self.loop.run()
+        self.client.stop()
+        self.assertEqual(1, len(errors))
+        self.assertIsInstance(errors[0], exceptions.RequestTimeout)
@@ -0,0 +1,62 @@
+# coding: utf-8
+
+# Copyright 2015 Jiří Janoušek <janousek.jiri@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import unittest
+
+from coinalib.stratum import codec
+
+
+class CodecTest(unittest.TestCase):
+    def test_round_trip(self):
+        message = {"id": 1, "result": [{"tx_hash": "ab" * 32, "height": 1}], "label": "Žluťoučký"}
+        for name in sorted(codec.CODECS):
+            with self.subTest(codec=name):
+                c = codec.get_codec(name)
+                data = c.encode(message)
+                self.assertIsInstance(data, bytes)
+                self.assertEqual(message, c.decode(data))
+                self.assertEqual(message, c.decode(bytearray(data)))
+                # Non-ASCII UTF-8 payloads are accepted.
+                self.assertEqual(message, c.decode(
+                    b'{"id":1,"result":[{"tx_hash":"' + b"ab" * 32 + b'","height":1}],'
+                    b'"label":"' + "Žluťoučký".encode("utf-8") + b'"}'))
+
+    def test_encode_request(self):
+        for name in sorted(codec.CODECS):
+            with self.subTest(codec=name):
+                c = codec.get_codec(name)
+                data = c.encode_request(5, "server.version", ["1.9.5", "0.9"])
+                self.assertTrue(data.endswith(b"\n"))
+                self.assertEqual(
+                    {"id": 5, "method": "server.version", "params": ["1.9.5", "0.9"],
+                     "jsonrpc": "2.0"},
+                    c.decode(data))
+
+    def test_invalid(self):
+        for name in sorted(codec.CODECS):
+            with self.subTest(codec=name):
+                with self.assertRaises(ValueError):
+                    codec.get_codec(name).decode(b"{")
+        with self.assertRaises(ValueError):
+            codec.get_codec("nonexistent")
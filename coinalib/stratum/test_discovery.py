@@ -0,0 +1,180 @@
+# coding: utf-8
+
+# Copyright 2015 Jiří Janoušek <janousek.jiri@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import collections
+import json
+import os
+import tempfile
+import unittest
+
+from coinalib import stratum
+from coinalib.stratum import discovery
+from coinalib.stratum import utils
+from coinalib.stratum.peers import Peer, PeerList
+from coinalib.stratum.transports import Notification, Response
+
+
+PEERS = [
+    ['123.123.123.123', 'myelectrum.example.info', ['v0.9', 'p10000', 't', 's']],
+    ['123.123.123.124', 'myelectrum.example.org', ['v0.9', 'p1000', 's789']],
+]
+
+
+class FakeClient:
+    def __init__(self, result):
+        self.result = result
+        self.requests = []
+        self.loop = utils.SimpleLoop()
+        self.connection_established = utils.Event()
+        self.notifications = collections.defaultdict(utils.Event)
+
+    def send_request_async(self, method, params, callback):
+        self.requests.append((method, params))
+        callback(Response(len(self.requests), self.result), None)
+
+
+class PeerCacheTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def test_save_and_load(self):
+        peers = list(PeerList.parse(PEERS))
+        peers[0].record_rtt(0.25)
+        peers[1].record_timeout()
+        cache = discovery.PeerCache(self.path)
+        cache.save(peers)
+        loaded = cache.load()
+        self.assertEqual([str(peer) for peer in peers], [str(peer) for peer in loaded])
+        self.assertEqual(0.25, loaded[0].rtt)
+        self.assertIsNone(loaded[1].rtt)
+        self.assertEqual(peers[1].failure_rate, loaded[1].failure_rate)
+
+    def test_circuit_breaker_survives_restart(self):
+        peers = list(PeerList.parse(PEERS))
+        peers[0].disable()
+        peers[1].disable()
+        peers[1].disable()
+        retry_delay = peers[1].retry_delay()
+        cache = discovery.PeerCache(self.path)
+        cache.save(peers)
+        loaded = cache.load()
+        self.assertFalse(loaded[0].enabled)
+        self.assertFalse(loaded[1].enabled)
+        self.assertEqual(2, loaded[1].trips)
+        self.assertAlmostEqual(retry_delay, loaded[1].retry_delay(), delta=1)
+        self.assertEqual(Peer.CLOSED, loaded[2].state)
+        # Loaded peers take precedence over the same default peers.
+        peer_list = discovery.load_peer_list(cache, PEERS)
+        self.assertEqual(1, sum(peer.enabled for peer in peer_list.list_peers()))
+        # Entries written before circuit breakers were saved are still read.
+        with open(self.path, "wt") as f:
+            f.write('[["host", 1, "v0.9", 0, "t", null, 0]]')
+        self.assertEqual(Peer.CLOSED, cache.load()[0].state)
+
+    def test_load_invalid(self):
+        with open(self.path, "wt") as f:
+            f.write("[")
+        self.assertEqual([], discovery.PeerCache(self.path).load())
+        with open(self.path, "wt") as f:
+            f.write('[["host", 1, "v0.9", 0, "x", null, 0], ["host", 1, "v0.9", 0, "t", null, 0]]')
+        self.assertEqual(1, len(discovery.PeerCache(self.path).load()))
+        os.unlink(self.path)
+        self.assertEqual([], discovery.PeerCache(self.path).load())
+        open(self.path, "w").close()
+
+    def test_load_corrupted(self):
+        valid = ["host", 1, "v0.9", 0, "t", 0.5, 0.25]
+        for data in ('{"host": 1}', '7', '"peers"', '[1, null, [], {}]', json.dumps([
+                ["host", 1, "v0.9", 0, "t", "fast", 0],
+                ["host", 1, "v0.9", 0, "t", -1, 0],
+                ["host", 1, "v0.9", 0, "t", None, None],
+                ["host", 1, "v0.9", 0, "t", None, 2],
+                ["host", 1, "v0.9", 0, "t", None, True],
+                [1, 1, "v0.9", 0, "t", None, 0],
+                ["host", 1, None, 0, "t", None, 0],
+                valid])):
+            with self.subTest(data=data):
+                with open(self.path, "wt") as f:
+                    f.write(data)
+                peers = discovery.PeerCache(self.path).load()
+                self.assertEqual(["host"] if "fast" in data else [], [p.host for p in peers])
+        self.assertEqual(0.5, peers[0].rtt)
+        self.assertEqual(0.25, peers[0].failure_rate)
+        self.assertEqual(4, len(list(discovery.load_peer_list(
+            discovery.PeerCache(self.path), PEERS).list_peers())))
+
+
+class PeerDiscoveryTest(unittest.TestCase):
+    def test_merge_keeps_known_peers(self):
+        known = Peer("myelectrum.example.info", 0, "v0.9", 10000, stratum.Protocol.tcp)
+        known.record_rtt(0.1)
+        peer_list = PeerList([known])
+        client = FakeClient(PEERS)
+        discovery.PeerDiscovery(client, peer_list).discover()
+        self.assertEqual([("server.peers.subscribe", [])], client.requests)
+        peers = list(peer_list.list_peers())
+        self.assertEqual(3, len(peers))
+        self.assertIn(known, peers)
+        self.assertEqual(0, peer_list.merge(PeerList.parse(PEERS)))
+
+    def test_discover_on_connection(self):
+        peer_list = PeerList()
+        client = FakeClient(PEERS)
+        fd, path = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        try:
+            cache = discovery.PeerCache(path)
+            discovery.PeerDiscovery(client, peer_list, cache)
+            client.connection_established.emit(client, None)
+            client.connection_established.emit(client, None)
+            self.assertEqual(1, len(client.requests))  # Rate limited
+            self.assertEqual(3, len(cache.load()))
+
+            client.notifications["server.peers.subscribe"].emit(Notification(
+                "server.peers.subscribe",
+                [[['1.1.1.1', 'new.example.org', ['v0.9', 'p100', 't']]]]))
+            self.assertEqual(4, len(cache.load()))
+        finally:
+            os.unlink(path)
+
+    def test_save_periodically(self):
+        peer_list = PeerList(PeerList.parse(PEERS))
+        client = FakeClient(PEERS)
+        fd, path = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        try:
+            cache = discovery.PeerCache(path)
+            peer_discovery = discovery.PeerDiscovery(client, peer_list, cache)
+            timer, = client.loop.timers.pop_due(float("inf"))
+            self.assertEqual(peer_discovery._save_periodically, timer.func)
+            next(iter(peer_list.list_peers())).record_rtt(0.5)
+            timer.func()
+            self.assertEqual([0.5], [p.rtt for p in cache.load() if p.rtt is not None])
+            self.assertEqual(1, len(client.loop.timers))  # Rescheduled
+        finally:
+            os.unlink(path)
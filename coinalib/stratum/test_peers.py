@@ -22,6 +22,8 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import random
+import threading
 import unittest
 
 from coinalib import stratum
@@ -41,6 +43,66 @@ class PeerTest(unittest.TestCase):
         peer.enable()
         self.assertTrue(peer.enabled)
 
+    def test_circuit_breaker(self):
+        peer = Peer("myhost", 1234, "v01", 1024, "x")
+        self.assertEqual(Peer.CLOSED, peer.state)
+        peer.disable()
+        self.assertEqual(Peer.OPEN, peer.state)
+        self.assertGreaterEqual(peer.cooldown, Peer.COOLDOWN / 2)
+        self.assertLessEqual(peer.cooldown, Peer.COOLDOWN)
+        self.assertGreater(peer.retry_delay(), 0)
+
+        # Consecutive failures prolong the cooldown.
+        peer.disable()
+        self.assertGreaterEqual(peer.cooldown, Peer.COOLDOWN)
+        self.assertEqual(2, peer.trips)
+
+        peer.retry_at = 0  # cooldown elapsed
+        self.assertEqual(Peer.HALF_OPEN, peer.state)
+        self.assertTrue(peer.enabled)
+        # Only a single trial is let through.
+        peer.start_trial()
+        self.assertFalse(peer.enabled)
+        peer.enable()
+        self.assertEqual(Peer.CLOSED, peer.state)
+        self.assertEqual(0, peer.trips)
+        self.assertEqual(0, peer.retry_delay())
+
+    def test_score(self):
+        peer = Peer("myhost", 1234, "v01", 1024, "x")
+        self.assertEqual(Peer.UNKNOWN_RTT, peer.score)
+        peer.record_rtt(0.2)
+        self.assertAlmostEqual(0.2, peer.rtt)
+        peer.record_rtt(1.0)
+        self.assertAlmostEqual(0.4, peer.rtt)
+        score = peer.score
+        peer.record_timeout()
+        peer.record_error()
+        self.assertEqual(1, peer.timeouts)
+        self.assertEqual(1, peer.errors)
+        self.assertGreater(peer.score, score)
+        failure_rate = peer.failure_rate
+        peer.record_rtt(0.4)
+        self.assertLess(peer.failure_rate, failure_rate)
+
+    def test_concurrent_updates(self):
+        peer = Peer("myhost", 1234, "v01", 1024, "x")
+
+        def update():
+            for i in range(2000):
+                peer.record_error()
+                peer.disable()
+                peer.record_rtt(0.1)
+                peer.enable()
+
+        threads = [threading.Thread(target=update) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(8000, peer.errors)
+        self.assertEqual(Peer.CLOSED, peer.state)
+
 
 class PeerListTest(unittest.TestCase):
     PEERS = [
@@ -138,3 +200,46 @@ class PeerListTest(unittest.TestCase):
         with self.subTest(protocol=protocol):
             with self.assertRaisesRegex(ValueError, "No enabled peers for any protocol"):
                 peers.get_peer(protocol)
+
+    def test_half_open_peer_trial(self):
+        peers = PeerList(
+            Peer("host{}".format(i), 0, "v0.9", 1000, stratum.Protocol.tcp) for i in range(2))
+        peer = peers.get_peer(stratum.Protocol.tcp)
+        peer.disable()
+        self.assertEqual(0, peers.retry_delay())
+        other = peers.get_peer(stratum.Protocol.tcp)
+        self.assertIsNot(peer, other)
+        other.disable()
+        self.assertGreater(peers.retry_delay(), 0)
+        with self.assertRaises(ValueError):
+            peers.get_peer(stratum.Protocol.tcp)
+
+        peer.retry_at = 0
+        self.assertEqual(0, peers.retry_delay())
+        self.assertIs(peer, peers.get_peer(stratum.Protocol.tcp))
+        with self.assertRaises(ValueError):
+            peers.get_peer(stratum.Protocol.tcp)
+
+    def test_get_peer_prefers_healthy_peers(self):
+        peers = PeerList(
+            Peer("host{}".format(i), 0, "v0.9", 1000, stratum.Protocol.tcp) for i in range(50))
+        dead = list(peers.list_peers())[:45]
+        for peer in dead:
+            peer.restore_circuit(1, 0)  # Half-open after a failure
+        for i in range(100):
+            self.assertNotIn(peers.get_peer(stratum.Protocol.tcp), dead)
+
+    def test_get_peer_prefers_fast_peers(self):
+        peers = PeerList(
+            Peer("host{}".format(i), 0, "v0.9", 1000, stratum.Protocol.tcp) for i in range(5))
+        for i, peer in enumerate(peers.list_peers()):
+            peer.record_rtt(0.1 if i == 0 else 2.0)
+        fast = next(peers.list_peers())
+        slow_peer = list(peers.list_peers())[-1]
+        slow_peer.prunning = 100  # lower pruning tier is never chosen
+        slow_peer.record_rtt(0.01)
+        random.seed(1)
+        picks = [peers.get_peer(stratum.Protocol.tcp) for i in range(200)]
+        self.assertNotIn(slow_peer, picks)
+        # The fastest peer wins whenever it is one of the two candidates: 1 - (3/4 * 2/3).
+        self.assertGreater(picks.count(fast), 70)
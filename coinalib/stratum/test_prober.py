@@ -0,0 +1,78 @@
+# coding: utf-8
+
+# Copyright 2015 Jiří Janoušek <janousek.jiri@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import unittest
+
+from coinalib import stratum
+from coinalib.stratum import exceptions
+from coinalib.stratum import prober
+from coinalib.stratum.peers import Peer
+from coinalib.stratum.test_transports import (
+    FakeElectrumServer, FakeHttpElectrumServer, echo_handler)
+
+
+class PeerProberTest(unittest.TestCase):
+    def setUp(self):
+        self.servers = [FakeElectrumServer(echo_handler), FakeHttpElectrumServer()]
+        for server in self.servers:
+            server.start()
+
+    def tearDown(self):
+        for server in self.servers:
+            server.close()
+
+    def test_probe_all(self):
+        socket_server, http_server = self.servers
+        alive = [
+            Peer("127.0.0.1", socket_server.port, "v0.9", 0, stratum.Protocol.tcp),
+            Peer("127.0.0.1", http_server.port, "v0.9", 0, stratum.Protocol.http),
+        ]
+        dead = Peer("127.0.0.1", 1, "v0.9", 0, stratum.Protocol.tcp)
+        received = []
+        results = prober.PeerProber(timeout=2, max_workers=2).probe_all(
+            alive + [dead], received.append)
+        self.assertEqual(results, received)
+        results = {result.peer: result for result in results}
+
+        self.assertEqual("1.0", results[alive[0]].server_version)
+        self.assertEqual(["1.9.5", "0.9"], results[alive[1]].server_version)
+        for peer in alive:
+            self.assertIsNone(results[peer].error)
+            self.assertTrue(peer.enabled)
+            self.assertIsNotNone(peer.rtt)
+
+        self.assertIsNotNone(results[dead].error)
+        self.assertFalse(dead.enabled)
+        self.assertEqual(1, dead.errors)
+
+    def test_invalid_response(self):
+        server = FakeElectrumServer(lambda message: [[message["id"]]])
+        server.start()
+        try:
+            peer = Peer("127.0.0.1", server.port, "v0.9", 0, stratum.Protocol.tcp)
+            result = prober.PeerProber(timeout=2).probe(peer)
+        finally:
+            server.close()
+        self.assertIsInstance(result.error, exceptions.ValueError)
+        self.assertFalse(peer.enabled)
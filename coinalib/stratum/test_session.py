@@ -0,0 +1,279 @@
+# coding: utf-8
+
+# Copyright 2015 Jiří Janoušek <janousek.jiri@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import queue
+import threading
+import time
+import unittest
+
+from coinalib.stratum import exceptions
+from coinalib.stratum import Priority
+from coinalib.stratum.session import RequestHandle, Session, SessionListener
+
+
+class RecordingListener(SessionListener):
+    def __init__(self):
+        self.responses = []
+
+    def on_respose_received(self, session, request, response, error):
+        self.responses.append((request.id, response, error))
+
+
+class SessionTest(unittest.TestCase):
+    def test_priority_lanes(self):
+        session = Session()
+        bulk = [session.enqueue_request("bulk", [i], None, priority=Priority.bulk)
+                for i in range(40)]
+        normal = session.enqueue_request("normal", [], None)
+        interactive = session.enqueue_request("click", [], None, priority=Priority.interactive)
+        self.assertEqual(interactive, session.pop_request().id)
+        self.assertEqual(normal, session.pop_request().id)
+        self.assertEqual(bulk[:2], [r.id for r in session.pop_requests(2)])
+
+        # Interactive requests take 16 of 17 turns, bulk ones aren't starved.
+        ids = [session.enqueue_request("click", [i], None, priority=Priority.interactive)
+               for i in range(32)]
+        popped = [r.id for r in session.pop_requests(34)]
+        self.assertEqual(bulk[2:4], [i for i in popped if i in bulk])
+        self.assertEqual(ids, [i for i in popped if i in ids])
+
+    def test_raise_priority(self):
+        session = Session()
+        first = session.enqueue_request("bulk", [1], None, priority=Priority.bulk)
+        second = session.enqueue_request("bulk", [2], None, priority=Priority.bulk)
+        self.assertTrue(session.raise_priority(second, Priority.interactive))
+        self.assertFalse(session.raise_priority(second, Priority.normal))
+        self.assertEqual([second, first], [r.id for r in session.pop_requests(10)])
+        self.assertFalse(session.raise_priority(first, Priority.interactive))
+        session.restart_unprocessed()
+        self.assertEqual([second, first], [r.id for r in session.pop_requests(10)])
+
+    def test_pop_request(self):
+        session = Session()
+        with self.assertRaises(queue.Empty):
+            session.pop_request()
+        first = session.enqueue_request("foo", [], None)
+        second = session.enqueue_request("bar", [1], None)
+        self.assertEqual(first, session.pop_request().id)
+        self.assertEqual(second, session.pop_request().id)
+        self.assertEqual({first, second}, set(session.in_progress))
+
+    def test_pop_requests(self):
+        session = Session()
+        ids = [session.enqueue_request("foo", [i], None) for i in range(5)]
+        self.assertEqual(ids[:3], [r.id for r in session.pop_requests(3)])
+        self.assertEqual(ids[3:], [r.id for r in session.pop_requests(3)])
+        with self.assertRaises(queue.Empty):
+            session.pop_requests(3)
+
+    def test_in_flight_window(self):
+        session = Session(max_in_flight=2)
+        ids = [session.enqueue_request("foo", [i], None) for i in range(4)]
+        self.assertEqual(ids[:2], [r.id for r in session.pop_requests(10)])
+        with self.assertRaises(queue.Empty):
+            session.pop_request()
+        with self.assertRaises(queue.Empty):
+            session.pop_request(block=True, timeout=0.01)
+
+        timer = threading.Timer(
+            0.05, session.deliver_response, (session.get_request(ids[0]), None, None))
+        timer.start()
+        self.assertEqual(ids[2], session.pop_request(block=True, timeout=5).id)
+        timer.join()
+
+    def test_wakers(self):
+        session = Session(max_in_flight=1)
+        calls = []
+        waker = lambda: calls.append(True)  # noqa
+        session.add_waker(waker)
+        request_id = session.enqueue_request("foo", [], None)
+        self.assertEqual(1, len(calls))
+        session.deliver_response(session.pop_request(), None, None)
+        self.assertEqual(2, len(calls))
+        session.remove_waker(waker)
+        session.enqueue_request("foo", [], None)
+        self.assertEqual(2, len(calls))
+        self.assertEqual(request_id + 1, session.pop_request().id)
+
+    def test_restart_unprocessed(self):
+        session = Session()
+        ids = [session.enqueue_request("foo", [i], None) for i in range(4)]
+        session.pop_requests(3)
+        session.restart_unprocessed()
+        self.assertFalse(session.in_progress)
+        self.assertEqual(ids, [r.id for r in session.pop_requests(10)])
+
+    def test_cancel_queued(self):
+        session = Session()
+        first = session.enqueue_request("foo", [], None)
+        second = session.enqueue_request("foo", [], None)
+        self.assertTrue(RequestHandle(session, first).cancel())
+        self.assertFalse(RequestHandle(session, first).cancel())
+        self.assertEqual(second, session.pop_request().id)
+        with self.assertRaises(queue.Empty):
+            session.pop_request()
+
+    def test_cancel_in_progress(self):
+        session = Session(max_in_flight=1)
+        listener = RecordingListener()
+        session.add_listener(listener)
+        first = session.enqueue_request("foo", [], None)
+        second = session.enqueue_request("foo", [], None)
+        request = session.pop_request()
+        self.assertTrue(session.cancel_request(first))
+        self.assertEqual(second, session.pop_request().id)
+        session.deliver_response(request, None, None)
+        self.assertEqual([], listener.responses)
+
+    def test_expire_requests(self):
+        session = Session(default_timeout=10)
+        listener = RecordingListener()
+        session.add_listener(listener)
+        now = time.monotonic()
+        queued = session.enqueue_request("foo", [], None)
+        in_progress = session.enqueue_request("bar", [], None, timeout=5)
+        session.enqueue_request("baz", [], None, timeout=20)
+        session.pop_requests(2)
+        self.assertLess(session.next_deadline(), now + 10)
+
+        self.assertEqual(0, session.expire_requests(now + 1))
+        self.assertEqual(1, session.expire_requests(now + 6))
+        self.assertEqual(in_progress, listener.responses[0][0])
+        self.assertIsInstance(listener.responses[0][2], exceptions.RequestTimeout)
+        self.assertEqual(1, session.expire_requests(now + 11))
+        self.assertEqual(queued, listener.responses[1][0])
+        self.assertNotIn(queued, session.in_progress)
+        self.assertNotIn(in_progress, session.in_progress)
+        self.assertGreater(session.next_deadline(), now + 11)
+
+    def test_finished_requests_dont_expire(self):
+        session = Session(default_timeout=1)
+        listener = RecordingListener()
+        session.add_listener(listener)
+        for i in range(100):
+            session.enqueue_request("foo", [], None)
+            session.deliver_response(session.pop_request(), None, None)
+        self.assertIsNone(session.next_deadline())
+        self.assertEqual(0, session.expire_requests(time.monotonic() + 2))
+        self.assertEqual(100, len(listener.responses))
+
+    def test_hedge(self):
+        session = Session(hedge_percentile=90, min_hedge_delay=1)
+        listener = RecordingListener()
+        session.add_listener(listener)
+        first, second = object(), object()
+        request_id = session.enqueue_request("blockchain.address.get_balance", ["a"], None)
+        subscription = session.enqueue_request("blockchain.address.subscribe", ["a"], None)
+        request = session.pop_request(transport=first)
+        session.pop_request(transport=first)
+        now = time.monotonic()
+
+        session.expire_requests(now + 0.5)
+        with self.assertRaises(queue.Empty):
+            session.pop_request(transport=second)
+
+        session.expire_requests(now + 1.5)
+        with self.assertRaises(queue.Empty):
+            session.pop_request(transport=first)
+        copy = session.pop_request(transport=second)
+        self.assertNotEqual(request_id, copy.id)
+        self.assertIn(b'"blockchain.address.get_balance"', copy.data)
+        with self.assertRaises(queue.Empty):
+            session.pop_request(transport=second)  # subscriptions are never hedged
+
+        session.deliver_response(copy, "copy", None)
+        session.deliver_response(request, "original", None)
+        self.assertEqual([(copy.id, "copy", None)], listener.responses)
+        self.assertEqual([subscription], list(session.in_progress))
+        self.assertEqual(1, len(session.latency.samples))
+
+    def test_hedge_restart_unprocessed(self):
+        session = Session(hedge_percentile=90, min_hedge_delay=0)
+        first, second = object(), object()
+        session.enqueue_request("foo", [], None)
+        session.enqueue_request("bar", [], None)
+        request = session.pop_request(transport=first)
+        session.expire_requests()
+        copy = session.pop_request(transport=second)
+        other = session.pop_request(transport=first)
+
+        session.restart_unprocessed(first)
+        self.assertEqual({copy.id}, set(session.in_progress))
+        self.assertEqual([request.id, other.id], [r.id for r in session.pop_requests(5)])
+
+        session.cancel_request(request.id)
+        self.assertEqual({other.id}, set(session.in_progress))
+
+    def test_least_outstanding(self):
+        session = Session()
+        first, second = object(), object()
+        session.transport_functional(first)
+        session.transport_functional(second)
+        for i in range(5):
+            session.enqueue_request("foo", [i], None)
+
+        a = session.pop_request(transport=first)
+        with self.assertRaises(queue.Empty):
+            session.pop_request(transport=first)
+        session.pop_request(transport=second)
+        session.pop_request(transport=second)
+        with self.assertRaises(queue.Empty):
+            session.pop_request(transport=second)
+        session.pop_request(transport=first)
+        self.assertEqual(2, session.outstanding[first])
+
+        session.deliver_response(a, None, None)
+        self.assertEqual(1, session.outstanding[first])
+        with self.assertRaises(queue.Empty):
+            session.pop_request(transport=second)
+        session.pop_request(transport=first)
+
+        session.remove_transport(first)
+        session.restart_unprocessed(first)
+        self.assertNotIn(first, session.outstanding)
+        self.assertEqual(2, len(session.pop_requests(5, transport=second)))
+
+    def test_batches_with_two_transports(self):
+        session = Session()
+        first, second = object(), object()
+        session.transport_functional(first)
+        session.transport_functional(second)
+        for i in range(500):
+            session.enqueue_request("foo", [i], None)
+        sizes = []
+        while session.queued:
+            transport = (first, second)[len(sizes) % 2]
+            sizes.append(len(session.pop_requests(100, transport=transport)))
+        self.assertEqual([100, 100, 100, 100, 50, 50], sizes)
+
+        # A short queue is split evenly.
+        session = Session()
+        session.transport_functional(first)
+        session.transport_functional(second)
+        for i in range(7):
+            session.enqueue_request("foo", [i], None)
+        self.assertEqual(4, len(session.pop_requests(100, transport=first)))
+        with self.assertRaises(queue.Empty):
+            session.pop_requests(100, transport=first)
+        self.assertEqual(3, len(session.pop_requests(100, transport=second)))
@@ -0,0 +1,135 @@
+# coding: utf-8
+
+# Copyright 2015 Jiří Janoušek <janousek.jiri@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import json
+import unittest
+
+from coinalib.stratum import codec
+from coinalib.stratum import exceptions
+from coinalib.stratum import stream
+
+MESSAGES = [
+    {"id": 1, "result": [{"tx_hash": "ab" * 32, "height": 1}, {"tx_hash": "cd" * 32}]},
+    {"id": 2, "error": [1, "bad \"request\" [{"]},
+    {"method": "blockchain.headers.subscribe", "params": [{"block_height": 2}]},
+]
+
+
+def feed_chunks(decoder, data, size):
+    entries = []
+    for i in range(0, len(data), size):
+        entries += decoder.feed(data[i:i + size])
+    return entries + decoder.close()
+
+
+class LineDecoderTest(unittest.TestCase):
+    def test_chunks(self):
+        data = b"".join(json.dumps(m).encode() + b"\n" for m in MESSAGES)
+        data += b"\n" + json.dumps(MESSAGES[:2]).encode() + b"\n"
+        for name in sorted(codec.CODECS):
+            for size in (1, 5, len(data)):
+                with self.subTest(codec=name, size=size):
+                    decoder = stream.LineDecoder(codec.get_codec(name))
+                    self.assertEqual(MESSAGES + MESSAGES[:2], feed_chunks(decoder, data, size))
+
+    def test_max_size(self):
+        decoder = stream.LineDecoder(max_size=10)
+        self.assertEqual([{"id": 1}], decoder.feed(b'{"id": 1}\n{"id"'))
+        with self.assertRaises(exceptions.ValueError):
+            decoder.feed(b": 12345678")
+
+    def test_invalid(self):
+        with self.assertRaises(exceptions.ValueError):
+            stream.LineDecoder().feed(b"{]\n")
+
+
+class JsonStreamDecoderTest(unittest.TestCase):
+    def test_batch(self):
+        data = b" \n" + json.dumps(MESSAGES, indent=1).encode()
+        for name in sorted(codec.CODECS):
+            for size in (1, 7, len(data)):
+                with self.subTest(codec=name, size=size):
+                    decoder = stream.JsonStreamDecoder(codec.get_codec(name))
+                    self.assertEqual(MESSAGES, feed_chunks(decoder, data, size))
+
+    def test_batch_is_decoded_incrementally(self):
+        decoder = stream.JsonStreamDecoder()
+        first = json.dumps(MESSAGES[0]).encode()
+        self.assertEqual([], decoder.feed(b"[" + first[:-1]))
+        self.assertEqual([MESSAGES[0]], decoder.feed(b"}, " + first[:10]))
+        # Only the incomplete message is buffered.
+        self.assertEqual(first[:10], bytes(decoder._buf))
+
+    def test_padded_batch(self):
+        # Chunks ending inside long runs of whitespace or digits must not slow the scan down.
+        messages = [
+            {"id": 1, "result": 1234567890123456789, "error": None},
+            {"id": 2, "result": ["ab" * 32, 0.12345678901234567890123456789]},
+        ]
+        data = json.dumps(messages, indent=8).replace("\n", " " * 40 + "\n").encode()
+        messages = json.loads(data.decode())
+        digits = data.index(b"0.1234567890")
+        spaces = data.index(b" " * 40, digits)
+        decoder = stream.JsonStreamDecoder()
+        entries = decoder.feed(data[:digits + 25])
+        entries += decoder.feed(data[digits + 25:spaces + 30])
+        entries += decoder.feed(data[spaces + 30:])
+        self.assertEqual(messages, entries + decoder.close())
+        for size in (1, 13, 64):
+            with self.subTest(size=size):
+                decoder = stream.JsonStreamDecoder()
+                self.assertEqual(messages, feed_chunks(decoder, data, size))
+
+    def test_long_string_is_scanned_once(self):
+        message = {"id": 1, "result": "ab" * 100000 + '\\"'}
+        data = json.dumps([message]).encode()
+        decoder = stream.JsonStreamDecoder()
+        entries = []
+        for i in range(0, len(data) - 1, 1000):
+            entries += decoder.feed(data[i:i + 1000])
+            if decoder._in_string and data[i + 999:i + 1000] != b"\\":
+                # Scanning resumes where the chunk ended.
+                self.assertEqual(len(decoder._buf), decoder._pos)
+        self.assertEqual([message], entries + decoder.close())
+
+    def test_single_message(self):
+        data = json.dumps(MESSAGES[1]).encode()
+        decoder = stream.JsonStreamDecoder()
+        self.assertEqual([MESSAGES[1]], feed_chunks(decoder, data, 3))
+        self.assertEqual([], stream.JsonStreamDecoder().close())
+
+    def test_incomplete(self):
+        decoder = stream.JsonStreamDecoder()
+        decoder.feed(b'[{"id": 1}, {"id": ')
+        with self.assertRaises(exceptions.ValueError):
+            decoder.close()
+        decoder.feed(b'{"id": ')
+        with self.assertRaises(exceptions.ValueError):
+            decoder.close()
+
+    def test_max_size(self):
+        decoder = stream.JsonStreamDecoder(max_size=20)
+        self.assertEqual([{"id": 1}, {"id": 2}], decoder.feed(b'[{"id": 1}, {"id": 2}, '))
+        with self.assertRaises(exceptions.ValueError):
+            decoder.feed(b'{"id": 3, "result": "1234567890"')
@@ -0,0 +1,138 @@
+# coding: utf-8
+
+# Copyright 2015 Jiří Janoušek <janousek.jiri@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import unittest
+
+from coinalib.stratum import client as m_client
+from coinalib.stratum import exceptions
+from coinalib.stratum import utils
+from coinalib.stratum.transports import Notification, Response
+
+
+class FakeTransportPool:
+    def __init__(self):
+        self.transports = []
+
+
+class FakeTransport:
+    is_functional = True
+
+
+class SubscriptionRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = utils.SimpleLoop()
+        self.pool = FakeTransportPool()
+        self.client = m_client.StratumClient(self.pool, self.loop)
+        self.session = self.client.session
+        self.registry = self.client.subscriptions
+        self.changes = []
+
+    def on_change(self, subscription, value, name):
+        self.changes.append((name, subscription.method, value))
+
+    def run_loop(self):
+        self.loop.call_soon(self.loop.stop)
+        self.loop.run()
+
+    def answer_all(self, result=lambda request: None):
+        requests = self.session.pop_requests(10000)
+        for request in requests:
+            self.session.deliver_response(request, Response(request.id, result(request)), None)
+        self.run_loop()
+        return requests
+
+    def test_subscribe_and_route(self):
+        method = "blockchain.address.subscribe"
+        self.registry.subscribe(method, ["1abc"], self.on_change, "a")
+        self.registry.subscribe(method, ["1xyz"], self.on_change, "x")
+        self.registry.subscribe("blockchain.headers.subscribe", [], self.on_change, "h")
+        self.answer_all(lambda request: "status" if request.params else {"block_height": 1})
+        self.assertEqual(3, len(self.changes))
+
+        self.changes.clear()
+        self.client.on_notification_received(
+            self.session, Notification(method, ["1xyz", "new status"]))
+        self.client.on_notification_received(self.session, Notification(
+            "blockchain.headers.subscribe", [{"block_height": 2}]))
+        self.client.on_notification_received(
+            self.session, Notification(method, ["1unknown", "status"]))
+        self.assertEqual([
+            ("x", method, "new status"),
+            ("h", "blockchain.headers.subscribe", {"block_height": 2})], self.changes)
+
+    def test_shared_subscription(self):
+        method = "blockchain.address.subscribe"
+        self.registry.subscribe(method, ["1abc"], self.on_change, "first")
+        self.answer_all(lambda request: "status")
+        handle = self.registry.subscribe(method, ["1abc"], self.on_change, "second")
+        self.assertEqual(0, len(self.session.queued))  # No new request
+        self.run_loop()
+        self.assertEqual(
+            [("first", method, "status"), ("second", method, "status")], self.changes)
+
+        self.registry.unsubscribe(handle)
+        self.client.on_notification_received(self.session, Notification(method, ["1abc", "x"]))
+        self.assertEqual(("first", method, "x"), self.changes[-1])
+        self.assertEqual(3, len(self.changes))
+
+    def test_failed_subscription(self):
+        method = "blockchain.address.subscribe"
+        failures = []
+        subscription, handler = self.registry.subscribe(method, ["1abc"], self.on_change, "a")
+        subscription.failed.connect(lambda subscription, error: failures.append(error))
+        request = self.session.pop_request()
+        error = exceptions.MessageError(1, "unknown method")
+        self.session.deliver_response(request, None, error)
+        self.run_loop()
+        self.assertEqual([error], failures)
+        self.assertEqual([], self.changes)
+        self.assertNotIn(subscription.key, self.registry.subscriptions)
+
+        # A later caller sends the subscribe request again.
+        self.registry.subscribe(method, ["1abc"], self.on_change, "b")
+        self.answer_all(lambda request: "status")
+        self.assertEqual([("b", method, "status")], self.changes)
+
+    def test_replay_after_connection_loss(self):
+        for i in range(100):
+            self.registry.subscribe(
+                "blockchain.address.subscribe", ["1addr{}".format(i)], self.on_change, i)
+        self.answer_all(lambda request: "status")
+        self.assertEqual(100, len(self.changes))
+
+        # All connections lost: replay once the next one is established.
+        self.client.connection_lost.emit(self.client, FakeTransport())
+        self.assertEqual(0, len(self.session.queued))
+        transport = FakeTransport()
+        self.pool.transports.append(transport)
+        self.client.connection_established.emit(self.client, transport)
+        self.client.connection_established.emit(self.client, FakeTransport())
+        requests = self.answer_all(lambda request: "status")
+        self.assertEqual(100, len(requests))
+        # Unchanged values aren't announced again.
+        self.assertEqual(100, len(self.changes))
+
+        # Another connection is still alive: replay right away.
+        self.client.connection_lost.emit(self.client, FakeTransport())
+        self.assertEqual(100, len(self.session.queued))
@@ -0,0 +1,69 @@
+# coding: utf-8
+
+# Copyright 2015 Jiří Janoušek <janousek.jiri@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import tempfile
+import unittest
+
+from coinalib import stratum
+from coinalib.stratum import trace
+from coinalib.stratum.peers import Peer
+
+
+class TraceTest(unittest.TestCase):
+    def setUp(self):
+        self.peer = Peer("myhost", 1234, "v0.9", 0, stratum.Protocol.tcp)
+
+    def tearDown(self):
+        trace.disable()
+
+    def test_disabled(self):
+        self.assertFalse(trace.level)
+        trace.record(trace.SENT, self.peer, b"{}")  # no sink, no error
+
+    def test_ring_buffer(self):
+        buffer = trace.RingBuffer(2)
+        trace.enable(buffer)
+        for i in range(3):
+            trace.record(trace.SENT, self.peer, '{{"id": {}}}\n'.format(i).encode())
+        self.assertEqual(2, len(buffer.entries))
+        self.assertIsNone(buffer.entries[0].data)
+        self.assertTrue(buffer.lines()[0].endswith(" > myhost:1234 10B"))
+
+        trace.enable(buffer, trace.PAYLOAD)
+        trace.record(trace.RECEIVED, self.peer, b'{"id": 3}\n')
+        self.assertTrue(buffer.lines()[-1].endswith(' < myhost:1234 10B {"id": 3}'))
+
+    def test_rotating_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "wire.log")
+            sink = trace.RotatingFile(path, max_bytes=100, backups=2)
+            trace.enable(sink, trace.PAYLOAD)
+            for i in range(10):
+                trace.record(trace.SENT, self.peer, b"x" * 20)
+            sink.close()
+            self.assertEqual(
+                ["wire.log", "wire.log.1", "wire.log.2"], sorted(os.listdir(directory)))
+            for name in os.listdir(directory):
+                self.assertLessEqual(os.path.getsize(os.path.join(directory, name)), 100)
@@ -0,0 +1,420 @@
+# coding: utf-8
+
+# Copyright 2015 Jiří Janoušek <janousek.jiri@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import http.server
+import json
+import os
+import queue
+import shutil
+import socket
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+
+from coinalib import stratum
+from coinalib.stratum import exceptions
+from coinalib.stratum import session as m_session
+from coinalib.stratum import transports
+from coinalib.stratum.peers import Peer, PeerList
+
+
+class FakeElectrumServer(threading.Thread):
+    def __init__(self, handler):
+        super().__init__(daemon=True)
+        self.handler = handler
+        self.listener = socket.socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(1)
+        self.port = self.listener.getsockname()[1]
+        self.conn = None
+        self.received = queue.Queue()
+
+    def run(self):
+        self.conn, addr = self.listener.accept()
+        with self.conn, self.conn.makefile("rb") as reader:
+            for line in reader:
+                message = json.loads(line.decode("utf-8"))
+                if message["id"]:
+                    self.received.put(message)
+                for reply in self.handler(message):
+                    self.send(reply)
+
+    def send(self, message):
+        self.conn.sendall(json.dumps(message).encode("utf-8") + b"\n")
+
+    def close(self):
+        self.listener.close()
+        if self.conn:
+            try:
+                self.conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass  # Already closed
+
+
+class FakeHttpElectrumServer(threading.Thread):
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.bodies = []
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])).decode())
+                server.bodies.append(body)
+                if isinstance(body, list):
+                    reply = [{"id": m["id"], "result": m["params"]} for m in body]
+                else:
+                    reply = {"id": body["id"], "result": body["params"]}
+                data = json.dumps(reply).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = http.server.HTTPServer(("127.0.0.1", 0), Handler)
+        self.port = self.httpd.server_address[1]
+
+    def run(self):
+        self.httpd.serve_forever()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class QueueListener(m_session.SessionListener):
+    def __init__(self):
+        self.events = queue.Queue()
+
+    def on_notification_received(self, session, notification):
+        self.events.put(("notification", notification))
+
+    def on_transport_aborted(self, session, transport, exception):
+        self.events.put(("aborted", exception))
+
+    def on_transport_functional(self, session, transport):
+        self.events.put(("functional", transport))
+
+    def on_respose_received(self, session, request, response, error):
+        self.events.put(("response", request.id, response and response.response, error))
+
+    def get(self):
+        return self.events.get(timeout=5)
+
+
+def echo_handler(message):
+    if message["method"] == "server.version":
+        yield {"id": message["id"], "result": "1.0"}
+    elif message["method"] == "blockchain.headers.subscribe":
+        yield {"id": message["id"], "result": {"block_height": 1}}
+        yield {"method": message["method"], "params": [{"block_height": 2}]}
+    elif message["method"] == "hang":
+        pass
+    else:
+        yield {"id": message["id"], "error": [1, "unknown method"]}
+
+
+class TransportPoolTest(unittest.TestCase):
+    def test_transport_options(self):
+        peers = PeerList([
+            Peer("127.0.0.1", 1, "v0.9", 0, stratum.Protocol.tcp),
+            Peer("127.0.0.1", 2, "v0.9", 0, stratum.Protocol.http),
+        ])
+        pool = transports.TransportPool(peers, max_in_flight=3, batch_limit=7)
+        for protocol in (stratum.Protocol.tcp, stratum.Protocol.http):
+            with self.subTest(protocol=protocol):
+                self.assertEqual(3, pool.get_transport(protocol).max_in_flight)
+        self.assertEqual(7, pool.get_transport(stratum.Protocol.http).batch_limit)
+
+
+class SocketTransportTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeElectrumServer(echo_handler)
+        self.server.start()
+        self.session = m_session.Session()
+        self.listener = QueueListener()
+        self.session.add_listener(self.listener)
+        peer = Peer("127.0.0.1", self.server.port, "v0.9", 0, stratum.Protocol.tcp)
+        self.transport = transports.create_transport(peer)
+        self.assertIsInstance(self.transport, transports.SocketTransportThread)
+
+    def tearDown(self):
+        if self.transport.running:
+            self.transport.stop()
+        self.transport.join(5)
+        self.server.close()
+
+    def test_request_and_notification(self):
+        self.transport.start(self.session)
+        self.assertEqual("functional", self.listener.get()[0])
+
+        request_id = self.session.enqueue_request("blockchain.headers.subscribe", [], None)
+        self.assertEqual(
+            ("response", request_id, {"block_height": 1}, None), self.listener.get())
+        event, notification = self.listener.get()
+        self.assertEqual("notification", event)
+        self.assertEqual("blockchain.headers.subscribe", notification.method)
+        self.assertEqual([{"block_height": 2}], notification.params)
+
+        request_id = self.session.enqueue_request("foo.bar", [], None)
+        event, response_id, result, error = self.listener.get()
+        self.assertEqual(request_id, response_id)
+        self.assertEqual(1, error.code)
+        self.assertFalse(self.session.in_progress)
+
+    def test_in_flight_window(self):
+        self.transport = transports.create_transport(self.transport.peer, max_in_flight=2)
+        self.transport.start(self.session)
+        self.assertEqual("functional", self.listener.get()[0])
+        for i in range(2):
+            self.session.enqueue_request("hang", [], None)
+        for i in range(3):
+            self.session.enqueue_request("server.version", [], None)
+        hanging = [self.server.received.get(timeout=5)["id"] for i in range(2)]
+        with self.assertRaises(queue.Empty):
+            self.server.received.get(timeout=0.2)
+        self.assertEqual(3, len(self.session.queued))
+
+        self.server.send({"id": hanging[0], "result": None})
+        self.assertEqual(hanging[0], self.listener.get()[1])
+        for i in range(3):
+            self.assertEqual("server.version", self.server.received.get(timeout=5)["method"])
+            self.listener.get()
+        self.server.send({"id": hanging[1], "result": None})
+        self.assertEqual(hanging[1], self.listener.get()[1])
+        self.assertFalse(self.session.in_progress)
+
+    def test_request_timeout(self):
+        self.transport.start(self.session)
+        self.assertEqual("functional", self.listener.get()[0])
+        request_id = self.session.enqueue_request("hang", [], None, timeout=0.1)
+        event, response_id, result, error = self.listener.get()
+        self.assertEqual(request_id, response_id)
+        self.assertIsInstance(error, exceptions.RequestTimeout)
+        self.assertFalse(self.session.in_progress)
+
+    def test_connection_closed(self):
+        self.transport.start(self.session)
+        self.assertEqual("functional", self.listener.get()[0])
+        self.session.enqueue_request("server.version", [], None)
+        self.listener.get()
+        self.server.close()
+        event, exception = self.listener.get()
+        self.assertEqual("aborted", event)
+        self.assertIsInstance(exception, exceptions.ConnectionError)
+
+
+class HttpTransportTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeHttpElectrumServer()
+        self.server.start()
+        self.session = m_session.Session()
+        self.listener = QueueListener()
+        self.session.add_listener(self.listener)
+        peer = Peer("127.0.0.1", self.server.port, "v0.9", 0, stratum.Protocol.http)
+        self.transport = transports.create_transport(peer)
+
+    def tearDown(self):
+        if self.transport.running:
+            self.transport.stop()
+        self.transport.join(5)
+        self.server.close()
+
+    def test_batch(self):
+        self.transport = transports.create_transport(self.transport.peer, batch_limit=3)
+        ids = [self.session.enqueue_request("echo", [i], None) for i in range(5)]
+        self.transport.start(self.session)
+        self.assertEqual("functional", self.listener.get()[0])
+        responses = {}
+        for i in range(5):
+            event, request_id, result, error = self.listener.get()
+            responses[request_id] = result
+        self.assertEqual({request_id: [i] for i, request_id in enumerate(ids)}, responses)
+        batches = [body for body in self.server.bodies if isinstance(body, list)]
+        self.assertEqual([3, 2], [len(batch) for batch in batches])
+
+
+class ConnectionCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.listener = socket.socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(5)
+        self.listener.settimeout(5)
+        port = self.listener.getsockname()[1]
+        self.peer = Peer("127.0.0.1", port, "v0.9", 0, stratum.Protocol.tcp)
+        self.cache = transports.ConnectionCache()
+
+    def tearDown(self):
+        self.cache.close()
+        self.listener.close()
+
+    def warm_up(self):
+        self.cache.warm_up(self.peer)
+        conn, addr = self.listener.accept()
+        for i in range(100):
+            if self.cache.count_idle():
+                break
+            time.sleep(0.01)
+        self.assertEqual(1, self.cache.count_idle())
+        return conn
+
+    def test_reuse_warm_connection(self):
+        conn = self.warm_up()
+        self.assertIs(self.peer, self.cache.get_warm_peer())
+        self.assertIsNone(self.cache.get_warm_peer({"127.0.0.1"}))
+        # Handshakes aren't mixed into the round-trip time of requests.
+        self.assertIsNone(self.peer.rtt)
+        self.assertTrue(self.peer.enabled)
+
+        sock = self.cache.acquire(self.peer, self.peer.port, False, 5)
+        self.assertEqual(0, self.cache.count_idle())
+        sock.sendall(b"hello")
+        self.assertEqual(b"hello", conn.recv(5))
+        sock.close()
+        conn.close()
+
+    def test_closed_connection_discarded(self):
+        conn = self.warm_up()
+        conn.close()
+        time.sleep(0.05)
+        sock = self.cache.acquire(self.peer, self.peer.port, False, 5)
+        conn, addr = self.listener.accept()  # A new connection was opened
+        sock.sendall(b"hello")
+        self.assertEqual(b"hello", conn.recv(5))
+        sock.close()
+        conn.close()
+
+    def test_expired_connection_replaced(self):
+        conn = self.warm_up()
+        self.cache.MAX_IDLE = 0
+        time.sleep(0.01)
+        self.assertEqual(1, self.cache.prune())
+        self.assertEqual(0, self.cache.count_idle())
+        conn.close()
+
+        self.cache.MAX_IDLE = 60
+        pool = transports.TransportPool(PeerList([self.peer]))
+        pool.connections = self.cache
+        pool.warm_up()
+        conn, addr = self.listener.accept()
+        for i in range(100):
+            if self.cache.count_idle():
+                break
+            time.sleep(0.01)
+        self.assertEqual(1, self.cache.count_idle())
+        conn.close()
+
+
+class TlsServer(threading.Thread):
+    """Accepts TLS 1.3 connections and echoes received lines."""
+
+    def __init__(self, certfile):
+        super().__init__(daemon=True)
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.minimum_version = ssl.TLSVersion.TLSv1_3
+        context.load_cert_chain(certfile)
+        self.listener = context.wrap_socket(
+            socket.create_server(("127.0.0.1", 0)), server_side=True)
+        self.port = self.listener.getsockname()[1]
+
+    def run(self):
+        while True:
+            try:
+                conn, addr = self.listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.echo, args=(conn,), daemon=True).start()
+
+    def echo(self, conn):
+        with conn, conn.makefile("rb") as reader:
+            try:
+                for line in reader:
+                    conn.sendall(line)
+            except OSError:
+                pass
+
+    def close(self):
+        self.listener.close()
+
+
+@unittest.skipUnless(shutil.which("openssl"), "openssl is needed to create a certificate")
+class TlsConnectionCacheTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.certfile = os.path.join(cls.tmpdir, "cert.pem")
+        subprocess.check_call([
+            "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+            "-subj", "/CN=localhost", "-keyout", cls.certfile, "-out", cls.certfile],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir)
+
+    def setUp(self):
+        self.server = TlsServer(self.certfile)
+        self.server.start()
+        self.peer = Peer("127.0.0.1", self.server.port, "v0.9", 0, stratum.Protocol.ssl)
+        self.cache = transports.ConnectionCache()
+
+    def tearDown(self):
+        self.cache.close()
+        self.server.close()
+
+    def echo(self, sock):
+        sock.sendall(b"hello\n")
+        self.assertEqual(b"hello\n", sock.recv(6))
+
+    def test_warm_ssl_connection_is_reused(self):
+        self.cache.warm_up(self.peer)
+        for i in range(100):
+            if self.cache.count_idle():
+                break
+            time.sleep(0.01)
+        time.sleep(0.05)  # Session tickets arrive after the handshake.
+        self.assertEqual(0, self.cache.prune())
+        self.assertEqual(1, self.cache.count_idle())
+        sock = self.cache.acquire(self.peer, self.peer.port, True, 5)
+        self.assertEqual(0, self.cache.count_idle())
+        self.echo(sock)
+        sock.close()
+
+    def test_session_resumption(self):
+        sock = self.cache.connect(self.peer, self.peer.port, True, 5)
+        self.echo(sock)
+        self.cache.save_tls_session(self.peer.host, self.peer.port, sock)
+        sock.close()
+        for i in range(2):
+            sock = self.cache.connect(self.peer, self.peer.port, True, 5)
+            self.assertTrue(sock.session_reused)
+            self.echo(sock)
+            self.cache.save_tls_session(self.peer.host, self.peer.port, sock)
+            sock.close()
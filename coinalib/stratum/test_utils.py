@@ -0,0 +1,158 @@
+# coding: utf-8
+
+# Copyright 2015 Jiří Janoušek <janousek.jiri@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import threading
+import time
+import unittest
+
+from coinalib.stratum import dispatchbench
+from coinalib.stratum import utils
+
+
+class BatchDispatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.scheduled = []
+        self.dispatcher = utils.BatchDispatcher(self.scheduled.append)
+
+    def run_scheduled(self):
+        runs = 0
+        while self.scheduled:
+            self.scheduled.pop(0)()
+            runs += 1
+        return runs
+
+    def test_single_wakeup(self):
+        results = []
+        for i in range(1000):
+            self.dispatcher.call_soon(results.append, i)
+        self.assertEqual(1, len(self.scheduled))
+        self.assertEqual(1, self.run_scheduled())
+        self.assertEqual(list(range(1000)), results)
+
+        self.dispatcher.call_soon(results.append, "again")
+        self.assertEqual(1, self.run_scheduled())
+        self.assertEqual("again", results[-1])
+
+    def test_time_slice(self):
+        self.dispatcher.time_slice = 0.001
+        results = []
+
+        def slow(i):
+            time.sleep(0.001)
+            results.append(i)
+
+        for i in range(10):
+            self.dispatcher.call_soon(slow, i)
+        self.assertGreater(self.run_scheduled(), 1)
+        self.assertEqual(list(range(10)), results)
+
+    def test_exception_doesnt_stop_batch(self):
+        results = []
+        self.dispatcher.call_soon(lambda: 1 / 0)
+        self.dispatcher.call_soon(results.append, 1)
+        self.run_scheduled()
+        self.assertEqual([1], results)
+
+    def test_producer_threads(self):
+        lock = threading.Lock()
+        scheduled = []
+
+        def schedule(func):
+            with lock:
+                scheduled.append(func)
+
+        dispatcher = utils.BatchDispatcher(schedule)
+        results = []
+
+        def produce(n):
+            for i in range(n):
+                dispatcher.call_soon(results.append, i)
+
+        threads = [threading.Thread(target=produce, args=(2000,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        while any(thread.is_alive() for thread in threads) or scheduled:
+            with lock:
+                batch, scheduled[:] = scheduled[:], []
+            for func in batch:
+                func()
+        self.assertEqual(8000, len(results))
+        self.assertFalse(dispatcher._callbacks)
+
+
+class DispatchBenchmarkTest(unittest.TestCase):
+    def test_priority_main_loop(self):
+        loop = dispatchbench.PriorityMainLoop()
+        calls = []
+        loop.idle_add(calls.append, "idle")
+        loop.timeout_add(0, calls.append, "timeout")
+        loop.timeout_add(10, loop.quit)
+        loop.run()
+        # Due timeouts are dispatched before idle sources.
+        self.assertEqual(["timeout", "idle"], calls)
+
+    def test_dispatcher_slices(self):
+        result = dispatchbench.benchmark(dispatchbench.PriorityMainLoop(), 2000, True, 0)
+        self.assertLess(result["slice_max"], 0.1)
+
+
+class SimpleLoopTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = utils.SimpleLoop()
+        self.calls = []
+
+    def test_call_later_order(self):
+        self.loop.call_later(0.03, self.calls.append, 3)
+        self.loop.call_later(0.01, self.calls.append, 1)
+        self.loop.call_later(0.01, self.calls.append, 2)
+        self.loop.call_soon(self.calls.append, 0)
+        handle = self.loop.call_later(0.02, self.calls.append, "cancelled")
+        handle.cancel()
+        self.loop.call_later(0.04, self.loop.stop)
+        start = time.monotonic()
+        self.loop.run()
+        self.assertGreaterEqual(time.monotonic() - start, 0.04)
+        self.assertEqual([0, 1, 2, 3], self.calls)
+        self.assertEqual(0, len(self.loop.timers))
+
+    def test_child_loop_runs_timers(self):
+        child = self.loop.create_child()
+        self.assertIs(self.loop.timers, child.timers)
+        child.call_later(0.01, self.calls.append, "child")
+        child.call_later(0.02, child.stop)
+        child.run()
+        self.assertEqual(["child"], self.calls)
+
+    def test_call_later_from_thread(self):
+        self.loop.call_later(5, self.calls.append, "late")
+
+        def schedule():
+            time.sleep(0.01)
+            self.loop.call_later(0.01, self.loop.stop)
+
+        threading.Thread(target=schedule).start()
+        start = time.monotonic()
+        self.loop.run()
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual([], self.calls)
@@ -0,0 +1,132 @@
+# coding: utf-8
+
+# Copyright 2015 Jiří Janoušek <janousek.jiri@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import collections
+import os
+import threading
+import time
+
+# Wire trace of Stratum messages. Tracing is off by default and call sites check the module
+# level first, so a disabled trace costs a single attribute lookup:
+#
+#     if trace.level:
+#         trace.record(trace.SENT, peer, data)
+
+OFF = 0
+# Record direction, peer and size of messages
+SUMMARY = 1
+# Record whole messages
+PAYLOAD = 2
+
+SENT = ">"
+RECEIVED = "<"
+
+TraceEntry = collections.namedtuple("TraceEntry", "time direction peer size data")
+
+level = OFF
+sink = None
+
+
+def enable(new_sink, new_level=SUMMARY):
+    global level, sink
+    sink = new_sink
+    level = new_level
+
+
+def disable():
+    global level, sink
+    level = OFF
+    sink = None
+
+
+def record(direction, peer, data):
+    current_sink = sink
+    if level and current_sink is not None:
+        current_sink.write(TraceEntry(
+            time.time(), direction, peer, len(data), data if level >= PAYLOAD else None))
+
+
+def format_entry(entry):
+    peer = "{}:{}".format(entry.peer.host, entry.peer.port) if entry.peer else "-"
+    line = "{:.6f} {} {} {}B".format(entry.time, entry.direction, peer, entry.size)
+    if entry.data is not None:
+        line += " " + bytes(entry.data).decode("utf-8", "replace").rstrip()
+    return line
+
+
+class RingBuffer:
+    """Keeps the last capacity entries in memory; entries are formatted only when read."""
+
+    def __init__(self, capacity=1000):
+        self.entries = collections.deque(maxlen=capacity)
+
+    def write(self, entry):
+        self.entries.append(entry)
+
+    def lines(self):
+        return [format_entry(entry) for entry in list(self.entries)]
+
+    def clear(self):
+        self.entries.clear()
+
+
+class RotatingFile:
+    """Appends formatted entries to a file, rotated to path.1 ... path.N when it gets too big."""
+
+    def __init__(self, path, max_bytes=10 * 1024 * 1024, backups=3):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._lock = threading.Lock()
+        self._file = None
+        self._size = 0
+
+    def write(self, entry):
+        line = (format_entry(entry) + "\n").encode("utf-8")
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, "ab")
+                self._size = self._file.tell()
+            elif self._size + len(line) > self.max_bytes:
+                self._rotate()
+            self._file.write(line)
+            self._file.flush()
+            self._size += len(line)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _rotate(self):
+        self._file.close()
+        for i in range(self.backups - 1, 0, -1):
+            source = "{}.{}".format(self.path, i)
+            if os.path.exists(source):
+                os.replace(source, "{}.{}".format(self.path, i + 1))
+        if self.backups > 0:
+            os.replace(self.path, self.path + ".1")
+        self._file = open(self.path, "wb")
+        self._size = 0
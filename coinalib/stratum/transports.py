@@ -23,8 +23,10 @@
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import collections
-import json
 import queue
+import selectors
+import socket
+import ssl
 import threading
 import time
 import traceback
@@ -34,48 +36,333 @@ import requests
 import coinalib
 from coinalib import stratum
 from coinalib.stratum import exceptions
+from coinalib.stratum import stream
+from coinalib.stratum import trace
 
 
 Response = collections.namedtuple("Response", "id response")
 Notification = collections.namedtuple("Notification", "method params")
 
+POLL_MSG_ID = 0
+
+
+DEFAULT_PORTS = {
+    stratum.Protocol.tcp: 50001,
+    stratum.Protocol.ssl: 50002,
+    stratum.Protocol.http: 8081,
+    stratum.Protocol.https: 8082,
+}
+
+SOCKET_PROTOCOLS = (stratum.Protocol.ssl, stratum.Protocol.tcp)
 
-def create_transport(peer):
+
+def create_transport(peer, connections=None, max_in_flight=32, batch_limit=50):
+    """
+    Create a transport for the peer.
+
+    Up to max_in_flight requests are sent without waiting for responses. HTTP transports send
+    up to batch_limit queued requests in one batch POST.
+    """
     protocol = peer.protocol
     if protocol in (stratum.Protocol.http, stratum.Protocol.https):
-        return HttpTransportThread(peer, protocol == stratum.Protocol.https)
+        return HttpTransportThread(
+            peer, protocol == stratum.Protocol.https, connections, max_in_flight, batch_limit)
+    if protocol in SOCKET_PROTOCOLS:
+        return SocketTransportThread(
+            peer, protocol == stratum.Protocol.ssl, connections, max_in_flight)
 
     raise ValueError("Unsupported protocol '{}'.".format(protocol))
 
 
+class ConnectionCache:
+    """
+    Reusable connections keyed by host, port and protocol.
+
+    Holds pre-connected idle sockets, TLS sessions for resumption and HTTP sessions, so that
+    a new transport doesn't have to wait for TCP and TLS handshakes.
+    """
+    # Servers drop idle clients eventually, so don't hand out old connections.
+    MAX_IDLE = 120
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sockets = {}
+        self._peers = {}
+        self._tls_sessions = {}
+        self._http_sessions = {}
+        self._warming = set()
+        self._ssl_context = None
+
+    @property
+    def ssl_context(self):
+        if self._ssl_context is None:
+            # Electrum servers use mostly self-signed certificates.
+            context = ssl.create_default_context()
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+            self._ssl_context = context
+        return self._ssl_context
+
+    def acquire(self, peer, port, use_ssl, timeout):
+        """Return an idle healthy connection to the peer or open a new one."""
+        key = (peer.host, port, use_ssl)
+        while True:
+            with self._lock:
+                idle = self._sockets.get(key)
+                if not idle:
+                    break
+                created, sock = idle.pop()
+            if self._is_usable(created, sock):
+                if use_ssl:
+                    self.save_tls_session(peer.host, port, sock)
+                return sock
+            sock.close()
+        return self.connect(peer, port, use_ssl, timeout)
+
+    def connect(self, peer, port, use_ssl, timeout):
+        key = (peer.host, port, use_ssl)
+        try:
+            sock = socket.create_connection((peer.host, port), timeout)
+            if use_ssl:
+                with self._lock:
+                    tls_session = self._tls_sessions.get(key)
+                try:
+                    sock = self.ssl_context.wrap_socket(
+                        sock, server_hostname=peer.host, session=tls_session)
+                except BaseException:
+                    sock.close()
+                    raise
+                self.save_tls_session(peer.host, port, sock)
+        except socket.timeout as e:
+            raise exceptions.ConnectionTimeout(peer) from e
+        except OSError as e:
+            raise exceptions.ConnectionError(str(e), peer=peer) from e
+        return sock
+
+    def save_tls_session(self, host, port, sock):
+        """
+        Remember the TLS session of a connection, so that the next one can resume it.
+
+        TLS 1.3 servers send session tickets only after the handshake, so this is called
+        again once something was read from the connection.
+        """
+        tls_session = sock.session
+        if tls_session is not None:
+            with self._lock:
+                self._tls_sessions[(host, port, True)] = tls_session
+
+    def warm_up(self, peer, timeout=5):
+        """Open a connection to the peer in the background and keep it idle for later."""
+        use_ssl = peer.protocol == stratum.Protocol.ssl
+        key = (peer.host, peer.port or DEFAULT_PORTS[peer.protocol], use_ssl)
+        with self._lock:
+            if key in self._warming or self._sockets.get(key):
+                return
+            self._warming.add(key)
+        threading.Thread(
+            target=self._warm_up, args=(peer, key, timeout), name="ConnectionWarmUp",
+            daemon=True).start()
+
+    def _warm_up(self, peer, key, timeout):
+        host, port, use_ssl = key
+        try:
+            # Handshake time isn't recorded, peers are scored by request round trips.
+            sock = self.connect(peer, port, use_ssl, timeout)
+        except exceptions.ConnectionTimeout:
+            peer.record_timeout()
+            peer.disable()
+        except exceptions.StratumError:
+            peer.record_error()
+            peer.disable()
+        else:
+            peer.enable()
+            with self._lock:
+                self._sockets.setdefault(key, []).append((time.monotonic(), sock))
+                self._peers[key] = peer
+        finally:
+            with self._lock:
+                self._warming.discard(key)
+
+    def get_warm_peer(self, exclude=()):
+        """Return an enabled peer with an idle connection and a host not in exclude."""
+        with self._lock:
+            candidates = [
+                self._peers[key] for key, idle in self._sockets.items()
+                if idle and key[0] not in exclude]
+        candidates = [peer for peer in candidates if peer.enabled]
+        return min(candidates, key=lambda peer: peer.score) if candidates else None
+
+    def prune(self):
+        """Close idle connections that expired or were closed by the server."""
+        closed = []
+        with self._lock:
+            for key, idle in list(self._sockets.items()):
+                usable = []
+                for created, sock in idle:
+                    if self._is_usable(created, sock):
+                        usable.append((created, sock))
+                        if key[2] and sock.session is not None:
+                            self._tls_sessions[key] = sock.session
+                    else:
+                        closed.append(sock)
+                if usable:
+                    self._sockets[key] = usable
+                else:
+                    del self._sockets[key]
+        for sock in closed:
+            sock.close()
+        return len(closed)
+
+    def count_idle(self):
+        with self._lock:
+            return sum(len(idle) for idle in self._sockets.values())
+
+    def idle_hosts(self):
+        with self._lock:
+            return {key[0] for key, idle in self._sockets.items() if idle}
+
+    def http_session(self, address):
+        """Return a shared requests.Session for the address to reuse its kept-alive connections."""
+        with self._lock:
+            http = self._http_sessions.get(address)
+            if http is None:
+                http = self._http_sessions[address] = requests.Session()
+            return http
+
+    def close(self):
+        with self._lock:
+            sockets, self._sockets = self._sockets, {}
+            http_sessions, self._http_sessions = self._http_sessions, {}
+        for idle in sockets.values():
+            for created, sock in idle:
+                sock.close()
+        for http in http_sessions.values():
+            http.close()
+
+    def _is_usable(self, created, sock):
+        if time.monotonic() - created > self.MAX_IDLE:
+            return False
+        timeout = sock.gettimeout()
+        try:
+            sock.setblocking(False)
+            if isinstance(sock, ssl.SSLSocket):
+                # TLS records such as session tickets make the socket readable without any
+                # application data, so let SSL process them instead of polling the socket.
+                sock.recv(1)
+            else:
+                sock.recv(1, socket.MSG_PEEK)
+        except (ssl.SSLWantReadError, BlockingIOError):
+            return True
+        except (OSError, ValueError):
+            return False
+        finally:
+            try:
+                sock.settimeout(timeout)
+            except OSError:
+                pass
+        # Servers don't send anything unasked, so data or EOF means the connection is unusable.
+        return False
+
+
 class TransportPool:
-    def __init__(self, peer_list):
+    """
+    Keeps up to size live transports, each connected to a different host.
+
+    Transport options, max_in_flight and batch_limit, are passed to create_transport.
+    """
+
+    def __init__(self, peer_list, size=1, spares=1, **transport_options):
         self.peer_list = peer_list
+        self.size = size
+        self.spares = spares
+        self.transport_options = transport_options
+        self.transports = []
+        self.connections = ConnectionCache()
+
+    @property
+    def is_full(self):
+        return len(self.transports) >= self.size
 
-    def get_transport(self, protocol=None):
+    def get_transport(self, protocol=None, exclude=()):
         if protocol is None:
             for protocol in stratum.Protocol.by_priority():
                 try:
-                    return self.get_transport(protocol)
+                    return self.get_transport(protocol, exclude)
                 except ValueError:
                     pass
             raise ValueError("No transport is available.")
 
-        return create_transport(self.peer_list.get_peer(protocol))
+        return create_transport(
+            self.peer_list.get_peer(protocol, exclude), self.connections,
+            **self.transport_options)
+
+    def start_transport(self, session):
+        """
+        Start a transport to a host not used by other live transports.
+
+        Peers with a warm connection are preferred.
+        """
+        exclude = {transport.peer.host for transport in self.transports}
+        peer = self.connections.get_warm_peer(exclude)
+        if peer is not None:
+            transport = create_transport(peer, self.connections, **self.transport_options)
+        else:
+            transport = self.get_transport(exclude=exclude)
+        self.transports.append(transport)
+        transport.start(session)
+        return transport
+
+    def warm_up(self):
+        """
+        Pre-connect to spare peers, so that failover can take over a warm connection.
+
+        Expired and closed spares are replaced. Call periodically to keep spares warm.
+        """
+        self.connections.prune()
+        exclude = {transport.peer.host for transport in self.transports}
+        exclude.update(self.connections.idle_hosts())
+        for i in range(self.spares - self.connections.count_idle()):
+            for protocol in SOCKET_PROTOCOLS:
+                try:
+                    peer = self.peer_list.get_peer(protocol, exclude)
+                except ValueError:
+                    continue
+                exclude.add(peer.host)
+                self.connections.warm_up(peer)
+                break
+
+    def remove_transport(self, transport):
+        if transport in self.transports:
+            self.transports.remove(transport)
+
+    def stop(self):
+        transports, self.transports = self.transports, []
+        for transport in transports:
+            if transport.running:
+                transport.stop()
+            transport.join()
+        self.connections.close()
 
     def enable_all(self):
         self.peer_list.enable_all()
 
+    def retry_delay(self):
+        return self.peer_list.retry_delay()
+
 
 class TransportThread(threading.Thread):
-    def __init__(self, peer, use_ssl):
+    def __init__(self, peer, use_ssl, connections=None, max_in_flight=32):
         super().__init__(name=self.__class__.__name__)
         self.daemon = True
         self.session = None
         self.peer = peer
         self.use_ssl = use_ssl
+        self.connections = connections if connections is not None else ConnectionCache()
+        self.port = peer.port or DEFAULT_PORTS[peer.protocol]
         self.running = False
         self.is_functional = False
+        self.max_in_flight = max_in_flight
+        self.in_flight = {}
 
     def start(self, session):
         self.session = session
@@ -88,32 +375,73 @@ class TransportThread(threading.Thread):
         if not self.running:
             raise RuntimeError("Transport is not runnning.")
         self.running = False
+        self.session.remove_transport(self)
+
+    def _window_available(self):
+        """Return how many more requests may be sent before the in-flight window is full."""
+        if len(self.in_flight) >= self.max_in_flight:
+            # Forget requests the session no longer waits for.
+            in_progress = self.session.in_progress
+            self.in_flight = {i: t for i, t in self.in_flight.items() if i in in_progress}
+        return self.max_in_flight - len(self.in_flight)
+
+    def _process_responses(self, decoder, data):
+        """Feed received data to the decoder and process entries it completes."""
+        if trace.level and data:
+            trace.record(trace.RECEIVED, self.peer, data)
+        entries = decoder.feed(data) if data else decoder.close()
+        for entry in entries:
+            message_id = entry.get("id", None)
+            if message_id == POLL_MSG_ID:
+                continue  # poll request
+
+            if message_id is None:
+                notification = Notification(entry.get("method"), entry.get("params"))
+                self.session.deliver_notification(notification)
+                continue
+
+            exception = None
+            sent = self.in_flight.pop(message_id, None)
+            if sent is not None:
+                self.peer.record_rtt(time.monotonic() - sent)
+            try:
+                request = self.session.get_request(message_id)
+            except KeyError:
+                continue  # Cancelled or expired request
 
+            error = entry.get("error")
+            if error:
+                exception = exceptions.MessageError.from_response(error)
 
-POLL_MSG_ID = 0
+            response = Response(message_id, entry.get("result"))
+            self.session.deliver_response(request, response, exception)
 
 
 class HttpTransportThread(TransportThread):
     USER_AGENT = '{}/{} Stratum/HttpTransport'.format("Coinalib", coinalib.VERSION)
+    CHUNK_SIZE = 64 * 1024
 
-    def __init__(self, peer, use_ssl):
-        super().__init__(peer, use_ssl)
-        self.port = peer.port or (8082 if use_ssl else 8081)
+    def __init__(self, peer, use_ssl, connections=None, max_in_flight=32, batch_limit=50):
+        super().__init__(peer, use_ssl, connections, max_in_flight)
         self.address = "{}://{}:{}/".format("https" if use_ssl else "http", peer.host, self.port)
         self.timeout = 5
         self.poll_timeout = 10
+        self.batch_limit = batch_limit
         self.last_poll = 0
-        self.http = http = requests.Session()
-        http.headers.update({
+        self._wakeup = None
+        self.http = self.connections.http_session(self.address)
+        self.headers = {
             'User-Agent': self.__class__.USER_AGENT,
             'Content-Type': 'application/stratum',
-        })
+        }
 
     def run(self):
         if self.running:
             raise RuntimeError("Transport is already runnning.")
 
         self.running = True
+        self._wakeup = threading.Event()
+        self.session.add_waker(self._wakeup.set)
         try:
             # Check whether connection is functional
             self._poll_for_responses()
@@ -121,41 +449,70 @@ class HttpTransportThread(TransportThread):
             while self.running:
                 try:
                     while self.running:
-                        request = self.session.pop_request()
-                        result = self._send_request(request.data, 5)
-                        self._process_responses(result.content)
+                        self.session.expire_requests()
+                        limit = min(self.batch_limit, self._window_available())
+                        if limit <= 0:
+                            raise queue.Empty
+                        requests = self.session.pop_requests(limit, transport=self)
+                        now = time.monotonic()
+                        self.in_flight.update((request.id, now) for request in requests)
+                        result = self._send_request(self._encode_batch(requests), 5)
+                        self._read_response(result)
                 except queue.Empty:
-                    time.sleep(1)
+                    self._wakeup.wait(1)
+                    self._wakeup.clear()
                     self._poll_for_responses()
-        except (exceptions.ConnectionTimeout, exceptions.ConnectionError) as e:
+        except exceptions.ConnectionTimeout as e:
+            self.session.transport_aborted(self, e)  # Timeouts are recorded by _send_request.
+        except exceptions.ConnectionError as e:
+            self.peer.record_error()
             self.session.transport_aborted(self, e)
         except Exception as e:
             traceback.print_exc()  # Unexpected exception - print traceback
+            self.peer.record_error()
             self.session.transport_aborted(self, e)
+        finally:
+            self.session.remove_waker(self._wakeup.set)
         self.running = False
 
     def _poll_for_responses(self):
-        if self.session.in_progress or time.monotonic() - self.last_poll >= self.poll_timeout:
-            result = self._send_request(json.dumps({
-                "jsonrpc": "2.0",
-                "id": POLL_MSG_ID,
-                "method": "server.version",
-                "params": ["1.9.5" "0.9"]
-            }).encode("ascii"), 5)
+        interval = 1 if self.in_flight else self.poll_timeout
+        if time.monotonic() - self.last_poll >= interval:
+            result = self._send_request(self.session.codec.encode_request(
+                POLL_MSG_ID, "server.version", ["1.9.5", "0.9"]), 5)
             self.last_poll = time.monotonic()
-            self._process_responses(result.content)
+            self._read_response(result)
+
+    def _read_response(self, result):
+        """Process the response body as it arrives, so that large batches aren't held whole."""
+        decoder = stream.JsonStreamDecoder(self.session.codec)
+        try:
+            with result:
+                for chunk in result.iter_content(self.CHUNK_SIZE):
+                    self._process_responses(decoder, chunk)
+        except requests.RequestException as e:
+            raise exceptions.ConnectionError(str(e), peer=self.peer) from e
+        self._process_responses(decoder, b"")
+
+    def _encode_batch(self, requests):
+        if len(requests) == 1:
+            return requests[0].data
+        return b"[" + b",".join(request.data.rstrip() for request in requests) + b"]"
 
     def _send_request(self, data, retry=0):
+        if trace.level:
+            trace.record(trace.SENT, self.peer, data)
         while retry >= 0:
-            print(">", self.address, retry, "\n>", data)
             try:
                 result = self.http.post(
-                    self.address, data=data, timeout=self.timeout, verify=False)
+                    self.address, data=data, headers=self.headers, timeout=self.timeout,
+                    verify=False, stream=True)
                 if not self.is_functional:
                     self.is_functional = True
                     self.session.transport_functional(self)
                 return result
             except requests.Timeout as e:
+                self.peer.record_timeout()
                 if retry > 0:
                     retry -= 1
                 else:
@@ -163,42 +520,174 @@ class HttpTransportThread(TransportThread):
             except requests.ConnectionError as e:
                 raise exceptions.ConnectionError(str(e), peer=self.peer) from e
 
-    def _process_responses(self, data):
-        if data:
+
+class SocketTransportThread(TransportThread):
+    """Persistent TCP or SSL connection streaming newline-delimited JSON-RPC messages."""
+    RECV_SIZE = 64 * 1024
+
+    def __init__(self, peer, use_ssl, connections=None, max_in_flight=32):
+        super().__init__(peer, use_ssl, connections, max_in_flight)
+        self.timeout = 5
+        self.keepalive_interval = 60
+        self.sock = None
+        self._selector = None
+        self._waker = None
+        self._wakeup_fd = None
+        self._decoder = None
+        self._out_buf = bytearray()
+        self._last_sent = 0
+        self._last_received = 0
+        self._poll_sent = None
+        self._tls_session_saved = False
+
+    def run(self):
+        if self.running:
+            raise RuntimeError("Transport is already runnning.")
+
+        self.running = True
+        self._waker, self._wakeup_fd = socket.socketpair()
+        self._waker.setblocking(False)
+        self._wakeup_fd.setblocking(False)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._wakeup_fd, selectors.EVENT_READ)
+        self.session.add_waker(self.wake_up)
+        try:
+            self._decoder = stream.LineDecoder(self.session.codec)
+            self.sock = self._connect()
+            self._selector.register(self.sock, selectors.EVENT_READ)
+            self.is_functional = True
+            self.session.transport_functional(self)
+            self._send_poll()
+            while self.running:
+                self.session.expire_requests()
+                self._pop_requests()
+                self._selector.modify(
+                    self.sock,
+                    selectors.EVENT_READ | selectors.EVENT_WRITE if self._out_buf
+                    else selectors.EVENT_READ)
+                for key, mask in self._selector.select(self._select_timeout()):
+                    if key.fileobj is self._wakeup_fd:
+                        self._drain_wakeups()
+                        continue
+                    if mask & selectors.EVENT_READ:
+                        self._read()
+                    if mask & selectors.EVENT_WRITE:
+                        self._write()
+                self._check_keepalive()
+        except exceptions.ConnectionTimeout as e:
+            if self.running:
+                self.peer.record_timeout()
+                self.session.transport_aborted(self, e)
+        except exceptions.ConnectionError as e:
+            if self.running:
+                self.peer.record_error()
+                self.session.transport_aborted(self, e)
+        except Exception as e:
+            traceback.print_exc()  # Unexpected exception - print traceback
+            if self.running:
+                self.peer.record_error()
+                self.session.transport_aborted(self, e)
+        finally:
+            self.session.remove_waker(self.wake_up)
+            self._close()
+        self.running = False
+
+    def stop(self):
+        super().stop()
+        self.wake_up()
+
+    def wake_up(self):
+        try:
+            self._waker.send(b"\0")
+        except (BlockingIOError, OSError):
+            pass  # Wake-up is already pending or the transport is closed.
+
+    def _connect(self):
+        sock = self.connections.acquire(self.peer, self.port, self.use_ssl, self.timeout)
+        sock.setblocking(False)
+        self._last_received = time.monotonic()
+        return sock
+
+    def _close(self):
+        self._selector.close()
+        for sock in (self.sock, self._waker, self._wakeup_fd):
+            if sock is not None:
+                sock.close()
+
+    def _drain_wakeups(self):
+        try:
+            while self._wakeup_fd.recv(1024):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _select_timeout(self):
+        now = time.monotonic()
+        if self._poll_sent is not None:
+            timeout = self._poll_sent + self.timeout - now
+        else:
+            timeout = self._last_sent + self.keepalive_interval - now
+        deadline = self.session.next_deadline()
+        if deadline is not None:
+            timeout = min(timeout, deadline - now)
+        return max(0, timeout)
+
+    def _pop_requests(self):
+        try:
+            while self.running and self._window_available() > 0:
+                request = self.session.pop_request(transport=self)
+                self.in_flight[request.id] = time.monotonic()
+                if trace.level:
+                    trace.record(trace.SENT, self.peer, request.data)
+                self._out_buf += request.data
+        except queue.Empty:
+            pass
+
+    def _send_poll(self):
+        self._out_buf += self.session.codec.encode_request(
+            POLL_MSG_ID, "server.version", ["1.9.5", "0.9"])
+        self._poll_sent = time.monotonic()
+
+    def _check_keepalive(self):
+        now = time.monotonic()
+        if self._poll_sent is not None:
+            if self._last_received >= self._poll_sent:
+                self._poll_sent = None
+            elif now - self._poll_sent >= self.timeout:
+                raise exceptions.ConnectionTimeout(self.peer)
+        elif now - self._last_sent >= self.keepalive_interval:
+            self._send_poll()
+
+    def _read(self):
+        while True:
             try:
-                entries = json.loads(data.decode("ascii"))
-            except Exception:
-                raise exceptions.ValueError("Invalid response", data)
-
-            if not isinstance(entries, list):
-                entries = [entries]
-            for entry in entries:
-                print("<", entry)
-                message_id = entry.get("id", None)
-                if message_id == POLL_MSG_ID:
-                    continue  # poll request
-
-                if message_id is None:
-                    notification = Notification(entry.get("method"), entry.get("params"))
-                    self.session.deliver_notification(notification)
-                    continue
+                data = self.sock.recv(self.RECV_SIZE)
+            except (ssl.SSLWantReadError, BlockingIOError):
+                return
+            except OSError as e:
+                raise exceptions.ConnectionError(str(e), peer=self.peer) from e
 
-                exception = None
-                try:
-                    request = self.session.get_request(message_id)
-                except KeyError:
-                    traceback.print_exc()
-                    continue
+            if not data:
+                raise exceptions.ConnectionError("Connection closed by peer.", peer=self.peer)
 
-                error = entry.get("error")
-                if error:
-                    if isinstance(error, str):
-                        exception = exceptions.MessageError(0, error)
-                    else:
-                        exception = exceptions.MessageError(
-                            error[0],
-                            error[1],
-                            error[2] if len(error) > 2 else None)
+            self._last_received = time.monotonic()
+            if self.use_ssl and not self._tls_session_saved:
+                # A TLS 1.3 session ticket arrives after the handshake, before any response.
+                self._tls_session_saved = True
+                self.connections.save_tls_session(self.peer.host, self.port, self.sock)
+            self._process_responses(self._decoder, data)
+
+            # SSL may hold decrypted data that won't show up as socket readiness.
+            if not self.use_ssl or not self.sock.pending():
+                return
 
-                response = Response(message_id, entry.get("result"))
-                self.session.deliver_response(request, response, exception)
+    def _write(self):
+        try:
+            sent = self.sock.send(self._out_buf)
+        except (ssl.SSLWantWriteError, BlockingIOError):
+            return
+        except OSError as e:
+            raise exceptions.ConnectionError(str(e), peer=self.peer) from e
+
+        del self._out_buf[:sent]
+        self._last_sent = time.monotonic()
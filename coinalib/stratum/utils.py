@@ -23,17 +23,77 @@
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import collections
+import heapq
+import itertools
 import queue
+import threading
+import time
 import traceback
 
 SimpleTask = collections.namedtuple("SimpleTask", "func args kwargs")
 
 
+class TimerHandle:
+    """Returned by call_later to allow cancellation of the call."""
+    __slots__ = ("deadline", "func", "args", "kwargs", "cancelled")
+
+    def __init__(self, deadline, func, args, kwargs):
+        self.deadline = deadline
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerQueue:
+    """Heap of timers ordered by monotonic deadlines."""
+
+    def __init__(self):
+        self._heap = []
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+
+    def add(self, delay, func, args, kwargs):
+        """Add a timer and return its handle and whether it is the earliest one."""
+        handle = TimerHandle(time.monotonic() + max(0, delay), func, args, kwargs)
+        with self._lock:
+            # The counter keeps timers with equal deadlines in FIFO order.
+            heapq.heappush(self._heap, (handle.deadline, next(self._counter), handle))
+            return handle, self._heap[0][2] is handle
+
+    def pop_due(self, now):
+        due = []
+        with self._lock:
+            heap = self._heap
+            while heap and (heap[0][0] <= now or heap[0][2].cancelled):
+                handle = heapq.heappop(heap)[2]
+                if not handle.cancelled:
+                    due.append(handle)
+        return due
+
+    def next_timeout(self, now):
+        """Return seconds until the earliest timer or None if there is none."""
+        with self._lock:
+            heap = self._heap
+            while heap and heap[0][2].cancelled:
+                heapq.heappop(heap)
+            return max(0, heap[0][0] - now) if heap else None
+
+    def __len__(self):
+        return len(self._heap)
+
+
 class SimpleLoop:
-    def __init__(self, tasks=None):
+    def __init__(self, tasks=None, timers=None):
         if tasks is None:
             tasks = queue.Queue()
+        if timers is None:
+            timers = TimerQueue()
         self.tasks = tasks
+        self.timers = timers
         self.running = False
 
     def run(self):
@@ -42,17 +102,29 @@ class SimpleLoop:
 
         self.running = True
         while self.running:
-            task = self.tasks.get()
+            try:
+                task = self.tasks.get(timeout=self._run_timers())
+            except queue.Empty:
+                continue
             try:
                 if isinstance(task, SimpleTask):
                     task.func(*task.args, **task.kwargs)
-                else:
+                elif task is not None:  # None just wakes up the loop
                     task.running = False
             except Exception:
                 traceback.print_exc()
             finally:
                 self.tasks.task_done()
 
+    def _run_timers(self):
+        """Run due timers and return seconds until the next one or None."""
+        for handle in self.timers.pop_due(time.monotonic()):
+            try:
+                handle.func(*handle.args, **handle.kwargs)
+            except Exception:
+                traceback.print_exc()
+        return self.timers.next_timeout(time.monotonic())
+
     def stop(self):
         if not self.running:
             raise RuntimeError("Loop isn't running.")
@@ -66,8 +138,59 @@ class SimpleLoop:
         task = SimpleTask(func, args, kwargs)
         self.tasks.put(task)
 
+    def call_later(self, delay, func, *args, **kwargs):
+        handle, earliest = self.timers.add(delay, func, args, kwargs)
+        if earliest:
+            # A loop waiting for tasks must recompute its timeout.
+            self.tasks.put(None)
+        return handle
+
     def create_child(self):
-        return self.__class__(self.tasks)
+        return self.__class__(self.tasks, self.timers)
+
+
+class BatchDispatcher:
+    """
+    Runs callbacks posted from any thread in batches from a single scheduled wakeup.
+
+    schedule(func) must arrange func() to be called once from the target loop. A batch runs
+    for at most time_slice seconds, then the rest waits for the next wakeup, so that the loop
+    can process other events in between.
+    """
+
+    def __init__(self, schedule, time_slice=0.01):
+        self.schedule = schedule
+        self.time_slice = time_slice
+        # deque.append and popleft are atomic, so producers don't need a lock.
+        self._callbacks = collections.deque()
+        self._scheduled = False
+
+    def call_soon(self, func, *args, **kwargs):
+        self._callbacks.append((func, args, kwargs))
+        if not self._scheduled:
+            self._scheduled = True
+            self.schedule(self.run_batch)
+
+    def run_batch(self):
+        """Run posted callbacks. Returns False, so it can be a GLib source callback."""
+        callbacks = self._callbacks
+        deadline = time.monotonic() + self.time_slice
+        while callbacks:
+            func, args, kwargs = callbacks.popleft()
+            try:
+                func(*args, **kwargs)
+            except Exception:
+                traceback.print_exc()
+            if callbacks and time.monotonic() >= deadline:
+                self.schedule(self.run_batch)
+                return False
+
+        self._scheduled = False
+        # A callback may have been posted after the loop ended but before the flag was reset.
+        if callbacks and not self._scheduled:
+            self._scheduled = True
+            self.schedule(self.run_batch)
+        return False
 
 
 EventHandler = collections.namedtuple("EventHandler", "func args kwargs")
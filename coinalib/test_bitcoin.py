@@ -23,6 +23,7 @@
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import binascii
+from concurrent.futures import ThreadPoolExecutor
 import struct
 import unittest
 
@@ -171,3 +172,61 @@ class BlockHeaderTest(unittest.TestCase):
                 expected_hash_hex = BLOCK_HEADERS[i + 1]["prev_block_hash"]
                 hash_hex = block_header.hash_hex
                 self.assertEqual(expected_hash_hex, hash_hex)
+
+    def test_from_raw(self):
+        for i, data in enumerate(BLOCK_HEADERS):
+            with self.subTest(i=i):
+                block_header = bitcoin.BlockHeader.from_dict(data)
+                copy = bitcoin.BlockHeader(block_header.raw_bin, data["block_height"])
+                self.assertEqual(block_header, copy)
+                self.assertEqual(block_header.hash_hex, copy.hash_hex)
+                expected = dict(data, utxo_root=None)
+                self.assertEqual(expected, copy.to_dict())
+
+    def test_to_dict(self):
+        for i, data in enumerate(BLOCK_HEADERS):
+            with self.subTest(i=i):
+                self.assertEqual(data, bitcoin.BlockHeader.from_dict(data).to_dict())
+
+    def test_compact(self):
+        block_header = bitcoin.BlockHeader(**BLOCK_HEADERS[0])
+        self.assertFalse(hasattr(block_header, "__dict__"))
+        with self.assertRaises(ValueError):
+            bitcoin.BlockHeader(block_header.raw_bin[1:])
+
+
+class BatchVerificationTest(unittest.TestCase):
+    def setUp(self):
+        self.headers = [bitcoin.BlockHeader(**header) for header in BLOCK_HEADERS]
+        self.data = b"".join(header.raw_bin for header in self.headers)
+
+    def test_bits_to_target(self):
+        self.assertEqual(0x00ffff * 2 ** (8 * (0x1d - 3)), bitcoin.bits_to_target(0x1d00ffff))
+        self.assertEqual(0x12, bitcoin.bits_to_target(0x01120000))
+        self.assertEqual(0, bitcoin.bits_to_target(0x04923456))
+
+    def test_hash_headers(self):
+        hashes = bitcoin.hash_headers(self.data)
+        self.assertEqual([header.hash_bin for header in self.headers], hashes)
+        with self.assertRaises(ValueError):
+            bitcoin.hash_headers(self.data[1:])
+
+    def test_verify_headers(self):
+        hashes, invalid = bitcoin.verify_headers(self.data)
+        self.assertEqual([header.hash_bin for header in self.headers], hashes)
+        self.assertEqual([], invalid)
+
+    def test_verify_headers_insufficient_work(self):
+        data = bytearray(self.data)
+        data[80 * 3 + 76] ^= 0xff  # nonce of the fourth header
+        data[80 * 10 + 76] ^= 0xff  # nonce of the eleventh header
+        hashes, invalid = bitcoin.verify_headers(data)
+        self.assertEqual([3, 10], invalid)
+
+    def test_verify_headers_executor(self):
+        data = bytearray(self.data)
+        data[80 * 10 + 76] ^= 0xff
+        with ThreadPoolExecutor(2) as executor:
+            result = bitcoin.verify_headers(data, executor, batch_size=3)
+        self.assertEqual(bitcoin.verify_headers(data), result)
+        self.assertEqual([10], result[1])
@@ -0,0 +1,100 @@
+# coding: utf-8
+
+# Copyright 2015 Jiří Janoušek <janousek.jiri@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import tempfile
+import unittest
+
+from coinalib import bitcoin
+from coinalib.headerstore import BlockHeaderStore
+from coinalib.test_bitcoin import BLOCK_HEADERS
+
+
+class BlockHeaderStoreTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.headers = [bitcoin.BlockHeader(**header) for header in BLOCK_HEADERS]
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def test_empty(self):
+        with BlockHeaderStore(self.path) as store:
+            self.assertEqual(0, len(store))
+            self.assertEqual(-1, store.height)
+            self.assertEqual(b"", store.get_range(0, 10))
+            with self.assertRaises(IndexError):
+                store.get_raw(0)
+
+    def test_append_and_get_raw(self):
+        with BlockHeaderStore(self.path) as store:
+            for height, header in enumerate(self.headers):
+                store.append(header)
+                self.assertEqual(height, store.height)
+                self.assertEqual(header.raw_bin, store.get_raw(height))
+
+            for height, header in enumerate(self.headers):
+                with self.subTest(height=height):
+                    self.assertEqual(header.raw_bin, store.get_raw(height))
+                    stored = store.get_header(height)
+                    self.assertEqual(height, stored.block_height)
+                    self.assertEqual(header.hash_hex, stored.hash_hex)
+
+    def test_reopen(self):
+        data = b"".join(header.raw_bin for header in self.headers)
+        with BlockHeaderStore(self.path) as store:
+            store.extend(data)
+            store.flush()
+
+        with BlockHeaderStore(self.path) as store:
+            self.assertEqual(len(self.headers), len(store))
+            self.assertEqual(data, store.get_range(0, len(store)))
+            self.assertEqual(data[80:240], store.get_range(1, 3))
+
+    def test_incomplete_record_dropped(self):
+        with open(self.path, "wb") as f:
+            f.write(self.headers[0].raw_bin + b"\0" * 10)
+
+        with BlockHeaderStore(self.path) as store:
+            self.assertEqual(1, len(store))
+            store.append(self.headers[1])
+            self.assertEqual(self.headers[1].raw_bin, store.get_raw(1))
+
+    def test_extend_invalid_size(self):
+        with BlockHeaderStore(self.path) as store:
+            with self.assertRaises(ValueError):
+                store.extend(b"\0" * 81)
+
+    def test_truncate(self):
+        with BlockHeaderStore(self.path) as store:
+            for header in self.headers:
+                store.append(header)
+            store.get_raw(5)
+            store.truncate(3)
+            self.assertEqual(3, len(store))
+            with self.assertRaises(IndexError):
+                store.get_raw(3)
+            store.append(self.headers[5])
+            self.assertEqual(self.headers[5].raw_bin, store.get_raw(3))
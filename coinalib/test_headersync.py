@@ -0,0 +1,151 @@
+# coding: utf-8
+
+# Copyright 2015 Jiří Janoušek <janousek.jiri@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import binascii
+import os
+import tempfile
+import unittest
+
+from coinalib import bitcoin
+from coinalib.headerstore import BlockHeaderStore
+from coinalib.headersync import BlockHeaderSync, ChainError, verify_chain
+from coinalib.stratum.transports import Response
+from coinalib.test_bitcoin import BLOCK_HEADERS
+
+RAW_HEADERS = [bitcoin.BlockHeader(**header).raw_bin for header in BLOCK_HEADERS]
+
+
+class FakeClient:
+    def __init__(self):
+        self.requests = []
+
+    def send_request_async(self, method, params, callback, *args, **kwargs):
+        self.requests.append((method, params, callback, args))
+
+    def reply(self, index, result):
+        method, params, callback, args = self.requests.pop(index)
+        callback(Response(0, result), None, *args)
+
+
+class SmallChunkSync(BlockHeaderSync):
+    CHUNK_SIZE = 4
+
+
+def chunk_hex(index, size=4):
+    return binascii.b2a_hex(b"".join(RAW_HEADERS[index * size:(index + 1) * size]))
+
+
+class VerifyChainTest(unittest.TestCase):
+    def test_valid(self):
+        verify_chain(b"".join(RAW_HEADERS[1:]), 1, RAW_HEADERS[0])
+
+    def test_broken(self):
+        data = b"".join(RAW_HEADERS[:3] + RAW_HEADERS[4:6])
+        with self.assertRaises(ChainError) as cm:
+            verify_chain(data, 10)
+        self.assertEqual(13, cm.exception.height)
+
+    def test_insufficient_work(self):
+        data = bytearray(b"".join(RAW_HEADERS[:4]))
+        data[80 * 2 + 76] ^= 0xff
+        with self.assertRaises(ChainError) as cm:
+            verify_chain(data, 10)
+        self.assertEqual(12, cm.exception.height)
+
+
+class BlockHeaderSyncTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.store = BlockHeaderStore(self.path)
+        self.client = FakeClient()
+        self.result = []
+
+    def tearDown(self):
+        self.store.close()
+        os.unlink(self.path)
+
+    def create_sync(self, max_in_flight):
+        sync = SmallChunkSync(self.client, self.store, max_in_flight)
+        sync.finished.connect(lambda sync, height: self.result.append(("finished", height)))
+        sync.failed.connect(lambda sync, error: self.result.append(("failed", error)))
+        return sync
+
+    def test_pipelined_out_of_order(self):
+        sync = self.create_sync(3)
+        sync.start()
+        self.client.reply(0, {"block_height": 13})
+        self.assertEqual([[0], [1], [2]], [r[1] for r in self.client.requests])
+
+        self.client.reply(2, chunk_hex(2))
+        self.client.reply(1, chunk_hex(1))
+        self.assertEqual(0, len(self.store))
+        self.assertEqual([[0]], [r[1] for r in self.client.requests])
+
+        self.client.reply(0, chunk_hex(0))
+        self.assertEqual(12, len(self.store))
+        self.assertEqual([[3]], [r[1] for r in self.client.requests])
+
+        self.client.reply(0, chunk_hex(3))
+        self.assertEqual([("finished", 13)], self.result)
+        self.assertEqual(b"".join(RAW_HEADERS), self.store.get_range(0, 14))
+
+    def test_resume_partial_chunk(self):
+        self.store.extend(b"".join(RAW_HEADERS[:6]))
+        sync = self.create_sync(2)
+        sync.start(13)
+        self.assertEqual([[1], [2]], [r[1] for r in self.client.requests])
+        self.client.reply(0, chunk_hex(1))
+        self.client.reply(0, chunk_hex(2))
+        self.client.reply(0, chunk_hex(3))
+        self.assertEqual([("finished", 13)], self.result)
+        self.assertEqual(b"".join(RAW_HEADERS), self.store.get_range(0, 14))
+
+    def test_late_response_after_restart(self):
+        sync = self.create_sync(2)
+        sync.start(13)
+        sync.stop()
+        sync.start(13)
+        self.assertEqual([[0], [1], [0], [1]], [r[1] for r in self.client.requests])
+        # Responses to the stopped sync don't touch the new one.
+        self.client.reply(0, chunk_hex(0))
+        self.client.reply(0, chunk_hex(1))
+        self.assertEqual({0, 1}, sync._in_flight)
+        self.assertEqual(0, len(self.store))
+        self.client.reply(0, chunk_hex(0))
+        self.client.reply(0, chunk_hex(1))
+        self.client.reply(0, chunk_hex(2))
+        self.client.reply(0, chunk_hex(3))
+        self.assertEqual([("finished", 13)], self.result)
+
+    def test_broken_linkage(self):
+        self.store.extend(RAW_HEADERS[0])
+        sync = self.create_sync(2)
+        sync.start(7)
+        self.client.reply(0, binascii.b2a_hex(RAW_HEADERS[0] + b"".join(RAW_HEADERS[2:5])))
+        self.assertEqual("failed", self.result[0][0])
+        self.assertIsInstance(self.result[0][1], ChainError)
+        self.assertEqual(1, self.result[0][1].height)
+        self.assertEqual(1, len(self.store))
+        self.assertFalse(sync.running)
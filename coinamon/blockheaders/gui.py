@@ -36,21 +36,11 @@ def add_views(app, window):
     view = BlockHeadersView(app.block_explorer)
     window.add_view(view, False)
 
-    def on_response(response, error, view, *args, **kwargs):
-        view.add_block_header(bitcoin.BlockHeader(**response.response))
+    def on_header(subscription, header, view):
+        view.add_block_header(bitcoin.BlockHeader.from_dict(header))
 
-    def on_notification(notification, view, *args, **kwargs):
-        view.add_block_header(bitcoin.BlockHeader(**notification.params[0]))
-
-    def on_new_transport(client, transport, view):
-        app.electrum.send_request_async(method, params, on_response, view)
-
-    method = "blockchain.headers.subscribe"
-    params = []
-    app.electrum.notifications[method].connect(on_notification, view)
-    app.electrum.connection_established.connect(on_new_transport, view)
-    if app.electrum.is_connection_established:
-        app.electrum.send_request_async(method, params, on_response, view)
+    # The subscription is replayed by the client after reconnects.
+    app.electrum.subscriptions.subscribe("blockchain.headers.subscribe", [], on_header, view)
 
 
 def add_actions(app, window):
@@ -22,6 +22,8 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import os.path
+
 from gi.repository import Gio
 from gi.repository import Gtk
 
@@ -33,7 +35,9 @@ class Application(Gtk.Application):
         self.components = components
         self.db_session = db_session
         self.window = None
+        self.peer_discovery = None
         self.connect("activate", self.on_activate)
+        self.connect("shutdown", self.on_shutdown)
 
     def on_activate(self, app):
         if not self.window:
@@ -43,18 +47,25 @@ class Application(Gtk.Application):
 
         self.window.present()
 
+    def on_shutdown(self, app):
+        if self.peer_discovery:
+            # Keep peer scores measured during this session.
+            self.peer_discovery.save()
+
     def _init_core(self):
         from coinalib import blockexplorers
         from coinalib.stratum import client
+        from coinalib.stratum import discovery
         from coinalib.stratum import glibutils
-        from coinalib.stratum import peers
         from coinalib.stratum import transports
 
         self.block_explorer = blockexplorers.Blocktrail()
         loop = glibutils.MainLoopWrapper()
-        peer_list = peers.PeerList(peers.PeerList.parse(peers.DEFAULT_PEERS))
+        peer_cache = discovery.PeerCache(os.path.join(os.path.abspath("."), "peers.json"))
+        peer_list = discovery.load_peer_list(peer_cache)
         self.transport_pool = transports.TransportPool(peer_list)
         self.electrum = client.StratumClient(self.transport_pool, loop)
+        self.peer_discovery = discovery.PeerDiscovery(self.electrum, peer_list, peer_cache)
         self.electrum.start()
 
     def _init_ui(self):
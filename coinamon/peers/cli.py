@@ -0,0 +1,68 @@
+# coding: utf-8
+
+# Copyright 2015 Jiří Janoušek <janousek.jiri@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import argparse
+import os.path
+
+from coinalib import stratum
+from coinalib.stratum import discovery
+from coinalib.stratum import prober
+from coinamon.core.cli import Command  # noqa
+from coinamon.core.cli import IntValidator  # noqa
+
+
+class ProbePeersCommand(Command):
+    name = "probe_peers"
+    label = "Check which Electrum peers are alive and save their scores to the peer cache."
+
+    def run(self, prog, args):
+        parser = argparse.ArgumentParser(prog, description=self.label)
+        parser.add_argument(
+            '-w', '--workers', type=IntValidator(1), default=16,
+            help='Number of peers to probe in parallel.')
+        parser.add_argument(
+            '-t', '--timeout', type=IntValidator(1), default=5,
+            help='Timeout of a probe in seconds.')
+        parser.add_argument(
+            '-p', '--protocol', choices=[protocol.value for protocol in stratum.Protocol],
+            help='Probe only peers of the given protocol.')
+        args = parser.parse_args(args)
+
+        cache = discovery.PeerCache(os.path.join(os.path.abspath("."), "peers.json"))
+        peer_list = discovery.load_peer_list(cache)
+        protocol = stratum.Protocol(args.protocol) if args.protocol else None
+
+        def print_result(result):
+            if result.error:
+                print("dead  {}    {}".format(result.peer, result.error))
+            else:
+                print("{:.3f} {}    {}".format(result.rtt, result.peer, result.server_version))
+
+        results = prober.PeerProber(args.timeout, args.workers).probe_all(
+            peer_list.list_peers(protocol), print_result)
+        cache.save(peer_list.list_peers())
+
+        alive = sum(1 for result in results if not result.error)
+        print("\n{} of {} peers are alive.".format(alive, len(results)))
+        return 0 if alive else 1